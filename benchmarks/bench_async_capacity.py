@@ -0,0 +1,65 @@
+"""
+Concurrent-connection capacity: gunicorn+gevent (Flask) vs the ASGI serving mode.
+
+    python -m benchmarks.bench_async_capacity --concurrency 100,500,1000 --hold 5
+
+Each level opens N simultaneous /api/chat/doc requests against a fake engine
+that holds every query for --hold seconds. While all of them are in flight
+the worker's RSS and thread count are sampled, which gives memory per
+in-flight request. Requires gunicorn, gevent, uvicorn, starlette and a2wsgi.
+"""
+
+import time
+import asyncio
+import argparse
+
+from .harness import run_server, worker_pids, proc_stats, http_request, percentile
+
+
+async def load(base_url, concurrency, hold, sample):
+    async def one(i):
+        try:
+            status, _, _, _, elapsed = await http_request(
+                base_url, "POST", "/api/chat/doc", {"message": f"Tenable_io {i}"})
+            return status, elapsed
+        except Exception:
+            return 0, None
+
+    tasks = [asyncio.create_task(one(i)) for i in range(concurrency)]
+    await asyncio.sleep(hold / 2)
+    loaded = sample()
+    results = await asyncio.gather(*tasks)
+    return results, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", default="100,500,1000")
+    parser.add_argument("--hold", type=float, default=5.0, help="fake engine seconds per query")
+    parser.add_argument("--modes", default="gevent,asgi")
+    args = parser.parse_args()
+
+    levels = [int(c) for c in args.concurrency.split(",")]
+    fake_env = {"FAKE_ENGINE_QUERY_LATENCY": str(args.hold), "FAKE_ENGINE_SESSION_LATENCY": "0.05"}
+    print(f"{'mode':<7} {'conc':>5} {'ok':>5} {'p50 s':>7} {'p99 s':>7} {'idle MiB':>9} "
+          f"{'load MiB':>9} {'KiB/req':>8} {'threads':>8}")
+    for mode in args.modes.split(","):
+        with run_server(mode, fake_env=fake_env) as (base_url, master_pid):
+            # Warm up: imports, engine handle, first session
+            asyncio.run(http_request(base_url, "POST", "/api/chat/doc", {"message": "warmup"}))
+            for concurrency in levels:
+                pids = worker_pids(master_pid)
+                idle_rss, _ = proc_stats(pids)
+                started = time.monotonic()
+                results, (load_rss, threads) = asyncio.run(
+                    load(base_url, concurrency, args.hold, lambda: proc_stats(pids)))
+                ok = [elapsed for status, elapsed in results if status == 200]
+                per_request = (load_rss - idle_rss) / concurrency
+                print(f"{mode:<7} {concurrency:>5} {len(ok):>5} {percentile(ok, 50) or 0:>7.2f} "
+                      f"{percentile(ok, 99) or 0:>7.2f} {idle_rss / 1024:>9.1f} {load_rss / 1024:>9.1f} "
+                      f"{per_request:>8.1f} {threads:>8}")
+                time.sleep(max(0.0, args.hold - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Recall@k of the local retrieval index, against labels or against Vertex AI RAG.
+
+    python -m benchmarks.bench_retrieval_recall --queries 200
+    python -m benchmarks.bench_retrieval_recall --reference vertex --queries 50
+
+Both sides are compared at the data source level, since the Vertex corpus
+chunks the document differently. With `--reference labels` (offline) every
+query names one data source and a hit means that source is in the local top k.
+With `--reference vertex` the sources of the Vertex top k (RAG_CORPUS, same
+top_k/threshold as the agent) are the relevant set; each Vertex context is
+attributed to the local chunk it overlaps most.
+"""
+
+import os
+import time
+import random
+import argparse
+
+from benchmarks.harness import percentile
+from ingestion_doc_tool.local_retrieval import local_index, name_index, tokenize
+
+KS = (1, 5, 10)
+TEMPLATES = [
+    "How do I ingest {name} logs into Cortex XSIAM?",
+    "{name}",
+    "Create a change request to onboard {name}",
+]
+
+
+def labelled_queries(n, seed):
+    rng = random.Random(seed)
+    # Marketplace data source names; README pages are titled by their opening sentence
+    sources = sorted(name_index.names.values())
+    picked = rng.sample(sources, min(n, len(sources)))
+    return [(rng.choice(TEMPLATES).format(name=name.replace("_", " ")), {name}) for name in picked]
+
+
+def attribute(text):
+    """Data source of the local chunk sharing the most tokens with `text`"""
+    tokens = set(tokenize(text))
+    best = max(local_index.chunks, key=lambda chunk: len(tokens & set(tokenize(chunk["text"]))))
+    return best["source"]
+
+
+def vertex_queries(queries, k):
+    import vertexai
+    from vertexai.preview import rag
+
+    vertexai.init(project=os.getenv("GOOGLE_CLOUD_PROJECT"), location=os.getenv("GOOGLE_CLOUD_LOCATION"))
+    resources = [rag.RagResource(rag_corpus=os.environ["RAG_CORPUS"])]
+    out = []
+    for query, _ in queries:
+        started = time.perf_counter()
+        response = rag.retrieval_query(
+            rag_resources=resources, text=query, similarity_top_k=k, vector_distance_threshold=0.6
+        )
+        latency = (time.perf_counter() - started) * 1000
+        relevant = {attribute(context.text) for context in response.contexts.contexts}
+        out.append((query, relevant, latency))
+    return out
+
+
+def evaluate(queries, mode):
+    recall = {k: [] for k in KS}
+    latencies = []
+    for query, relevant in queries:
+        started = time.perf_counter()
+        named = name_index.match(query)[0] if mode == "name" else None
+        if named is not None:
+            sources = [named]
+        else:
+            results = local_index.search(query, k=max(KS), mode="bm25" if mode == "name" else mode)
+            sources = [local_index.chunks[doc]["source"] for doc, _ in results]
+        latencies.append((time.perf_counter() - started) * 1000)
+        for k in KS:
+            recall[k].append(len(relevant & set(sources[:k])) / len(relevant) if relevant else 1.0)
+    return {k: sum(v) / len(v) for k, v in recall.items()}, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reference", choices=["labels", "vertex"], default="labels")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    queries = labelled_queries(args.queries, args.seed)
+    if args.reference == "vertex":
+        scored = vertex_queries(queries, max(KS))
+        queries = [(query, relevant) for query, relevant, _ in scored]
+        remote = [latency for _, _, latency in scored]
+        print(f"vertex rag: p50 {percentile(remote, 50):.1f} ms  p95 {percentile(remote, 95):.1f} ms")
+
+    # name: the name index first, BM25 only when no data source name matches
+    modes = ["bm25"] + (["dense", "hybrid"] if local_index.dense is not None else []) + ["name"]
+    print(f"{len(queries)} queries, reference={args.reference}, {len(local_index.chunks)} local chunks")
+    for mode in modes:
+        recall, latencies = evaluate(queries, mode)
+        cells = "  ".join(f"recall@{k} {recall[k]:.3f}" for k in KS)
+        print(f"{mode:>7}: {cells}  p50 {percentile(latencies, 50):.2f} ms  p95 {percentile(latencies, 95):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
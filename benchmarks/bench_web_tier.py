@@ -0,0 +1,261 @@
+"""
+Web-tier latency and throughput against a fake Agent Engine, with saved baselines.
+
+    python -m benchmarks.bench_web_tier --scenarios chat,stream,batch
+    python -m benchmarks.bench_web_tier --save-baseline
+    python -m benchmarks.bench_web_tier --check     # exit 1 on a regression
+
+Runs the real Flask app under gunicorn+gevent with AGENT_ENGINE_BACKEND=fake.
+The fake engine's latency distribution, chunk rate and error rates come from
+the flags. The response cache is off, so every request reaches the engine.
+  chat:    --requests POSTs to /api/chat/<key> from --concurrency clients
+  stream:  the same against /api/chat/<key>/stream; first-token time is read
+           from the `done` frame
+  batch:   one --rows row CSV through /api/batch_chat/<key>, polled until done
+The gunicorn master and workers are sampled every 100 ms for RSS and threads.
+
+Results are keyed by service and scenario. --save-baseline writes them to
+benchmarks/baselines/web_tier.json. --check compares a run against that file
+when the flags match and flags any metric more than --tolerance worse.
+Requires gunicorn and gevent.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+from .harness import PeakSampler, http_request, multipart, percentile, run_server
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "web_tier.json")
+ENGINE_KEYS = {"doc-spl": "doc", "dm-gen": "dmgen"}
+# metric -> True when higher is better
+METRICS = {
+    "p50_s": False, "p95_s": False, "p99_s": False, "first_token_p95_s": False,
+    "requests_per_s": True, "rows_per_s": True, "error_rate": False,
+    "peak_rss_mib": False, "peak_threads": False,
+}
+# Differences below these are noise whatever the tolerance
+ABSOLUTE_SLACK = {"p50_s": 0.01, "p95_s": 0.02, "p99_s": 0.05, "first_token_p95_s": 0.02,
+                  "error_rate": 0.01, "peak_rss_mib": 5, "peak_threads": 4}
+
+
+async def closed_loop(requests, concurrency, send):
+    """Run `send(i)` for `requests` indexes from `concurrency` clients; returns the results and wall time"""
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+    results = []
+
+    async def client():
+        while not queue.empty():
+            results.append(await send(queue.get_nowait()))
+
+    started = time.monotonic()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return results, time.monotonic() - started
+
+
+def latency_summary(latencies, total, wall):
+    return {
+        "ok": len(latencies),
+        "error_rate": round(1 - len(latencies) / total, 4) if total else 0.0,
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "p99_s": percentile(latencies, 99),
+        "requests_per_s": round(len(latencies) / wall, 2) if wall else None,
+    }
+
+
+async def chat(base_url, key, args):
+    async def send(i):
+        try:
+            status, _, _, _, elapsed = await http_request(
+                base_url, "POST", f"/api/chat/{key}", {"message": f"Tenable_io bench {i}"})
+            return elapsed if status == 200 else None
+        except Exception:
+            return None
+
+    results, wall = await closed_loop(args.requests, args.concurrency, send)
+    return latency_summary([r for r in results if r is not None], args.requests, wall)
+
+
+async def stream(base_url, key, args):
+    async def send(i):
+        try:
+            status, _, body, _, elapsed = await http_request(
+                base_url, "POST", f"/api/chat/{key}/stream", {"message": f"Tenable_io bench {i}"})
+        except Exception:
+            return None
+        for frame in body.decode(errors="replace").split("\n\n"):
+            if status == 200 and frame.startswith("event: done"):
+                done = json.loads(frame.split("data: ", 1)[1])
+                return elapsed, (done.get("first_token_ms") or 0) / 1000
+        return None
+
+    results, wall = await closed_loop(args.requests, args.concurrency, send)
+    ok = [r for r in results if r is not None]
+    summary = latency_summary([elapsed for elapsed, _ in ok], args.requests, wall)
+    summary["first_token_p95_s"] = percentile([first for _, first in ok], 95)
+    return summary
+
+
+async def batch(base_url, key, args):
+    rows = "".join(f"Tenable_io bench row {i}\n" for i in range(args.rows)).encode()
+    body, headers = multipart("file", "bench.csv", rows)
+    started = time.monotonic()
+    status, _, content, _, _ = await http_request(base_url, "POST", f"/api/batch_chat/{key}", body, headers)
+    if status != 200:
+        raise RuntimeError(f"batch upload failed with {status}: {content[:200]!r}")
+    status_url = json.loads(content)["status_url"]
+    while True:
+        await asyncio.sleep(0.2)
+        _, _, content, _, _ = await http_request(base_url, "GET", status_url)
+        job = json.loads(content)
+        if job["status"] in ("completed", "failed"):
+            break
+    wall = time.monotonic() - started
+    return {
+        "ok": job["rows_done"] - job["rows_failed"],
+        "error_rate": round(job["rows_failed"] / args.rows, 4) if args.rows else 0.0,
+        "rows_per_s": round(args.rows / wall, 2),
+        "wall_s": round(wall, 2),
+    }
+
+
+SCENARIOS = {"chat": chat, "stream": stream, "batch": batch}
+
+
+def fake_engine_env(args):
+    return {
+        "RESPONSE_CACHE_ENABLED": "false",
+        "FAKE_ENGINE_QUERY_LATENCY": str(args.latency),
+        "FAKE_ENGINE_LATENCY_DISTRIBUTION": args.distribution,
+        "FAKE_ENGINE_LATENCY_SPREAD": str(args.spread),
+        "FAKE_ENGINE_SESSION_LATENCY": str(args.session_latency),
+        "FAKE_ENGINE_STREAM_CHUNKS": str(args.chunks),
+        "FAKE_ENGINE_CHUNK_INTERVAL": str(args.chunk_interval),
+        "FAKE_ENGINE_ERROR_RATE": str(args.error_rate),
+        "FAKE_ENGINE_STREAM_ERROR_RATE": str(args.stream_error_rate),
+    }
+
+
+def run(args):
+    """{"<service>/<scenario>": metrics} for one benchmark run"""
+    key = ENGINE_KEYS[args.service]
+    results = {}
+    with run_server("gevent", args.service, workers=args.workers, fake_env=fake_engine_env(args)) as (base_url, pid):
+        # Warm up: imports, engine handle, first session
+        asyncio.run(http_request(base_url, "POST", f"/api/chat/{key}", {"message": "warmup"}))
+        for name in args.scenarios.split(","):
+            with PeakSampler(pid) as sampler:
+                metrics = asyncio.run(SCENARIOS[name](base_url, key, args))
+            metrics["peak_rss_mib"] = round(sampler.peak_rss / 1024, 1)
+            metrics["peak_threads"] = sampler.peak_threads
+            results[f"{args.service}/{name}"] = metrics
+    return results
+
+
+def config_of(args):
+    """Flags that change the numbers; a baseline only applies to runs with the same ones"""
+    return {
+        name: getattr(args, name)
+        for name in ("workers", "concurrency", "requests", "rows", "latency", "distribution", "spread",
+                     "session_latency", "chunks", "chunk_interval", "error_rate", "stream_error_rate")
+    }
+
+
+def regressions(results, baseline, tolerance):
+    """[(scenario, metric, baseline value, current value)] for metrics worse than the baseline allows"""
+    found = []
+    for scenario, metrics in results.items():
+        reference = baseline.get(scenario, {})
+        for metric, higher_is_better in METRICS.items():
+            old, new = reference.get(metric), metrics.get(metric)
+            if old is None or new is None:
+                continue
+            slack = max(abs(old) * tolerance, ABSOLUTE_SLACK.get(metric, 0))
+            worse = new < old - slack if higher_is_better else new > old + slack
+            if worse:
+                found.append((scenario, metric, old, new))
+    return found
+
+
+def load_baselines(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(results, config, path=BASELINE_PATH):
+    baselines = load_baselines(path)
+    for scenario, metrics in results.items():
+        baselines[scenario] = {"config": config, "metrics": metrics, "recorded": time.strftime("%Y-%m-%d")}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def print_results(results):
+    columns = ["ok", "error_rate", "p50_s", "p95_s", "p99_s", "first_token_p95_s",
+               "requests_per_s", "rows_per_s", "peak_rss_mib", "peak_threads"]
+    print(f"{'scenario':<16}" + "".join(f"{c:>18}" for c in columns))
+    for scenario, metrics in results.items():
+        cells = []
+        for column in columns:
+            value = metrics.get(column)
+            cells.append(f"{'-' if value is None else round(value, 3):>18}")
+        print(f"{scenario:<16}" + "".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--service", choices=sorted(ENGINE_KEYS), default="doc-spl")
+    parser.add_argument("--scenarios", default="chat,stream,batch")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent chat clients")
+    parser.add_argument("--requests", type=int, default=500, help="chat requests per scenario")
+    parser.add_argument("--rows", type=int, default=300, help="rows in the batch CSV")
+    parser.add_argument("--latency", type=float, default=0.5, help="median fake engine seconds to first token")
+    parser.add_argument("--distribution", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--spread", type=float, default=0.4, help="uniform +/- fraction or lognormal sigma")
+    parser.add_argument("--session-latency", type=float, default=0.05)
+    parser.add_argument("--chunks", type=int, default=20, help="streamed chunks per reply")
+    parser.add_argument("--chunk-interval", type=float, default=0.02, help="seconds between chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--stream-error-rate", type=float, default=0.0)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="exit 1 when a metric regressed against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    results = run(args)
+    print_results(results)
+    config = config_of(args)
+
+    if args.save_baseline:
+        save_baseline(results, config, args.baseline)
+        print(f"Saved baseline to {args.baseline}")
+    if args.check:
+        baselines = load_baselines(args.baseline)
+        comparable = {
+            scenario: entry["metrics"] for scenario, entry in baselines.items() if entry.get("config") == config
+        }
+        if not comparable:
+            print(f"No baseline in {args.baseline} was recorded with these flags; run with --save-baseline first")
+            sys.exit(2)
+        found = regressions(results, comparable, args.tolerance)
+        for scenario, metric, old, new in found:
+            print(f"REGRESSION {scenario} {metric}: {old} -> {new}")
+        if found:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Cost of the offline XQL check per SPL->XQL answer.
+
+    python -m benchmarks.bench_xql_validation --answers 20000
+    python -m benchmarks.bench_xql_validation --results results/<job_id>.jsonl
+
+Synthetic answers mix prose, fenced and bare queries of 3-12 stages, a share
+of them with SPL left in (--invalid). With --results the outputs of a
+finished spl batch job (CSV or JSONL result file) are checked instead, which
+also shows how many of its translations would have gone to a repair turn.
+The check runs once per engine answer, so its p99 is what a batch row pays.
+"""
+
+import csv
+import json
+import time
+import random
+import argparse
+
+from benchmarks.harness import percentile
+from web_common.xql_validator import check_answer
+
+FIELDS = ["action_local_ip", "agent_hostname", "actor_effective_username", "action_remote_port", "event_type",
+          "action_file_path", "dst_ip", "src_ip", "user", "url"]
+STAGES = [
+    lambda rng: f'filter {rng.choice(FIELDS)} = "{rng.randint(1, 9999)}" and {rng.choice(FIELDS)} != null',
+    lambda rng: f'filter {rng.choice(FIELDS)} in ("a", "b", "c") or incidr({rng.choice(FIELDS)}, "10.0.0.0/8")',
+    lambda rng: f'alter d = format_timestamp("%Y-%m-%d", _time), n = to_integer({rng.choice(FIELDS)})',
+    lambda rng: f"comp count() as c, count_distinct({rng.choice(FIELDS)}) as u by {rng.choice(FIELDS)}",
+    lambda rng: f"fields {', '.join(rng.sample(FIELDS, 3))}",
+    lambda rng: f"sort desc {rng.choice(FIELDS)}",
+    lambda rng: f"limit {rng.randint(1, 1000)}",
+    lambda rng: f"dedup {rng.choice(FIELDS)}",
+]
+SPL_STAGES = [
+    lambda rng: f"stats dc({rng.choice(FIELDS)}) by {rng.choice(FIELDS)}",
+    lambda rng: f'eval t = strftime(_time, "%Y")',
+    lambda rng: f"head {rng.randint(1, 100)}",
+]
+
+
+def synthetic_answers(n, invalid, seed):
+    rng = random.Random(seed)
+    answers = []
+    for _ in range(n):
+        stages = [rng.choice(STAGES)(rng) for _ in range(rng.randint(2, 11))]
+        if rng.random() < invalid:
+            stages.insert(rng.randrange(len(stages)), rng.choice(SPL_STAGES)(rng))
+        query = " | ".join([f"dataset = {rng.choice(['xdr_data', 'panw_ngfw_traffic_raw'])}"] + stages)
+        if rng.random() < 0.5:
+            query = query.replace(" | ", "\n| ")
+        answers.append(rng.choice([
+            query,
+            f"```xql\n{query}\n```",
+            f"Here is the XQL translation:\n\n```xql\n{query}\n```\n\nIt keeps the original filters and grouping.",
+        ]))
+    return answers
+
+
+def result_answers(path):
+    with open(path, newline="") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line)["output"] for line in f if line.strip()]
+        return [row[1] for row in list(csv.reader(f))[1:] if len(row) > 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--answers", type=int, default=10000)
+    parser.add_argument("--invalid", type=float, default=0.2, help="share of synthetic answers with SPL left in")
+    parser.add_argument("--results", help="result file of an spl batch job to check instead")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    answers = result_answers(args.results) if args.results else synthetic_answers(args.answers, args.invalid, args.seed)
+    latencies, failing = [], 0
+    started = time.perf_counter()
+    for answer in answers:
+        t = time.perf_counter()
+        failing += bool(check_answer(answer))
+        latencies.append((time.perf_counter() - t) * 1000)
+    elapsed = time.perf_counter() - started
+
+    print(f"{len(answers)} answers, {failing} would get a repair turn ({failing / max(len(answers), 1):.1%})")
+    print(f"p50 {percentile(latencies, 50):.3f} ms  p95 {percentile(latencies, 95):.3f} ms  "
+          f"p99 {percentile(latencies, 99):.3f} ms  {len(answers) / elapsed:,.0f} answers/s")
+
+
+if __name__ == "__main__":
+    main()
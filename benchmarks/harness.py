@@ -0,0 +1,210 @@
+"""
+Shared plumbing for the offline web-tier benchmarks.
+
+Starts one of the Flask services under gunicorn with AGENT_ENGINE_BACKEND=fake,
+drives it with a dependency-free asyncio HTTP client and samples the worker
+processes' RSS and thread counts from /proc.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import uuid
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+APP_DIRS = {"doc-spl": "web_app_doc_spl", "dm-gen": "web_app_dm_gen"}
+WORKER_CLASSES = {
+    "gevent": ("gevent", "app:app"),
+    "asgi": ("uvicorn.workers.UvicornWorker", "asgi:app"),
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def run_server(mode="gevent", service="doc-spl", workers=1, fake_env=None):
+    """Run a service under gunicorn in a scratch directory; yields (base_url, master_pid)"""
+    worker_class, target = WORKER_CLASSES[mode]
+    port = free_port()
+    with tempfile.TemporaryDirectory(prefix="xsiam-bench-") as scratch:
+        env = dict(os.environ)
+        env.update({
+            "AGENT_ENGINE_BACKEND": "fake",
+            "DOC_AGENT_ENGINE_ID": "fake-doc",
+            "SPL_AGENT_ENGINE_ID": "fake-spl",
+            "DM_AGENT_ENGINE_ID": "fake-dmgen",
+            "SCHEDULER_STATE_DIR": os.path.join(scratch, "scheduler"),
+            "METRICS_DIR": os.path.join(scratch, "metrics"),
+            "RATE_LIMIT_PROJECT_RPM": "0",
+            "RATE_LIMIT_ENGINE_RPM": "0",
+        })
+        env.update(fake_env or {})
+        cmd = [
+            sys.executable, "-m", "gunicorn", "-w", str(workers), "-k", worker_class,
+            "-b", f"127.0.0.1:{port}", "--timeout", "3600", "--backlog", "4096",
+            "--pythonpath", os.path.join(REPO_ROOT, APP_DIRS[service]), target,
+        ]
+        # cwd is the scratch dir so job_status/ and results/ don't land in the repo
+        # Server logs go to a file: an unread pipe fills up and blocks the worker mid-run
+        log_path = os.path.join(scratch, "server.log")
+        with open(log_path, "wb") as log:
+            proc = subprocess.Popen(cmd, cwd=scratch, env=env, stdout=subprocess.DEVNULL, stderr=log)
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            wait_ready(port, proc, log_path)
+            yield base_url, proc.pid
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def wait_ready(port, proc, log_path, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            with open(log_path, "rb") as f:
+                raise RuntimeError(f"server exited: {f.read().decode(errors='replace')[-2000:]}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def worker_pids(master_pid):
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == master_pid:
+            pids.append(int(entry))
+    return pids
+
+
+def proc_stats(pids):
+    """Summed RSS (KiB) and thread count of `pids`"""
+    rss = threads = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss += int(line.split()[1])
+                    elif line.startswith("Threads:"):
+                        threads += int(line.split()[1])
+        except OSError:
+            continue
+    return rss, threads
+
+
+async def http_request(base_url, method, path, body=None, headers=None, timeout=3600):
+    """Minimal HTTP/1.1 client; returns (status, headers, body bytes, seconds to first byte, total seconds)"""
+    host, port = base_url.split("//", 1)[1].split(":")
+    started = time.monotonic()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, int(port)), timeout)
+    payload = body if isinstance(body, bytes) else json.dumps(body).encode() if body is not None else b""
+    head = [f"{method} {path} HTTP/1.1", f"Host: {host}", "Connection: close", f"Content-Length: {len(payload)}"]
+    if body is not None and not isinstance(body, bytes):
+        head.append("Content-Type: application/json")
+    head += [f"{k}: {v}" for k, v in (headers or {}).items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + payload)
+    await writer.drain()
+    try:
+        first = await asyncio.wait_for(reader.read(1), timeout)
+        ttfb = time.monotonic() - started
+        rest = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    raw = first + rest
+    header_blob, _, content = raw.partition(b"\r\n\r\n")
+    lines = header_blob.decode(errors="replace").split("\r\n")
+    status = int(lines[0].split()[1]) if lines and len(lines[0].split()) > 1 else 0
+    response_headers = {}
+    for line in lines[1:]:
+        key, _, value = line.partition(":")
+        response_headers[key.strip().lower()] = value.strip()
+    if response_headers.get("transfer-encoding") == "chunked":
+        content = dechunk(content)
+    return status, response_headers, content, ttfb, time.monotonic() - started
+
+
+def multipart(field, filename, content, content_type="text/csv"):
+    """(body, headers) of a multipart/form-data upload of one file"""
+    boundary = f"bench{uuid.uuid4().hex}"
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    return body, {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+class PeakSampler:
+    """Samples RSS and thread count of a gunicorn master and its workers in the background, keeping the peaks"""
+
+    def __init__(self, master_pid, interval=0.1):
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peak_rss = 0  # KiB
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self):
+        rss, threads = proc_stats([self.master_pid] + worker_pids(self.master_pid))
+        self.peak_rss = max(self.peak_rss, rss)
+        self.peak_threads = max(self.peak_threads, threads)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def dechunk(data):
+    out = bytearray()
+    while data:
+        size_line, _, data = data.partition(b"\r\n")
+        size = int(size_line.split(b";")[0] or b"0", 16)
+        if size == 0:
+            break
+        out += data[:size]
+        data = data[size + 2:]
+    return bytes(out)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[k]
@@ -15,7 +15,7 @@
 import vertexai
 from vertexai import agent_engines
 from vertexai.preview.reasoning_engines import AdkApp
-from ingestion_doc_tool.agent import root_agent
+from ingestion_doc_tool.agent import deployment_env_vars, root_agent
 import logging
 import os
 from dotenv import set_key
@@ -55,7 +55,7 @@ logging.debug("deploying agent to agent engine:")
 remote_app = agent_engines.create(
     app,
     requirements=[
-        "google-cloud-aiplatform[adk,agent-engines]==1.88.0",
+        "google-cloud-aiplatform[adk,agent-engines]==1.94.0",
         "google-adk",
         "python-dotenv",
         "google-auth",
@@ -66,6 +66,7 @@ remote_app = agent_engines.create(
     extra_packages=[
         "./ingestion_doc_tool"  # Ensure this path is correct relative to the script,
     ],
+    env_vars=deployment_env_vars(),
 )
 
 # log remote_app
@@ -7,7 +7,7 @@ from dotenv import load_dotenv
 from vertexai import agent_engines
 from vertexai.preview import reasoning_engines
 
-from ingestion_doc_tool.agent import root_agent
+from ingestion_doc_tool.agent import deployment_env_vars, root_agent
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string("project_id", None, "GCP project ID.")
@@ -62,6 +62,7 @@ def create() -> None:
             "llama-index",
         ],
         extra_packages=["./ingestion_doc_tool"],
+        env_vars=deployment_env_vars(),
     )
     print(f"Created remote app: {remote_app.resource_name}")
 
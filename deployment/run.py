@@ -1,4 +1,5 @@
 import os
+import sys
 import vertexai
 from vertexai import agent_engines
 from google.adk.sessions import VertexAiSessionService
@@ -7,13 +8,18 @@ import json
 
 import asyncio
 
-def pretty_print_event(event):
-    """Pretty prints an event with truncation for long content."""
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from web_common import tracing
+
+def pretty_print_event(event, elapsed=None):
+    """Pretty prints an event with truncation for long content, prefixed with seconds since the query was sent."""
     if "content" not in event:
         print(f"[{event.get('author', 'unknown')}]: {event}")
         return
         
     author = event.get("author", "unknown")
+    if elapsed is not None:
+        author = f"+{elapsed:.2f}s {author}"
     parts = event["content"].get("parts", [])
     
     for part in parts:
@@ -62,11 +68,19 @@ queries = [
 ]
 
 
+# Set TRACE_DIR to also keep the spans; summarize them with `python -m web_common.tracing`
+tracing.configure("run")
+
 for query in queries:
     print(f"\n[user]: {query}")
-    for event in agent_engine.stream_query(
+    trace = tracing.Trace()
+    for event in trace.stream(agent_engine.stream_query(
         user_id="123",
         session_id=session.id,
         message=query,
-    ):
-        print(event)
+    )):
+        pretty_print_event(event, elapsed=trace.last_offset)
+    tools = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in trace.seconds("tool").items()) or "none"
+    print(f"[timing]: total {trace.now():.2f}s, generation {sum(trace.seconds('generation').values()):.2f}s, "
+          f"tools: {tools}")
+    tracing.export(trace.records(query=query[:100]))
@@ -15,38 +15,67 @@
 import os
 
 from google.adk.agents import Agent
-from google.adk.tools.retrieval.vertex_ai_rag_retrieval import VertexAiRagRetrieval
-from vertexai.preview import rag
 
 from dotenv import load_dotenv
 from .prompts import return_instructions_root
+from .context_budget import budget_prompt, report_usage
 
 load_dotenv()
 
-ask_vertex_retrieval = VertexAiRagRetrieval(
-    name='retrieve_rag_documentation',
-    description=(
-        'Use this tool to retrieve documentation and reference materials for the question from the RAG corpus,'
-    ),
-    rag_resources=[
-        rag.RagResource(
-            # please fill in your own rag corpus
-            # here is a sample rag corpus for testing purpose
-            # e.g. projects/123/locations/us-central1/ragCorpora/456
-            rag_corpus=os.environ.get("RAG_CORPUS")
-        )
-    ],
-    similarity_top_k=10,
-    vector_distance_threshold=0.6,
+# vertex: Vertex AI RAG Engine corpus (RAG_CORPUS); local: in-process index over the shipped corpus
+RAG_BACKEND = os.environ.get("RAG_BACKEND", "vertex")
+# Settings read on import. A deployed agent is re-imported remotely without the local .env, so they go with it
+DEPLOYED_ENV_VARS = (
+    "RAG_BACKEND", "RAG_CORPUS", "RETRIEVAL_CACHE_ENABLED", "RETRIEVAL_CACHE_MAX_BYTES",
+    "RETRIEVAL_CACHE_VERSION_INTERVAL", "LOCAL_RAG_TOP_K", "LOCAL_RAG_MODE", "LOCAL_RAG_INDEX_DIR", "CHUNK_TOKENS",
+    "NAME_INDEX_MAX_CHARS", "NAME_INDEX_FUZZY_THRESHOLD", "NAME_INDEX_FUZZY_MARGIN",
+    "CONTEXT_BUDGET_TOKENS", "RETRIEVAL_BUDGET_TOKENS", "KEEP_RECENT_TURNS",
 )
 
 
+def deployment_env_vars(environ=os.environ):
+    """`env_vars` for agent_engines.create(); the vertex backend cannot be deployed without RAG_CORPUS"""
+    env = {name: environ[name] for name in DEPLOYED_ENV_VARS if environ.get(name)}
+    if env.get("RAG_BACKEND", "vertex") != "local" and not env.get("RAG_CORPUS"):
+        raise ValueError("RAG_CORPUS environment variable not set. Please set it in your .env file.")
+    return env
+
+
+if RAG_BACKEND == "local":
+    from .local_retrieval import retrieve_rag_documentation as retrieval_tool
+elif os.environ.get("RETRIEVAL_CACHE_ENABLED", "true").lower() == "true":
+    # Same corpus, top_k and threshold as below, with results cached per query
+    from .retrieval_cache import retrieve_rag_documentation as retrieval_tool
+else:
+    from google.adk.tools.retrieval.vertex_ai_rag_retrieval import VertexAiRagRetrieval
+    from vertexai.preview import rag
+
+    retrieval_tool = VertexAiRagRetrieval(
+        name='retrieve_rag_documentation',
+        description=(
+            'Use this tool to retrieve documentation and reference materials for the question from the RAG corpus,'
+        ),
+        rag_resources=[
+            rag.RagResource(
+                # please fill in your own rag corpus
+                # here is a sample rag corpus for testing purpose
+                # e.g. projects/123/locations/us-central1/ragCorpora/456
+                rag_corpus=os.environ.get("RAG_CORPUS")
+            )
+        ],
+        similarity_top_k=10,
+        vector_distance_threshold=0.6,
+    )
+
+
 root_agent = Agent(
     model='gemini-2.5-pro',
     name='cortex_xsiam_data_ingestion_agent',
     description="Agent specialized in generating Documents for Cortex XSIAM data ingestion.",
     instruction=return_instructions_root(),
     tools=[
-        ask_vertex_retrieval,
-    ]
+        retrieval_tool,
+    ],
+    before_model_callback=budget_prompt,
+    after_model_callback=report_usage,
 )
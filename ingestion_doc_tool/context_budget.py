@@ -0,0 +1,199 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Prompt-size budget for multi-turn sessions.
+
+Every model call carries the instruction, the whole session history and every
+passage retrieve_rag_documentation returned so far, so follow-ups grow the
+prompt each turn. `budget_prompt` (a before_model_callback) measures the three
+parts and, before the request is sent:
+  1. keeps retrieved passages newest first up to RETRIEVAL_BUDGET_TOKENS and
+     replaces the rest with a note saying how many were dropped
+  2. if the prompt is still over CONTEXT_BUDGET_TOKENS, folds the oldest turns
+     (always keeping the last KEEP_RECENT_TURNS) into one extractive summary:
+     each question and the start of its answer
+
+Only the outgoing request is changed; the session keeps the full history.
+`report_usage` (an after_model_callback) logs the token counts Gemini reports
+next to the estimate, one line per model call.
+"""
+
+import os
+import json
+import logging
+
+from google.genai import types
+
+from .shared_libraries.chunk_corpus import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_BUDGET_TOKENS = int(os.getenv("CONTEXT_BUDGET_TOKENS", "60000"))
+RETRIEVAL_BUDGET_TOKENS = int(os.getenv("RETRIEVAL_BUDGET_TOKENS", "12000"))
+KEEP_RECENT_TURNS = int(os.getenv("KEEP_RECENT_TURNS", "2"))
+RETRIEVAL_TOOL = "retrieve_rag_documentation"
+SUMMARY_QUESTION_CHARS = 300
+SUMMARY_ANSWER_CHARS = 600
+
+
+def part_tokens(part):
+    if part.text:
+        return estimate_tokens(part.text)
+    if part.function_call:
+        return estimate_tokens(json.dumps(part.function_call.args or {}, default=str))
+    if part.function_response:
+        return estimate_tokens(json.dumps(part.function_response.response or {}, default=str))
+    return 0
+
+
+def content_tokens(content):
+    return sum(part_tokens(part) for part in content.parts or [])
+
+
+def instruction_tokens(llm_request):
+    instruction = llm_request.config.system_instruction if llm_request.config else None
+    if instruction is None:
+        return 0
+    if isinstance(instruction, str):
+        return estimate_tokens(instruction)
+    return content_tokens(instruction)
+
+
+def is_retrieval(part):
+    return bool(part.function_response) and part.function_response.name == RETRIEVAL_TOOL
+
+
+def passages_of(part):
+    """Retrieved passages of a retrieval response; ADK wraps a list return value as {"result": [...]}"""
+    result = (part.function_response.response or {}).get("result")
+    if isinstance(result, list):
+        return result
+    return [result] if result else []
+
+
+def retrieved_tokens(contents):
+    return sum(part_tokens(part) for content in contents for part in content.parts or [] if is_retrieval(part))
+
+
+def cap_retrievals(contents, budget=RETRIEVAL_BUDGET_TOKENS):
+    """Copy of `contents` keeping retrieved passages, newest first, within `budget` tokens"""
+    remaining = budget
+    capped = []
+    for content in reversed(contents):
+        parts = []
+        for part in content.parts or []:
+            if not is_retrieval(part):
+                parts.append(part)
+                continue
+            kept = []
+            passages = passages_of(part)
+            for passage in passages:
+                cost = estimate_tokens(str(passage))
+                if cost > remaining:
+                    break
+                kept.append(passage)
+                remaining -= cost
+            if len(kept) < len(passages):
+                kept.append(f"[{len(passages) - len(kept)} more passages omitted to fit the context budget]")
+            response = types.FunctionResponse(
+                id=part.function_response.id, name=part.function_response.name, response={"result": kept}
+            )
+            parts.append(types.Part(function_response=response))
+        capped.append(types.Content(role=content.role, parts=parts))
+    capped.reverse()
+    return capped
+
+
+def is_user_message(content):
+    return content.role == "user" and any(part.text for part in content.parts or [])
+
+
+def split_turns(contents):
+    """Contents grouped into turns, each starting at a user message"""
+    turns = []
+    for content in contents:
+        if not turns or is_user_message(content):
+            turns.append([])
+        turns[-1].append(content)
+    return turns
+
+
+def _text(content):
+    return " ".join(" ".join(part.text.split()) for part in content.parts or [] if part.text)
+
+
+def summarize_turns(turns):
+    """One user content standing in for `turns`: each question and the start of its answer"""
+    lines = ["Summary of earlier turns in this conversation (compacted to fit the context budget):"]
+    for turn in turns:
+        question = _text(turn[0])[:SUMMARY_QUESTION_CHARS]
+        answer = " ".join(_text(c) for c in turn[1:] if c.role == "model").strip()[:SUMMARY_ANSWER_CHARS]
+        lines.append(f"- User asked: {question}")
+        if answer:
+            lines.append(f"  You answered: {answer}")
+    return types.Content(role="user", parts=[types.Part(text="\n".join(lines))])
+
+
+def compact_history(contents, budget, keep=KEEP_RECENT_TURNS):
+    """Fold the oldest turns into a summary until the contents fit `budget` tokens"""
+    turns = split_turns(contents)
+    total = sum(content_tokens(c) for c in contents)
+    dropped = 0
+    while total > budget and len(turns) - dropped > keep:
+        total -= sum(content_tokens(c) for c in turns[dropped])
+        dropped += 1
+    if not dropped:
+        return contents
+    summary = summarize_turns(turns[:dropped])
+    return [summary] + [content for turn in turns[dropped:] for content in turn]
+
+
+def measure(llm_request):
+    instruction = instruction_tokens(llm_request)
+    retrieved = retrieved_tokens(llm_request.contents)
+    history = sum(content_tokens(c) for c in llm_request.contents) - retrieved
+    return {
+        "instruction": instruction,
+        "history": history,
+        "retrieved": retrieved,
+        "total": instruction + history + retrieved,
+        "turns": len(split_turns(llm_request.contents)),
+    }
+
+
+def budget_prompt(callback_context, llm_request):
+    """before_model_callback: fit the outgoing request into the token budget"""
+    before = measure(llm_request)
+    llm_request.contents = cap_retrievals(llm_request.contents)
+    history_budget = CONTEXT_BUDGET_TOKENS - before["instruction"]
+    llm_request.contents = compact_history(llm_request.contents, history_budget)
+    after = measure(llm_request)
+    logger.info(
+        f"Prompt tokens (estimated) invocation={callback_context.invocation_id} "
+        + " ".join(f"{key}={value}" for key, value in after.items())
+        + (f" compacted_from={before['total']}" if after["total"] < before["total"] else "")
+    )
+    return None
+
+
+def report_usage(callback_context, llm_response):
+    """after_model_callback: log the token counts Gemini reports for the call"""
+    usage = llm_response.usage_metadata
+    if usage is not None:
+        logger.info(
+            f"Prompt tokens (reported) invocation={callback_context.invocation_id} "
+            f"prompt={usage.prompt_token_count} response={usage.candidates_token_count} "
+            f"total={usage.total_token_count}"
+        )
+    return None
@@ -0,0 +1,260 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process retrieval over the shipped XSIAM marketplace corpus.
+
+An alternative to VertexAiRagRetrieval (select it with RAG_BACKEND=local) that
+answers `retrieve_rag_documentation` in milliseconds without a remote round
+trip. The index has two parts:
+  - BM25 over the chunk_corpus.py chunks of the marketplace text and README
+    pages, and of the Broker VM PDF once pdf_extract.py has run (pure Python)
+  - an optional dense matrix of hashed character-trigram vectors, searched
+    with a single NumPy mat-vec; only used when NumPy is installed
+
+With both available the rankings are merged with reciprocal rank fusion.
+Queries that name data sources get each named source's section directly from
+the name index (name_index.py); ranking is skipped when the query is nothing
+but names, and otherwise adds the best chunks of the other sources.
+Build the index ahead of time with shared_libraries/build_local_index.py;
+without a prebuilt index it is built from the corpus on import.
+"""
+
+import os
+import re
+import json
+import math
+import time
+import heapq
+import logging
+import zlib
+from collections import Counter, defaultdict
+
+from .name_index import load_name_index
+from .shared_libraries.chunk_corpus import CHUNK_TOKENS, PDF_CHUNKS_PATH, README_CORPUS_PATH, chunk_corpus
+
+try:
+    import numpy as np
+except ImportError:  # dense search is optional
+    np = None
+
+logger = logging.getLogger(__name__)
+
+SHARED_LIBRARIES = os.path.join(os.path.dirname(__file__), "shared_libraries")
+CORPUS_PATH = os.path.join(SHARED_LIBRARIES, "xsiam_marketplace_ingestion_method.txt")
+LOCAL_RAG_INDEX_DIR = os.getenv("LOCAL_RAG_INDEX_DIR", os.path.join(SHARED_LIBRARIES, "local_index"))
+LOCAL_RAG_TOP_K = int(os.getenv("LOCAL_RAG_TOP_K", "10"))
+# bm25 | dense | hybrid; hybrid falls back to bm25 when there is no dense matrix
+LOCAL_RAG_MODE = os.getenv("LOCAL_RAG_MODE", "hybrid")
+# A named section longer than this is narrowed to its best chunks instead of returned whole
+NAME_INDEX_MAX_CHARS = int(os.getenv("NAME_INDEX_MAX_CHARS", "20000"))
+
+DENSE_DIM = 4096
+RRF_K = 60
+# The data source name is the strongest signal; its tokens count this many times per chunk
+NAME_BOOST = 3
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORD = re.compile(r"[A-Za-z0-9]+")
+_CAMEL = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in into is it of on or that the this to what when "
+    "which with you your".split()
+)
+
+
+def tokenize(text):
+    """Lowercased words; CamelCase names also yield their parts ("AzureFirewall" -> azurefirewall, azure, firewall)"""
+    tokens = []
+    for word in _WORD.findall(text):
+        lower = word.lower()
+        if lower not in STOPWORDS:
+            tokens.append(lower)
+        parts = _CAMEL.findall(word)
+        if len(parts) > 1:
+            tokens.extend(p.lower() for p in parts if p.lower() not in STOPWORDS)
+    return tokens
+
+
+def load_chunks(path=CORPUS_PATH, readme_path=README_CORPUS_PATH, pdf_chunks_path=PDF_CHUNKS_PATH):
+    """
+    Structure-aware chunks of the marketplace text and the README pages it
+    lacks, plus the Broker VM PDF chunks when pdf_extract.py has written them
+    """
+    records = list(chunk_corpus(path, readme_path, budget=CHUNK_TOKENS))
+    if pdf_chunks_path and os.path.exists(pdf_chunks_path):
+        with open(pdf_chunks_path, encoding="utf-8") as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return [{"source": record["data_source"], "text": record["text"]} for record in records]
+
+
+def hashed_trigram_vector(text, dim=DENSE_DIM):
+    """L2-normalized bag of hashed character trigrams; a cheap offline embedding"""
+    vec = np.zeros(dim, dtype=np.float32)
+    for token in tokenize(text):
+        padded = f" {token} "
+        for i in range(len(padded) - 2):
+            vec[zlib.crc32(padded[i:i + 3].encode()) % dim] += 1.0
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+class LocalIndex:
+    def __init__(self, chunks, postings, doc_lengths, dense=None):
+        self.chunks = chunks
+        self.postings = postings  # term -> [[chunk index, term frequency], ...]
+        self.doc_lengths = doc_lengths
+        self.avg_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0
+        n = len(chunks)
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in postings.items()
+        }
+        self.dense = dense  # float32 matrix, one L2-normalized row per chunk, or None
+        self.by_source = defaultdict(set)
+        for i, chunk in enumerate(chunks):
+            self.by_source[chunk["source"]].add(i)
+
+    @classmethod
+    def build(cls, chunks, dense=True):
+        postings = defaultdict(list)
+        doc_lengths = []
+        for i, chunk in enumerate(chunks):
+            tokens = tokenize(chunk["text"]) + tokenize(chunk["source"]) * (NAME_BOOST - 1)
+            doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings[term].append([i, tf])
+        matrix = None
+        if dense and np is not None:
+            matrix = np.stack([hashed_trigram_vector(c["text"]) for c in chunks])
+        return cls(chunks, dict(postings), doc_lengths, matrix)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "bm25.json"), "w", encoding="utf-8") as f:
+            json.dump({"chunks": self.chunks, "postings": self.postings, "doc_lengths": self.doc_lengths}, f)
+        if self.dense is not None:
+            np.save(os.path.join(directory, "dense.npy"), self.dense)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, "bm25.json"), encoding="utf-8") as f:
+            data = json.load(f)
+        dense = None
+        dense_path = os.path.join(directory, "dense.npy")
+        if np is not None and os.path.exists(dense_path):
+            dense = np.load(dense_path)
+        return cls(data["chunks"], data["postings"], data["doc_lengths"], dense)
+
+    def bm25(self, query, k, docs=None):
+        """[(chunk index, score)] best first, optionally only among chunk indexes `docs`"""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc, tf in self.postings[term]:
+                if docs is not None and doc not in docs:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc] / self.avg_length)
+                scores[doc] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def dense_search(self, query, k, docs=None):
+        if self.dense is None:
+            return []
+        rows = np.fromiter(sorted(docs), dtype=np.int64) if docs is not None else np.arange(len(self.dense))
+        if not len(rows):
+            return []
+        sims = self.dense[rows] @ hashed_trigram_vector(query, self.dense.shape[1])
+        k = min(k, len(sims))
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return [(int(rows[i]), float(sims[i])) for i in top]
+
+    def search(self, query, k=LOCAL_RAG_TOP_K, mode=LOCAL_RAG_MODE, source=None):
+        """[(chunk index, score)] for the best `k` chunks, optionally from one data source"""
+        docs = self.by_source.get(source, set()) if source is not None else None
+        if mode == "dense" and self.dense is not None:
+            return self.dense_search(query, k, docs)
+        if mode != "hybrid" or self.dense is None:
+            return self.bm25(query, k, docs)
+        # Reciprocal rank fusion over a deeper candidate list from each ranker
+        fused = defaultdict(float)
+        for ranking in (self.bm25(query, k * 3, docs), self.dense_search(query, k * 3, docs)):
+            for rank, (doc, _) in enumerate(ranking):
+                fused[doc] += 1.0 / (RRF_K + rank + 1)
+        return heapq.nlargest(k, fused.items(), key=lambda item: item[1])
+
+
+def load_index(directory=LOCAL_RAG_INDEX_DIR, corpus_path=CORPUS_PATH):
+    """Prebuilt index from `directory`, or one built from the corpus when none exists"""
+    started = time.monotonic()
+    if os.path.exists(os.path.join(directory, "bm25.json")):
+        index = LocalIndex.load(directory)
+        origin = directory
+    else:
+        index = LocalIndex.build(load_chunks(corpus_path))
+        origin = corpus_path
+    logger.info(
+        f"Loaded local RAG index from {origin}: {len(index.chunks)} chunks, "
+        f"dense={'yes' if index.dense is not None else 'no'}, {(time.monotonic() - started) * 1000:.0f} ms"
+    )
+    return index
+
+
+local_index = load_index()
+name_index = load_name_index(os.path.join(LOCAL_RAG_INDEX_DIR, "name_index.json"))
+
+
+def named_source_passages(query):
+    """Passages for the data sources `query` names, or None to fall back to ranked search"""
+    hits, rest = name_index.lookup(query)
+    if not hits:
+        return None
+    logger.info(f"Name index match for {query[:80]!r}: {', '.join(f'{name} ({tier})' for name, tier, _ in hits)}")
+    # The sources share the room one section may take
+    budget = NAME_INDEX_MAX_CHARS // len(hits)
+    passages = []
+    for name, _, texts in hits:
+        if sum(len(text) for text in texts) <= budget:
+            passages.extend(texts)
+            continue
+        # Too large to pass whole: the best chunks of that source only
+        results = local_index.search(query, k=max(1, LOCAL_RAG_TOP_K // len(hits)), source=name)
+        if results:
+            passages.extend(local_index.chunks[doc]["text"] for doc, _ in results)
+        else:
+            passages.extend(text[:budget] for text in texts)
+    if tokenize(" ".join(rest)):
+        # The query asks about more than the named sources ("okta vs azure AD"): rank the rest of the corpus too
+        named = {name for name, _, _ in hits}
+        passages.extend(local_index.chunks[doc]["text"] for doc, _ in local_index.search(query)
+                        if local_index.chunks[doc]["source"] not in named)
+    return passages
+
+
+def retrieve_rag_documentation(query: str) -> list[str]:
+    """Use this tool to retrieve documentation and reference materials for the question from the RAG corpus.
+
+    Args:
+        query: The question or data source name to look up.
+
+    Returns:
+        The most relevant documentation passages, best match first.
+    """
+    passages = named_source_passages(query)
+    if passages is not None:
+        return passages
+    return [local_index.chunks[doc]["text"] for doc, _ in local_index.search(query)]
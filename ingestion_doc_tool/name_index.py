@@ -0,0 +1,230 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Data source name index: name -> byte ranges of its documentation.
+
+Most `doc` requests are just a product name ("Tenable_io"). Instead of ranking
+chunks, the names in a query are looked up in three tiers and each whole
+section is read straight out of the memory-mapped corpus file:
+  1. exact:  `# Data source name:` headers, ignoring case and punctuation
+  2. alias:  integration titles ("## Configure <title> on Cortex XSOAR"),
+             names without version/collector suffixes, and product names
+             of the README corpus pages that have no marketplace section
+             (chunk_corpus.readme_products, also their chunks' data source)
+  3. fuzzy:  character-trigram similarity against all names and aliases, only
+             for short queries with no exact or alias hit, and only when the
+             best name beats every other name by NAME_INDEX_FUZZY_MARGIN
+
+Targets are (file, start, end, format) with byte offsets. Marketplace sections
+are plain UTF-8 text. README pages are JSON string literals, which are ASCII in
+the shipped file and decoded on read.
+"""
+
+import os
+import re
+import json
+import mmap
+import logging
+from collections import defaultdict
+
+from .shared_libraries.chunk_corpus import CONFIGURE_TITLE, opening, readme_products
+
+logger = logging.getLogger(__name__)
+
+SHARED_LIBRARIES = os.path.join(os.path.dirname(__file__), "shared_libraries")
+MARKETPLACE_PATH = os.path.join(SHARED_LIBRARIES, "xsiam_marketplace_ingestion_method.txt")
+README_CORPUS_PATH = os.path.join(SHARED_LIBRARIES, "xsiam_readme_corpus.json")
+NAME_INDEX_FUZZY_THRESHOLD = float(os.getenv("NAME_INDEX_FUZZY_THRESHOLD", "0.6"))
+# A fuzzy hit must beat the runner-up name by this much; "Microsoft" is as close to MicrosoftECM as to Microsoft365
+NAME_INDEX_FUZZY_MARGIN = float(os.getenv("NAME_INDEX_FUZZY_MARGIN", "0.1"))
+# Longest run of words in a query that is tried as a name
+MAX_NAME_WORDS = 5
+
+_HEADER = re.compile(rb"^# Data source name: *(.+?) *\r?$", re.MULTILINE)
+_SUFFIX = re.compile(r"(?:event ?collector|v\d+|iam)$")
+_README_ENTRY = re.compile(rb'"data": (")')
+
+
+def name_key(text):
+    """'Tenable_io', 'tenable.io' and 'Tenable IO' all become 'tenableio'"""
+    return re.sub(r"[^a-z0-9]", "", text.lower())
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def dice(a, b):
+    """Dice coefficient of two trigram sets"""
+    return 2 * len(a & b) / (len(a) + len(b)) if a and b else 0.0
+
+
+def marketplace_targets(path):
+    """(name, start, end) byte ranges of every `# Data source name:` section, header included"""
+    with open(path, "rb") as f:
+        data = f.read()
+    headers = list(_HEADER.finditer(data))
+    for i, match in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(data)
+        yield match.group(1).decode("utf-8"), match.start(), end
+
+
+def readme_targets(path):
+    """(text, start, end) for each README page; the range covers the JSON string literal"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.isascii():
+        # Character offsets from the JSON decoder would not be byte offsets
+        logger.warning(f"{path} is not ASCII-escaped JSON; README pages are not indexed by name")
+        return
+    text = data.decode("ascii")
+    decoder = json.JSONDecoder()
+    for match in _README_ENTRY.finditer(data):
+        value, end = decoder.raw_decode(text, match.start(1))
+        yield value, match.start(1), end
+
+
+class NameIndex:
+    def __init__(self, names, aliases, targets, root=SHARED_LIBRARIES):
+        self.root = root  # directory holding the target files
+        self.names = names  # key -> canonical data source name
+        self.aliases = aliases  # alias key -> canonical name
+        self.targets = targets  # canonical name -> [[file, start, end, format], ...]
+        self._grams = {key: trigrams(key) for key in list(names) + list(aliases)}
+        self._maps = {}
+
+    @classmethod
+    def build(cls, marketplace_path=MARKETPLACE_PATH, readme_path=README_CORPUS_PATH):
+        names, aliases = {}, {}
+        targets = defaultdict(list)
+        sections = {}
+        for name, start, end in marketplace_targets(marketplace_path):
+            names[name_key(name)] = name
+            targets[name].append([os.path.basename(marketplace_path), start, end, "text"])
+            sections[name] = (start, end)
+
+        with open(marketplace_path, "rb") as f:
+            data = f.read()
+        for name, (start, end) in sections.items():
+            for title in CONFIGURE_TITLE.findall(data[start:end].decode("utf-8")):
+                aliases.setdefault(name_key(title), name)
+            stripped = _SUFFIX.sub("", name_key(name))
+            if stripped and stripped != name_key(name):
+                aliases.setdefault(stripped, name)
+
+        if readme_path and os.path.exists(readme_path):
+            # Pages that duplicate a marketplace section are already indexed by their header
+            bodies = {opening(data[s:e].decode("utf-8").split("\n", 1)[-1]) for s, e in sections.values()}
+            for text, start, end in readme_targets(readme_path):
+                if opening(text) in bodies:
+                    continue
+                target = [os.path.basename(readme_path), start, end, "json"]
+                for product in readme_products(text):
+                    key = name_key(product)
+                    canonical = names.get(key) or aliases.get(key) or product
+                    aliases.setdefault(key, canonical)
+                    if target not in targets[canonical]:
+                        targets[canonical].append(target)
+
+        # Exact names win over aliases that collide with them
+        aliases = {key: name for key, name in aliases.items() if key not in names}
+        return cls(names, aliases, dict(targets), root=os.path.dirname(marketplace_path))
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"names": self.names, "aliases": self.aliases, "targets": self.targets}, f)
+
+    @classmethod
+    def load(cls, path, root=SHARED_LIBRARIES):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["names"], data["aliases"], data["targets"], root=root)
+
+    def matches(self, query):
+        """
+        ([(canonical name, tier), ...], rest) for the data sources `query`
+        names, in query order, and the words that are not part of any name
+        """
+        words = re.findall(r"[\w.\-]+", query)
+        found = {}  # first word position -> (name, tier)
+        used = set()
+        # Longest run of words first, so "Okta EventCollector" beats "Okta"
+        for size in range(min(MAX_NAME_WORDS, len(words)), 0, -1):
+            for i in range(len(words) - size + 1):
+                span = range(i, i + size)
+                if used.intersection(span):
+                    continue
+                key = name_key("".join(words[i:i + size]))
+                if key in self.names:
+                    found[i] = self.names[key], "exact"
+                elif key in self.aliases:
+                    found[i] = self.aliases[key], "alias"
+                else:
+                    continue
+                used.update(span)
+        if found:
+            hits = []
+            for i in sorted(found):
+                if found[i][0] not in [name for name, _ in hits]:
+                    hits.append(found[i])
+            return hits, [word for i, word in enumerate(words) if i not in used]
+
+        # Fuzzy matching only makes sense when the query is little more than a name
+        if not words or len(words) > MAX_NAME_WORDS:
+            return [], words
+        grams = trigrams(name_key(query))
+        scores = defaultdict(float)  # canonical name -> best score of its name and aliases
+        for candidate, candidate_grams in self._grams.items():
+            name = self.names.get(candidate) or self.aliases[candidate]
+            scores[name] = max(scores[name], dice(grams, candidate_grams))
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:2] + [(None, 0.0)]
+        (best, best_score), (_, runner_up) = ranked[:2]
+        if best_score >= NAME_INDEX_FUZZY_THRESHOLD and best_score - runner_up >= NAME_INDEX_FUZZY_MARGIN:
+            return [(best, "fuzzy")], []
+        return [], words
+
+    def match(self, query):
+        """(canonical name, tier) for the first data source `query` names, or (None, None)"""
+        hits, _ = self.matches(query)
+        return hits[0] if hits else (None, None)
+
+    def _map(self, filename):
+        mapped = self._maps.get(filename)
+        if mapped is None:
+            with open(os.path.join(self.root, filename), "rb") as f:
+                mapped = self._maps[filename] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mapped
+
+    def read(self, name):
+        """Documentation text for `name`, marketplace section first"""
+        out = []
+        for filename, start, end, fmt in self.targets.get(name, []):
+            raw = self._map(filename)[start:end]
+            out.append(json.loads(raw) if fmt == "json" else raw.decode("utf-8").strip())
+        return out
+
+    def lookup(self, query):
+        """([(name, tier, texts), ...], rest) for the data sources named in `query`; see matches()"""
+        hits, rest = self.matches(query)
+        return [(name, tier, self.read(name)) for name, tier in hits], rest
+
+
+def load_name_index(path=None):
+    """Prebuilt index from `path` when it exists, otherwise built from the corpus files"""
+    if path and os.path.exists(path):
+        return NameIndex.load(path)
+    index = NameIndex.build()
+    logger.info(f"Built data source name index: {len(index.names)} names, {len(index.aliases)} aliases")
+    return index
@@ -0,0 +1,219 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cached retrieval from the Vertex AI RAG corpus.
+
+The agent asks for the same data sources over and over, and every call to the
+corpus costs a remote round trip. `retrieve_rag_documentation` queries
+RAG_CORPUS directly (with the same top_k and distance threshold as the
+VertexAiRagRetrieval tool it replaces) and keeps results in an LRU bounded by
+RETRIEVAL_CACHE_MAX_BYTES, keyed on (normalized query, top_k, threshold).
+
+RAG_CORPUS is read once, on import. A deployed agent is re-imported on Agent
+Engine, which does not get the local .env: deployment passes it as an
+environment variable (agent.deployment_env_vars()).
+
+The cache is cleared whenever the corpus version changes: a hash of the
+corpus's file names and descriptions, which carry the content hashes written
+by corpus_sync.py. The version is re-read at most every
+RETRIEVAL_CACHE_VERSION_INTERVAL seconds. Every call logs whether it hit, the
+running hit rate and the latency it saved.
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE_ENABLED", "true").lower() == "true"
+RETRIEVAL_CACHE_MAX_BYTES = int(os.getenv("RETRIEVAL_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+RETRIEVAL_CACHE_VERSION_INTERVAL = float(os.getenv("RETRIEVAL_CACHE_VERSION_INTERVAL", "300"))  # seconds
+RAG_CORPUS = os.getenv("RAG_CORPUS")  # projects/<project>/locations/<location>/ragCorpora/<id>
+RAG_TOP_K = 10
+RAG_DISTANCE_THRESHOLD = 0.6
+NO_MATCH = "No matching result found in the RAG corpus."
+
+
+def normalize_query(query):
+    return " ".join(query.casefold().split())
+
+
+def entry_size(key, passages):
+    """Approximate bytes held by one entry"""
+    return len(key[0]) + sum(len(passage) for passage in passages) + 200
+
+
+class RetrievalCache:
+    """
+    LRU of retrieval results bounded by total size, cleared when the corpus
+    version reported by `version()` changes.
+    """
+
+    def __init__(self, max_bytes=RETRIEVAL_CACHE_MAX_BYTES, version=None,
+                 version_interval=RETRIEVAL_CACHE_VERSION_INTERVAL, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.version = version
+        self.version_interval = version_interval
+        self.clock = clock
+        self._reset()
+
+    def _reset(self):
+        self.entries = OrderedDict()  # key -> (passages, size, latency in seconds)
+        self.bytes = 0
+        self.calls = 0
+        self.hits = 0
+        self.saved = 0.0
+        self.corpus_version = None
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    # The agent is pickled when it is deployed to Agent Engine; ship it empty
+    def __getstate__(self):
+        return {
+            "max_bytes": self.max_bytes,
+            "version": self.version,
+            "version_interval": self.version_interval,
+            "clock": self.clock,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def _check_version(self):
+        now = self.clock()
+        if self.version is None or (self.checked_at is not None and now - self.checked_at < self.version_interval):
+            return
+        self.checked_at = now
+        try:
+            current = self.version()
+        except Exception as e:
+            logger.warning(f"Could not read the corpus version, keeping cached results: {e}")
+            return
+        if current != self.corpus_version:
+            with self.lock:
+                if self.corpus_version is not None:
+                    logger.info(f"Corpus version changed, dropping {len(self.entries)} cached retrievals")
+                self.entries.clear()
+                self.bytes = 0
+                self.corpus_version = current
+
+    def get(self, key):
+        """(passages, saved seconds) for a cached key, or None"""
+        self._check_version()
+        with self.lock:
+            self.calls += 1
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.saved += entry[2]
+            return entry[0], entry[2]
+
+    def put(self, key, passages, latency):
+        size = entry_size(key, passages)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (passages, size, latency)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted, _) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+
+    def cached(self, retrieve, top_k, threshold):
+        """`retrieve(query, top_k, threshold)` behind this cache"""
+
+        def lookup(query):
+            key = (normalize_query(query), top_k, threshold)
+            hit = self.get(key)
+            if hit is not None:
+                passages, latency = hit
+                logger.info(
+                    f"Retrieval cache hit for {query[:80]!r}: hit rate {self.hits}/{self.calls}, "
+                    f"saved {latency * 1000:.0f} ms ({self.saved:.1f}s total)"
+                )
+                return passages
+            started = time.perf_counter()
+            passages = retrieve(query, top_k, threshold)
+            latency = time.perf_counter() - started
+            self.put(key, passages, latency)
+            logger.info(
+                f"Retrieval cache miss for {query[:80]!r}: {latency * 1000:.0f} ms, "
+                f"hit rate {self.hits}/{self.calls}, {len(self.entries)} entries, {self.bytes / 1e6:.1f} MB"
+            )
+            return passages
+
+        return lookup
+
+
+def _corpus_name():
+    if not RAG_CORPUS:
+        raise ValueError("RAG_CORPUS environment variable not set. Please set it in your .env file.")
+    return RAG_CORPUS
+
+
+def _rag_resources():
+    corpus = _corpus_name()
+    from vertexai.preview import rag
+
+    return [rag.RagResource(rag_corpus=corpus)]
+
+
+def vertex_retrieve(query, top_k=RAG_TOP_K, threshold=RAG_DISTANCE_THRESHOLD):
+    rag_resources = _rag_resources()
+    from vertexai.preview import rag
+
+    response = rag.retrieval_query(
+        rag_resources=rag_resources,
+        text=query,
+        similarity_top_k=top_k,
+        vector_distance_threshold=threshold,
+    )
+    return [context.text for context in response.contexts.contexts]
+
+
+def vertex_corpus_version():
+    """Hash of the corpus file list; corpus_sync puts each file's content hash in its description"""
+    from vertexai.preview import rag
+
+    digest = hashlib.sha256()
+    files = rag.list_files(corpus_name=_corpus_name())
+    for name, description in sorted((f.name, f.description or "") for f in files):
+        digest.update(f"{name}\0{description}\0".encode())
+    return digest.hexdigest()
+
+
+retrieval_cache = RetrievalCache(version=vertex_corpus_version)
+_cached_vertex_retrieve = retrieval_cache.cached(vertex_retrieve, RAG_TOP_K, RAG_DISTANCE_THRESHOLD)
+
+
+def retrieve_rag_documentation(query: str) -> list[str]:
+    """Use this tool to retrieve documentation and reference materials for the question from the RAG corpus.
+
+    Args:
+        query: The question or data source name to look up.
+
+    Returns:
+        The most relevant documentation passages, best match first.
+    """
+    return _cached_vertex_retrieve(query) or [NO_MATCH]
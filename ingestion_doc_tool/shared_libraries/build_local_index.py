@@ -0,0 +1,53 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Prebuilds the local retrieval index used when RAG_BACKEND=local.
+
+    python -m ingestion_doc_tool.shared_libraries.build_local_index [--no-dense]
+
+Writes bm25.json, name_index.json (and dense.npy when NumPy is installed) to
+LOCAL_RAG_INDEX_DIR, which the agent loads on import instead of re-reading the
+corpus.
+"""
+
+import os
+import argparse
+import time
+
+from ingestion_doc_tool.local_retrieval import CORPUS_PATH, LOCAL_RAG_INDEX_DIR, LocalIndex, load_chunks
+from ingestion_doc_tool.name_index import NameIndex
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--corpus", default=CORPUS_PATH)
+  parser.add_argument("--out", default=LOCAL_RAG_INDEX_DIR)
+  parser.add_argument("--no-dense", action="store_true", help="Skip the NumPy trigram matrix")
+  args = parser.parse_args()
+
+  started = time.monotonic()
+  chunks = load_chunks(args.corpus)
+  index = LocalIndex.build(chunks, dense=not args.no_dense)
+  index.save(args.out)
+  names = NameIndex.build(marketplace_path=args.corpus)
+  names.save(os.path.join(args.out, "name_index.json"))
+  print(
+      f"Indexed {len(chunks)} chunks from {len({c['source'] for c in chunks})} data sources into {args.out}"
+      f" (dense={'yes' if index.dense is not None else 'no'}, {len(names.names)} names,"
+      f" {len(names.aliases)} aliases) in {time.monotonic() - started:.1f}s"
+  )
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,310 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Structure-aware chunker for the marketplace and README corpora.
+
+    python -m ingestion_doc_tool.shared_libraries.chunk_corpus [--tokens 500]
+
+Reads the marketplace text line by line and splits it on `# Data source name:`
+and `##` headings. Within a section, paragraphs, markdown tables and fenced
+code blocks are packed into chunks of at most `--tokens` tokens, and a block is
+never cut unless it alone exceeds the budget. An oversized table is split
+between rows, and every piece repeats the header row. README corpus pages that
+are not copies of a marketplace section go through the same packing. Each chunk
+becomes one JSONL record with its data source, section and token estimate, and
+its text opens with a "Data source: / Section:" line for retrieval.
+"""
+
+import os
+import re
+import json
+import argparse
+
+SHARED_LIBRARIES_DIR = os.path.dirname(os.path.abspath(__file__))
+MARKETPLACE_PATH = os.path.join(SHARED_LIBRARIES_DIR, "xsiam_marketplace_ingestion_method.txt")
+README_CORPUS_PATH = os.path.join(SHARED_LIBRARIES_DIR, "xsiam_readme_corpus.json")
+CHUNKED_CORPUS_PATH = os.path.join(SHARED_LIBRARIES_DIR, "chunked", "xsiam_corpus.jsonl")
+PDF_CHUNKS_PATH = os.path.join(SHARED_LIBRARIES_DIR, "chunked", "xsiam_broker_vm_xdr_collector.jsonl")
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "500"))
+# English markdown averages about four characters per token
+CHARS_PER_TOKEN = 4
+
+_SOURCE = re.compile(r"^# Data source name: *(.+?) *$")
+_HEADING = re.compile(r"^(#{1,6}) +(.+?) *#* *$")
+_TABLE_SEPARATOR = re.compile(r"^\s*\|?\s*:?-{3,}")
+# Emitted by pdf_extract.py so chunks can record the pages they came from
+_PAGE = re.compile(r"^<!-- page (\d+) -->$")
+# Integration title of a marketplace section or README page
+CONFIGURE_TITLE = re.compile(r"^## Configure (.+?) (?:on|in) Cortex", re.MULTILINE)
+# "... collects logs from Corelight Zeek." in the opening of a README page
+_README_PRODUCT = re.compile(r"(?:logs|data) from ((?:[A-Z][\w\-]*)(?: [A-Z0-9][\w\-]*)*)")
+_OVERVIEW = "Overview"
+
+
+def estimate_tokens(text):
+  return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def iter_blocks(lines):
+  """
+  Group lines into blocks: ("source", name), ("heading", level, title),
+  ("page", number), and ("table" | "code" | "text", text). Tables and fenced
+  code are kept whole.
+  """
+  buffer, kind = [], None
+
+  def flush():
+    nonlocal buffer, kind
+    block = (kind, "\n".join(buffer)) if buffer else None
+    buffer, kind = [], None
+    return block
+
+  for raw in lines:
+    line = raw.rstrip("\n").rstrip("\r")
+    stripped = line.strip()
+    if kind == "code":
+      buffer.append(line)
+      if stripped.startswith("```"):
+        yield flush()
+      continue
+    if stripped.startswith("```"):
+      block = flush()
+      if block:
+        yield block
+      buffer, kind = [line], "code"
+      continue
+    page = _PAGE.match(stripped)
+    if page:
+      block = flush()
+      if block:
+        yield block
+      yield ("page", int(page.group(1)))
+      continue
+    source = _SOURCE.match(line)
+    heading = _HEADING.match(line)
+    if source or heading:
+      block = flush()
+      if block:
+        yield block
+      yield ("source", source.group(1)) if source else ("heading", len(heading.group(1)), heading.group(2))
+      continue
+    if not stripped:
+      block = flush()
+      if block:
+        yield block
+      continue
+    line_kind = "table" if stripped.startswith("|") else "text"
+    if kind is not None and kind != line_kind:
+      yield flush()
+    kind = line_kind
+    buffer.append(line)
+  block = flush()
+  if block:
+    yield block
+
+
+def split_block(kind, text, budget):
+  """Pieces of an oversized block, each within `budget` where possible"""
+  lines = text.split("\n")
+  header = []
+  if kind == "table" and len(lines) > 2 and _TABLE_SEPARATOR.match(lines[1]):
+    header, lines = lines[:2], lines[2:]
+  pieces, current = [], list(header)
+  for line in lines:
+    if len(current) > len(header) and estimate_tokens("\n".join(current + [line])) > budget:
+      pieces.append("\n".join(current))
+      current = list(header)
+    current.append(line)
+  if len(current) > len(header):
+    pieces.append("\n".join(current))
+
+  # A single line longer than the budget (minified HTML, long URLs) is cut by characters
+  limit = budget * CHARS_PER_TOKEN
+  out = []
+  for piece in pieces:
+    out.extend(piece[i:i + limit] for i in range(0, len(piece), limit) if piece[i:i + limit].strip())
+  return out
+
+
+class _Section:
+  """Blocks of one `##` section, packed into chunks as they arrive"""
+
+  def __init__(self, data_source, section, source_file, budget, page=None):
+    self.data_source = data_source
+    self.section = section
+    self.source_file = source_file
+    # The context line lets a chunk match on its data source even when the body never names it
+    self.header = f"Data source: {data_source}\nSection: {section}\n\n"
+    self.budget = budget
+    self.body_budget = max(1, budget - estimate_tokens(self.header) - 1)
+    self.blocks = []
+    self.page = page  # current page of a paginated source
+    self.pages = []  # page of each block
+
+  def add(self, kind, text):
+    if estimate_tokens(text) > self.body_budget:
+      for piece in split_block(kind, text, self.body_budget):
+        yield from self.add(kind, piece)
+      return
+    if self.blocks and estimate_tokens(self.header + "\n\n".join(self.blocks + [text])) > self.budget:
+      # Keep a trailing sub-heading with the content it introduces
+      last = self.blocks[-1]
+      carry, carry_pages = [], []
+      if last.startswith("#") and len(self.blocks) > 1 and estimate_tokens(self.header + last + "\n\n" + text) <= self.budget:
+        carry, carry_pages = [self.blocks.pop()], [self.pages.pop()]
+      yield self.record()
+      self.blocks, self.pages = carry, carry_pages
+    self.blocks.append(text)
+    self.pages.append(self.page)
+
+  def record(self):
+    text = self.header + "\n\n".join(self.blocks)
+    pages = [page for page in self.pages if page is not None]
+    self.blocks, self.pages = [], []
+    return {
+        "data_source": self.data_source,
+        "section": self.section,
+        "source_file": self.source_file,
+        "text": text,
+        "tokens": estimate_tokens(text),
+        "pages": [min(pages), max(pages)] if pages else None,
+    }
+
+
+def chunk_lines(lines, source_file, budget=CHUNK_TOKENS, data_source=None):
+  """Chunk records for a markdown document, one `##` section at a time"""
+  section = _Section(data_source, _OVERVIEW, source_file, budget)
+  for block in iter_blocks(lines):
+    if block[0] == "page":
+      section.page = block[1]
+      continue
+    if block[0] == "source" or (block[0] == "heading" and block[1] <= 2):
+      if section.blocks:
+        yield section.record()
+      if block[0] == "source":
+        section = _Section(block[1], _OVERVIEW, source_file, budget, section.page)
+      else:
+        section = _Section(section.data_source, block[2], source_file, budget, section.page)
+      continue
+    if block[0] == "heading":
+      yield from section.add("text", f"{'#' * block[1]} {block[2]}")
+    else:
+      yield from section.add(*block)
+  if section.blocks:
+    yield section.record()
+
+
+def readme_products(text):
+  """
+  Product names a README page documents: its integration titles, then the
+  products its opening says it collects logs or data from. name_index.py
+  indexes the page under each of them.
+  """
+  products = CONFIGURE_TITLE.findall(text) + _README_PRODUCT.findall(text[:1000])
+  return list(dict.fromkeys(product.strip() for product in products))
+
+
+def readme_title(text):
+  """
+  A name for a README page: the first of its readme_products(), or else its
+  first heading or line past the boilerplate
+  """
+  products = readme_products(text)
+  if products:
+    return products[0]
+  for line in text.split("\n"):
+    line = line.strip().lstrip("#").strip()
+    if line and line not in ("Abstract", "Cortex XSIAM"):
+      return line[:120]
+  return "README"
+
+
+def opening(text, size=200):
+  """
+  Whitespace-normalized start of a document. A README page whose opening is
+  that of a marketplace section body (header line excluded) is a copy of it;
+  chunk_corpus() and name_index.py both skip such pages with this test.
+  """
+  return " ".join(text.split())[:size]
+
+
+def _collect_openings(lines, openings):
+  """Pass `lines` through, recording the opening of every marketplace section"""
+  body = None
+  for line in lines:
+    if _SOURCE.match(line):
+      if body is not None:
+        openings.add(opening(" ".join(body)))
+      body = []
+    elif body is not None and sum(len(part) for part in body) < 400:
+      body.append(line)
+    yield line
+  if body is not None:
+    openings.add(opening(" ".join(body)))
+
+
+def chunk_corpus(marketplace_path=MARKETPLACE_PATH, readme_path=README_CORPUS_PATH, budget=CHUNK_TOKENS):
+  """Chunks of the marketplace text, then of README pages it does not already contain"""
+  openings = set()
+  with open(marketplace_path, encoding="utf-8") as f:
+    yield from chunk_lines(_collect_openings(f, openings), os.path.basename(marketplace_path), budget)
+  if not readme_path or not os.path.exists(readme_path):
+    return
+  with open(readme_path, encoding="utf-8") as f:
+    pages = json.load(f)
+  for page in pages:
+    text = page["data"]
+    if opening(text) in openings:
+      continue
+    yield from chunk_lines(text.split("\n"), os.path.basename(readme_path), budget, data_source=readme_title(text))
+
+
+def write_jsonl(records, path=CHUNKED_CORPUS_PATH):
+  """Write records with stable ids (data source slug + sequence); returns the count"""
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  seen = {}
+  count = 0
+  tmp_path = f"{path}.tmp"
+  with open(tmp_path, "w", encoding="utf-8") as out:
+    for record in records:
+      slug = re.sub(r"[^a-z0-9]+", "-", (record["data_source"] or "corpus").lower()).strip("-")
+      seen[slug] = seen.get(slug, 0) + 1
+      out.write(json.dumps({"id": f"{slug}-{seen[slug]:03d}", **record}, ensure_ascii=False) + "\n")
+      count += 1
+  os.replace(tmp_path, path)
+  return count
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--tokens", type=int, default=CHUNK_TOKENS, help="Token budget per chunk")
+  parser.add_argument("--out", default=CHUNKED_CORPUS_PATH)
+  args = parser.parse_args()
+
+  sizes = []
+
+  def measured(records):
+    for record in records:
+      sizes.append(record["tokens"])
+      yield record
+
+  count = write_jsonl(measured(chunk_corpus(budget=args.tokens)), args.out)
+  print(
+      f"Wrote {count} chunks to {args.out}: avg {sum(sizes) / max(count, 1):.0f} tokens,"
+      f" max {max(sizes, default=0)} (budget {args.tokens})"
+  )
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,220 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incremental sync of shared_libraries/ into a Vertex AI RAG corpus.
+
+Each corpus file is identified by its path relative to the synced directory
+(its display name) and its SHA-256. The hash is recorded in the RAG file's
+description and in a local manifest, so a re-run compares hashes instead of
+re-uploading: new and changed files are uploaded, superseded and deleted ones
+are removed, and everything else is left alone.
+
+This module holds only the planning and execution logic. The Vertex calls are
+passed in by prepare_corpus_and_data.py, so nothing here imports vertexai.
+"""
+
+import os
+import json
+import time
+import random
+import hashlib
+import concurrent.futures
+from dataclasses import dataclass, field
+
+SYNC_EXTENSIONS = (".txt", ".json", ".jsonl", ".pdf")
+MANIFEST_NAME = ".corpus_manifest.json"
+# Build outputs that live next to the corpus but are not part of it
+SYNC_EXCLUDE_DIRS = ("local_index", "pdf_cache")
+HASH_MARKER = "sha256:"
+
+
+@dataclass
+class LocalFile:
+  path: str
+  display_name: str
+  sha256: str
+
+
+@dataclass
+class RemoteFile:
+  name: str  # projects/.../ragCorpora/.../ragFiles/...
+  display_name: str
+  sha256: str = None  # parsed from the description when it was uploaded by this sync
+
+
+@dataclass
+class SyncPlan:
+  upload: list = field(default_factory=list)  # LocalFile
+  delete: list = field(default_factory=list)  # RemoteFile no longer matching any local file
+  unchanged: list = field(default_factory=list)  # (LocalFile, RemoteFile)
+
+  def is_noop(self):
+    return not self.upload and not self.delete
+
+
+def file_sha256(path, block_size=1 << 20):
+  digest = hashlib.sha256()
+  with open(path, "rb") as f:
+    for block in iter(lambda: f.read(block_size), b""):
+      digest.update(block)
+  return digest.hexdigest()
+
+
+def scan(root, extensions=SYNC_EXTENSIONS, manifest=None, exclude=SYNC_EXCLUDE_DIRS, skip=()):
+  """
+  Every corpus file under `root` except the display names in `skip`; hashes are
+  reused from `manifest` when size and mtime match
+  """
+  cached = (manifest or {}).get("files", {})
+  files = []
+  for directory, dirnames, filenames in os.walk(root):
+    dirnames[:] = sorted(d for d in dirnames if not d.startswith((".", "__")) and d not in exclude)
+    for filename in sorted(filenames):
+      if not filename.endswith(extensions) or filename == MANIFEST_NAME:
+        continue
+      path = os.path.join(directory, filename)
+      display_name = os.path.relpath(path, root).replace(os.sep, "/")
+      if display_name in skip:
+        continue
+      stat = os.stat(path)
+      entry = cached.get(display_name, {})
+      if entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+        sha = entry["sha256"]
+      else:
+        sha = file_sha256(path)
+      files.append(LocalFile(path, display_name, sha))
+  return files
+
+
+def describe(local_file, description=""):
+  """RAG file description carrying the content hash"""
+  prefix = f"{description} " if description else ""
+  return f"{prefix}[{HASH_MARKER}{local_file.sha256}]"
+
+
+def parse_hash(description):
+  if description and HASH_MARKER in description:
+    return description.split(HASH_MARKER, 1)[1].split("]", 1)[0]
+  return None
+
+
+def plan_sync(local_files, remote_files, manifest=None):
+  """
+  Diff local files against the corpus.
+
+  A remote file counts as current when its hash (from the description, or from
+  the manifest entry that recorded its resource name) equals the local hash.
+  Other remote files with a local file's display name (older versions, earlier
+  duplicate uploads) are deleted. So are synced files whose local file is gone;
+  files uploaded by other means under other names are left alone.
+  """
+  recorded = {
+      entry["rag_file"]: entry["sha256"]
+      for entry in (manifest or {}).get("files", {}).values()
+      if entry.get("rag_file")
+  }
+  by_name = {}
+  for remote in remote_files:
+    remote.sha256 = remote.sha256 or recorded.get(remote.name)
+    by_name.setdefault(remote.display_name, []).append(remote)
+
+  plan = SyncPlan()
+  local_names = set()
+  for local in local_files:
+    local_names.add(local.display_name)
+    current = None
+    for remote in by_name.get(local.display_name, []):
+      if current is None and remote.sha256 == local.sha256:
+        current = remote
+      else:
+        plan.delete.append(remote)
+    if current is None:
+      plan.upload.append(local)
+    else:
+      plan.unchanged.append((local, current))
+
+  for display_name, remotes in by_name.items():
+    if display_name not in local_names:
+      plan.delete.extend(r for r in remotes if r.sha256 is not None)
+  return plan
+
+
+def with_retries(fn, *args, retries=3, backoff=1.0, sleep=time.sleep):
+  """Call `fn`, retrying with jittered exponential backoff"""
+  for attempt in range(retries + 1):
+    try:
+      return fn(*args)
+    except Exception:
+      if attempt == retries:
+        raise
+      sleep(backoff * (2 ** attempt) * (0.5 + random.random() / 2))
+
+
+def execute(plan, upload, delete, workers=4, retries=3, backoff=1.0):
+  """
+  Apply `plan`: `upload(local_file)` returns the new RAG file's resource name,
+  `delete(remote_file)` removes one. Uploads run first so a changed file is
+  never missing from the corpus. Returns (uploaded, deleted, errors) where
+  uploaded maps display name to resource name.
+  """
+  uploaded, deleted, errors = {}, [], []
+  with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+    futures = {executor.submit(with_retries, upload, f, retries=retries, backoff=backoff): f for f in plan.upload}
+    for future in concurrent.futures.as_completed(futures):
+      local = futures[future]
+      try:
+        uploaded[local.display_name] = future.result()
+      except Exception as e:
+        errors.append((local.display_name, e))
+
+    # Keep the old version of any file whose replacement failed to upload
+    failed = {name for name, _ in errors}
+    stale = [r for r in plan.delete if r.display_name not in failed]
+    futures = {executor.submit(with_retries, delete, r, retries=retries, backoff=backoff): r for r in stale}
+    for future in concurrent.futures.as_completed(futures):
+      remote = futures[future]
+      try:
+        future.result()
+        deleted.append(remote)
+      except Exception as e:
+        errors.append((remote.display_name, e))
+  return uploaded, deleted, errors
+
+
+def load_manifest(path):
+  if not os.path.exists(path):
+    return {"files": {}}
+  with open(path, encoding="utf-8") as f:
+    return json.load(f)
+
+
+def save_manifest(path, corpus_name, local_files, plan, uploaded):
+  """Record the hash and resource name of every file now current in the corpus"""
+  current = {local.display_name: remote.name for local, remote in plan.unchanged}
+  current.update(uploaded)
+  files = {}
+  for local in local_files:
+    if local.display_name not in current:
+      continue
+    stat = os.stat(local.path)
+    files[local.display_name] = {
+        "sha256": local.sha256,
+        "rag_file": current[local.display_name],
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+    }
+  tmp_path = f"{path}.tmp"
+  with open(tmp_path, "w", encoding="utf-8") as f:
+    json.dump({"corpus": corpus_name, "files": files}, f, indent=2, sort_keys=True)
+  os.replace(tmp_path, path)
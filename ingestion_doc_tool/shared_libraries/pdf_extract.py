@@ -0,0 +1,266 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Page-parallel extraction of the Broker VM / XDR Collector PDF into chunks.
+
+    python -m ingestion_doc_tool.shared_libraries.pdf_extract [--workers 4] [--tokens 500]
+
+Pages are read with pypdf's layout mode in a process pool. Each page becomes
+markdown: numbered headings ("1.2 | Activate CSV Collector") become `##`
+sections, and column-aligned tables are rebuilt as markdown tables. Converted
+pages are cached in pdf_cache/ under the hash of their content stream, so a
+re-run only converts pages that changed. The cover and table of contents, and
+lines repeated at the top or bottom of most pages, are then dropped, and the
+document is packed by chunk_corpus.py into chunked/ with the pages each chunk
+came from.
+
+Requires pypdf, a project dependency.
+"""
+
+import os
+import re
+import time
+import hashlib
+import argparse
+import concurrent.futures
+from collections import Counter
+
+from ingestion_doc_tool.shared_libraries import chunk_corpus
+
+SHARED_LIBRARIES_DIR = os.path.dirname(os.path.abspath(__file__))
+PDF_PATH = os.path.join(SHARED_LIBRARIES_DIR, "XSIAM_Broker_VM_and_XDR_Collector.pdf")
+PDF_CACHE_DIR = os.path.join(SHARED_LIBRARIES_DIR, "pdf_cache")
+PDF_TITLE = "Cortex XSIAM Broker VM and XDR Collector"
+# Part of every page hash; bump it when page conversion changes so cached pages are redone
+EXTRACTOR_VERSION = "1"
+
+_NUMBERED_HEADING = re.compile(r"^(\d+(?:\.\d+)*) \| (.+)$")
+_TASK_HEADING = re.compile(r"^Task \d+\. \S")
+_CELL = re.compile(r"\S+(?: \S+)*")
+_COPYRIGHT = re.compile(r"^Confidential - Copyright ©")
+_PAGE_NUMBER = re.compile(r"^(?:Page )?\d+(?: of \d+)?$")
+# Widest header cell of a table; longer runs are prose that happens to contain wide gaps
+MAX_HEADER_CELL = 40
+
+_reader = None
+
+
+def _open(path):
+  global _reader
+  from pypdf import PdfReader
+
+  _reader = PdfReader(path)
+
+
+def page_hashes(path):
+  """SHA-256 of each page's content stream, salted with the extractor version"""
+  from pypdf import PdfReader
+
+  hashes = []
+  for page in PdfReader(path).pages:
+    contents = page.get_contents()
+    digest = hashlib.sha256(EXTRACTOR_VERSION.encode())
+    digest.update(contents.get_data() if contents is not None else b"")
+    hashes.append(digest.hexdigest())
+  return hashes
+
+
+def segments(line):
+  """(start column, text) of each run of words separated by two or more spaces"""
+  return [(m.start(), m.group()) for m in _CELL.finditer(line)]
+
+
+def table_columns(line):
+  """Column starts when `line` looks like a table header, otherwise None"""
+  cells = segments(line)
+  if len(cells) < 2 or any(len(text) > MAX_HEADER_CELL for _, text in cells):
+    return None
+  return [start for start, _ in cells]
+
+
+def markdown_row(cells):
+  return "| " + " | ".join(" ".join(cell).replace("|", "\\|") for cell in cells) + " |"
+
+
+def rebuild_table(lines, columns):
+  """
+  Read rows from column-aligned `lines` until the layout stops matching.
+  Returns (markdown lines, number of lines consumed); a row starts on a line
+  with text in the first column after a blank line, and any other line adds to
+  the current row's cells.
+  """
+  rows, blank, used = [], True, 0
+  for line in lines:
+    if not line.strip():
+      blank = True
+      used += 1
+      continue
+    cells = segments(line)
+    if cells[0][0] < columns[0] - 1:
+      break
+    placed = [[] for _ in columns]
+    fits = True
+    for start, text in cells:
+      column = max(i for i, col in enumerate(columns) if col <= start + 1 or i == 0)
+      if column + 1 < len(columns) and start + len(text) > columns[column + 1] + 1:
+        fits = False  # runs across the next column: prose, not a cell
+        break
+      placed[column].append(text)
+    if not fits:
+      break
+    if placed[0] and (blank or not rows):
+      rows.append(placed)
+    elif rows:
+      for cell, text in zip(rows[-1], placed):
+        cell.extend(text)
+    blank = False
+    used += 1
+  while used and not lines[used - 1].strip():
+    used -= 1
+  if len(rows) < 2:
+    return None, 0
+  header, body = rows[0], rows[1:]
+  out = [markdown_row(header), "| " + " | ".join("---" for _ in columns) + " |"]
+  out.extend(markdown_row(row) for row in body)
+  return out, used
+
+
+def page_markdown(text):
+  """Markdown for one page of pypdf layout-mode text"""
+  lines = [line.rstrip() for line in text.split("\n")]
+  margin = min((len(line) - len(line.lstrip()) for line in lines if line.strip()), default=0)
+  lines = [line[margin:] for line in lines]
+  out = []
+  i = 0
+  while i < len(lines):
+    line = lines[i]
+    columns = table_columns(line)
+    if columns and line.startswith(" "):
+      table, used = rebuild_table(lines[i:], columns)
+      if table:
+        out.extend(["", *table, ""])
+        i += used
+        continue
+    stripped = " ".join(line.split())
+    heading = _NUMBERED_HEADING.match(stripped)
+    if heading:
+      out.extend(["", f"## {heading.group(1)} {heading.group(2)}", ""])
+    elif _TASK_HEADING.match(stripped):
+      out.extend(["", f"### {stripped}", ""])
+    elif stripped != "Abstract":
+      out.append(line if line.startswith(" ") else stripped)
+    i += 1
+  return "\n".join(out)
+
+
+def _convert(index):
+  return index, page_markdown(_reader.pages[index].extract_text(extraction_mode="layout"))
+
+
+def extract_pages(path=PDF_PATH, cache_dir=PDF_CACHE_DIR, workers=4):
+  """Markdown of every page; returns (pages, number converted, number from cache)"""
+  hashes = page_hashes(path)
+  pages = [None] * len(hashes)
+  missing = []
+  for index, digest in enumerate(hashes):
+    cached = os.path.join(cache_dir, f"{digest}.md")
+    if os.path.exists(cached):
+      with open(cached, encoding="utf-8") as f:
+        pages[index] = f.read()
+    else:
+      missing.append(index)
+
+  if missing:
+    os.makedirs(cache_dir, exist_ok=True)
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=_open, initargs=(path,)
+    ) as executor:
+      for index, markdown in executor.map(_convert, missing, chunksize=4):
+        pages[index] = markdown
+        cached = os.path.join(cache_dir, f"{hashes[index]}.md")
+        with open(f"{cached}.tmp", "w", encoding="utf-8") as f:
+          f.write(markdown)
+        os.replace(f"{cached}.tmp", cached)
+  return pages, len(missing), len(hashes) - len(missing)
+
+
+def _edges(lines, size=2):
+  body = [line for line in lines if line.strip()]
+  return body[:size] + body[-size:]
+
+
+def strip_boilerplate(pages):
+  """
+  Drop the front matter before the first numbered section, and header/footer
+  lines: copyright notices, page numbers, and any line found at the top or
+  bottom of at least half the pages.
+  """
+  edge_counts = Counter(line.strip() for page in pages for line in set(_edges(page.split("\n"))))
+  repeated = {line for line, count in edge_counts.items() if len(pages) > 2 and count >= len(pages) / 2}
+  started = False
+  out = []
+  for page in pages:
+    lines = page.split("\n")
+    edges = set(_edges(lines))
+    kept = []
+    for line in lines:
+      stripped = line.strip()
+      if line in edges and (stripped in repeated or _PAGE_NUMBER.match(stripped)):
+        continue
+      if _COPYRIGHT.match(stripped):
+        continue
+      if not started and stripped.startswith("## "):
+        started = True
+      if started:
+        kept.append(line)
+    out.append("\n".join(kept))
+  return out
+
+
+def pdf_lines(pages):
+  """Lines of the whole document with a page marker before each page"""
+  for number, page in enumerate(pages, 1):
+    yield f"<!-- page {number} -->"
+    yield from page.split("\n")
+
+
+def chunk_pdf(path=PDF_PATH, cache_dir=PDF_CACHE_DIR, workers=4, budget=chunk_corpus.CHUNK_TOKENS):
+  """(chunk records, pages converted, pages from cache)"""
+  pages, converted, cached = extract_pages(path, cache_dir, workers)
+  records = list(chunk_corpus.chunk_lines(
+      pdf_lines(strip_boilerplate(pages)), os.path.basename(path), budget, data_source=PDF_TITLE
+  ))
+  return records, converted, cached
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--pdf", default=PDF_PATH)
+  parser.add_argument("--out", default=chunk_corpus.PDF_CHUNKS_PATH)
+  parser.add_argument("--cache", default=PDF_CACHE_DIR)
+  parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Extraction processes")
+  parser.add_argument("--tokens", type=int, default=chunk_corpus.CHUNK_TOKENS, help="Token budget per chunk")
+  args = parser.parse_args()
+
+  started = time.monotonic()
+  records, converted, cached = chunk_pdf(args.pdf, args.cache, args.workers, args.tokens)
+  count = chunk_corpus.write_jsonl(records, args.out)
+  print(
+      f"Wrote {count} chunks to {args.out} in {time.monotonic() - started:.1f}s"
+      f" ({converted} pages converted, {cached} from cache)"
+  )
+
+
+if __name__ == "__main__":
+  main()
@@ -16,10 +16,15 @@ from google.auth import default
 import vertexai
 from vertexai.preview import rag
 import os
+import time
+import argparse
 from dotenv import load_dotenv, set_key
 import requests
 import tempfile
 
+# Run from the repository root: python -m ingestion_doc_tool.shared_libraries.prepare_corpus_and_data [--chunk]
+from ingestion_doc_tool.shared_libraries import chunk_corpus, corpus_sync, pdf_extract
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -37,9 +42,18 @@ if not LOCATION:
     )
 CORPUS_DISPLAY_NAME = "Data_Ingestion_Corpus"
 CORPUS_DESCRIPTION = "Corpus containing data ingestion document in XSIAM."
-PDF_URL = "https://abc.xyz/assets/77/51/9841ad5c4fbe85b4440c47a4df8d/goog-10-k-2024.pdf"
-PDF_FILENAME = "goog-10-k-2024.pdf"
+# Where to fetch a newer export of the Broker VM / XDR Collector PDF; the copy in shared_libraries/ is used otherwise
+PDF_URL = os.getenv("BROKER_VM_PDF_URL")
+PDF_FILENAME = os.path.basename(pdf_extract.PDF_PATH)
 ENV_FILE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".env"))
+SHARED_LIBRARIES_DIR = os.path.dirname(os.path.abspath(__file__))
+FILE_DESCRIPTIONS = {
+    "xsiam_marketplace_ingestion_method.txt": "Explain Cortex XSIAM ingestion method from the Marketplace document",
+    "xsiam_readme_corpus.json": "Cortex XSIAM integration README and data ingestion documentation",
+    "XSIAM_Broker_VM_and_XDR_Collector.pdf": "Cortex XSIAM Broker VM and XDR Collector ingestion methods",
+    "chunked/xsiam_corpus.jsonl": "Cortex XSIAM ingestion documentation, chunked by data source and section",
+    "chunked/xsiam_broker_vm_xdr_collector.jsonl": "Cortex XSIAM Broker VM and XDR Collector documentation, chunked by section",
+}
 
 
 # --- Start of the script ---
@@ -50,18 +64,21 @@ def initialize_vertex_ai():
   )
 
 
+def find_corpus():
+  """Returns the existing corpus, or None if there is none yet."""
+  for existing_corpus in rag.list_corpora():
+    if existing_corpus.display_name == CORPUS_DISPLAY_NAME:
+      print(f"Found existing corpus with display name '{CORPUS_DISPLAY_NAME}'")
+      return existing_corpus
+  return None
+
+
 def create_or_get_corpus():
   """Creates a new corpus or retrieves an existing one."""
   embedding_model_config = rag.EmbeddingModelConfig(
       publisher_model="publishers/google/models/text-embedding-004"
   )
-  existing_corpora = rag.list_corpora()
-  corpus = None
-  for existing_corpus in existing_corpora:
-    if existing_corpus.display_name == CORPUS_DISPLAY_NAME:
-      corpus = existing_corpus
-      print(f"Found existing corpus with display name '{CORPUS_DISPLAY_NAME}'")
-      break
+  corpus = find_corpus()
   if corpus is None:
     corpus = rag.create_corpus(
         display_name=CORPUS_DISPLAY_NAME,
@@ -118,25 +135,102 @@ def list_corpus_files(corpus_name):
     print(f"File: {file.display_name} - {file.name}")
 
 
+def sync_corpus(corpus_name, root=SHARED_LIBRARIES_DIR, workers=4, retries=3, dry_run=False, skip=()):
+  """
+  Uploads new and changed files under `root` and removes stale ones; unchanged files are skipped.
+  A dry run may pass corpus_name=None for a corpus that does not exist yet.
+  """
+  started = time.monotonic()
+  manifest_path = os.path.join(root, corpus_sync.MANIFEST_NAME)
+  manifest = corpus_sync.load_manifest(manifest_path)
+  local_files = corpus_sync.scan(root, manifest=manifest, skip=skip)
+  remote_files = [
+      corpus_sync.RemoteFile(f.name, f.display_name, corpus_sync.parse_hash(f.description))
+      for f in (rag.list_files(corpus_name=corpus_name) if corpus_name else [])
+  ]
+  # Resource names in a manifest written for another corpus mean nothing here
+  known = manifest if manifest.get("corpus") == corpus_name else None
+  plan = corpus_sync.plan_sync(local_files, remote_files, known)
+  print(
+      f"{len(local_files)} local files: {len(plan.unchanged)} unchanged, {len(plan.upload)} to upload,"
+      f" {len(plan.delete)} remote files to delete"
+  )
+  for local in plan.upload:
+    print(f"  upload {local.display_name}")
+  for remote in plan.delete:
+    print(f"  delete {remote.display_name} ({remote.name})")
+  if dry_run:
+    return plan
+
+  def upload(local):
+    rag_file = rag.upload_file(
+        corpus_name=corpus_name,
+        path=local.path,
+        display_name=local.display_name,
+        description=corpus_sync.describe(local, FILE_DESCRIPTIONS.get(local.display_name, "")),
+    )
+    return rag_file.name
+
+  def delete(remote):
+    rag.delete_file(name=remote.name)
+
+  uploaded, deleted, errors = corpus_sync.execute(plan, upload, delete, workers=workers, retries=retries)
+  corpus_sync.save_manifest(manifest_path, corpus_name, local_files, plan, uploaded)
+  for display_name, error in errors:
+    print(f"Error syncing {display_name}: {error}")
+  print(
+      f"Sync finished in {time.monotonic() - started:.1f}s: {len(uploaded)} uploaded, {len(deleted)} deleted,"
+      f" {len(errors)} errors"
+  )
+  return plan
+
+
 def main():
+  parser = argparse.ArgumentParser(description="Sync shared_libraries/ into the Vertex AI RAG corpus.")
+  parser.add_argument("--root", default=SHARED_LIBRARIES_DIR, help="Directory to sync")
+  parser.add_argument("--workers", type=int, default=4, help="Parallel uploads")
+  parser.add_argument("--retries", type=int, default=3, help="Retries per upload or delete")
+  parser.add_argument("--dry-run", action="store_true", help="Print the plan without changing the corpus or any local file")
+  parser.add_argument(
+      "--chunk", action="store_true",
+      help="Upload structure-aware chunks (chunked/*.jsonl) instead of the raw marketplace, README and PDF files"
+  )
+  parser.add_argument("--pdf-url", default=PDF_URL, help="Download the Broker VM / XDR Collector PDF from this URL first")
+  parser.add_argument("--pdf-workers", type=int, default=os.cpu_count() or 1, help="PDF extraction processes")
+  args = parser.parse_args()
+
+  # A dry run plans from the files already on disk: nothing is downloaded or rewritten
+  if args.pdf_url and not args.dry_run:
+    download_pdf_from_url(args.pdf_url, os.path.join(SHARED_LIBRARIES_DIR, PDF_FILENAME))
+
+  # The corpus holds either the raw documents or their chunks, never both
+  skipped = [chunk_corpus.CHUNKED_CORPUS_PATH, chunk_corpus.PDF_CHUNKS_PATH]
+  if args.chunk:
+    skipped = [chunk_corpus.MARKETPLACE_PATH, chunk_corpus.README_CORPUS_PATH, pdf_extract.PDF_PATH]
+    if args.dry_run:
+      for path in (chunk_corpus.CHUNKED_CORPUS_PATH, chunk_corpus.PDF_CHUNKS_PATH):
+        if not os.path.exists(path):
+          print(f"{path} has not been written yet; run without --dry-run to create it")
+    else:
+      count = chunk_corpus.write_jsonl(chunk_corpus.chunk_corpus())
+      print(f"Wrote {count} chunks to {chunk_corpus.CHUNKED_CORPUS_PATH}")
+      records, converted, cached = pdf_extract.chunk_pdf(workers=args.pdf_workers)
+      count = chunk_corpus.write_jsonl(records, chunk_corpus.PDF_CHUNKS_PATH)
+      print(f"Wrote {count} chunks to {chunk_corpus.PDF_CHUNKS_PATH} ({converted} pages converted, {cached} from cache)")
+  skip = tuple(os.path.relpath(path, args.root).replace(os.sep, "/") for path in skipped)
+
   initialize_vertex_ai()
-  corpus = create_or_get_corpus()
+  if args.dry_run:
+    # Plan against the corpus as it is: nothing is created and .env is left alone
+    corpus = find_corpus()
+    if corpus is None:
+      print(f"No corpus named '{CORPUS_DISPLAY_NAME}' yet; every file would be uploaded to a new one")
+    sync_corpus(corpus.name if corpus else None, root=args.root, dry_run=True, skip=skip)
+    return
 
-    # Upload your local PDF to the corpus
-  local_file_path = "/home/hiepn/adk-samples/python/agents/xsiam-ingestion-doc/ingestion_doc_tool/shared_libraries/xsiam_marketplace_ingestion_method.txt" # Set the correct path
-  display_name = "xsiam_marketplace_ingestion_method.txt" # Set the desired display name
-  description = "Explain Cortex XSIAM ingestion method from the Marketplace document" # Set the description
-
-  # Ensure the file exists before uploading
-  if os.path.exists(local_file_path):
-      upload_pdf_to_corpus(
-          corpus_name=corpus.name,
-          pdf_path=local_file_path,
-          display_name=display_name,
-          description=description
-      )
-  else:
-      print(f"Error: Local file not found at {local_file_path}")
+  corpus = create_or_get_corpus()
+  update_env_file(corpus.name, ENV_FILE_PATH)
+  sync_corpus(corpus.name, root=args.root, workers=args.workers, retries=args.retries, skip=skip)
 
   # List all files in the corpus
   list_corpus_files(corpus_name=corpus.name)
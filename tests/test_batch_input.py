@@ -0,0 +1,98 @@
+import io
+import json
+
+import pytest
+
+pytest.importorskip("werkzeug")
+
+from web_common.batch_input import BatchInput, BatchInputError, detect_format
+from web_common.concurrency import AdaptiveLimiter
+from web_common.job_runner import JobRunner
+from web_common.job_store import JobStore, JOB_COMPLETED
+
+ENGINES = {"doc": "doc-engine", "spl": "spl-engine", "dmgen": "dm-engine"}
+
+
+def rows(text, fmt, default_engine="spl"):
+    batch = BatchInput(io.StringIO(text, newline=""), fmt, default_engine, ENGINES)
+    return batch, list(batch.rows())
+
+
+def test_one_column_csv_is_read_as_before():
+    batch, parsed = rows("index=a | stats count\n\n  x  ,ignored\n", "csv")
+    assert batch.format is None
+    assert parsed == ["index=a | stats count", "x"]
+
+
+def test_headed_csv_and_jsonl_carry_engine_session_and_id():
+    batch, parsed = rows('id,engine,input,session_group\n7,dmgen,"line one\nline two",\n8,,okta,g1\n', "csv")
+    assert batch.format == "csv"
+    assert [(r["row_id"], r["engine_key"], r["engine_id"], r["input"], r["session_group"]) for r in parsed] == [
+        ("7", "dmgen", "dm-engine", "line one\nline two", None),
+        ("8", "spl", "spl-engine", "okta", "g1"),
+    ]
+
+    lines = ['"index=a"', "", json.dumps({"message": "Okta", "engine": "DOC", "session": 3, "id": "x"})]
+    _, parsed = rows("\n".join(lines) + "\n", "jsonl")
+    assert [(r["engine_key"], r["input"], r["session_group"], r["row_id"]) for r in parsed] == [
+        ("spl", "index=a", None, None), ("doc", "Okta", "3", "x"),
+    ]
+
+
+def test_bad_rows_and_formats_are_rejected():
+    with pytest.raises(BatchInputError, match="Row 2: unknown engine 'xql'"):
+        rows("input,engine\na,xql\n", "csv")
+    with pytest.raises(BatchInputError, match="Line 2: invalid JSON"):
+        rows('"a"\n{oops\n', "jsonl")
+    with pytest.raises(BatchInputError, match="Line 1: no 'input' string"):
+        rows('{"engine": "doc"}\n', "jsonl")
+    assert detect_format("rows.NDJSON") == "jsonl" and detect_format("rows.txt") == "csv"
+    with pytest.raises(ValueError):
+        detect_format("rows.csv", "xlsx")
+
+
+def test_dedup_key_never_merges_rows_of_different_engines():
+    batch, parsed = rows('{"input": "Okta", "engine": "doc"}\n{"input": "okta", "engine": "doc"}\n'
+                         '{"input": "Okta", "engine": "dmgen"}\n', "jsonl")
+    keys = [batch.dedup_key(row) for row in parsed]
+    assert keys[0] == keys[1] != keys[2]
+
+
+def test_one_job_routes_rows_by_engine_and_runs_session_groups_in_order(tmp_path):
+    lines = [
+        {"id": "a", "input": "Okta", "engine": "doc"},
+        {"id": "b", "input": "first", "session_group": "g"},
+        {"id": "c", "input": "okta", "engine": "doc"},
+        {"id": "d", "input": "second", "session_group": "g"},
+        {"id": "e", "input": "raw log", "engine": "dmgen"},
+        {"id": "f", "input": "third", "session_group": "g"},
+    ]
+    batch = BatchInput(io.StringIO("".join(json.dumps(line) + "\n" for line in lines)), "jsonl", "spl", ENGINES)
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    store.open_job("job-1", "spl", "spl-engine", "job-1.jsonl", input_format=batch.format)
+    store.append_rows("job-1", batch.rows(), dedup_key=batch.dedup_key)
+    assert store.seal_job("job-1") == 6
+
+    calls = []
+
+    def process_row(text, engine_id, session_id=None):
+        calls.append((text, engine_id, session_id))
+        return f"{engine_id}:{text}"
+
+    sessions = iter(["s1", "s2"])
+    runner = JobRunner(store, process_row, str(tmp_path), limiter=AdaptiveLimiter(initial=4, max_limit=4), lease=0,
+                       open_session=lambda engine_id: next(sessions))
+    runner.run_job(store.claim_job(runner.owner, lease=0))
+
+    assert store.get_job("job-1")["status"] == JOB_COMPLETED
+    assert [c for c in calls if c[2]] == [("first", "spl-engine", "s1"), ("second", "spl-engine", "s1"),
+                                          ("third", "spl-engine", "s1")]
+    assert sorted(c[:2] for c in calls if not c[2]) == [("Okta", "doc-engine"), ("raw log", "dm-engine")]
+    with open(tmp_path / "job-1.jsonl", encoding="utf-8") as f:
+        results = [json.loads(line) for line in f]
+    assert [(r["id"], r["engine"], r["status"], r["output"]) for r in results] == [
+        ("a", "doc", "done", "doc-engine:Okta"), ("b", "spl", "done", "spl-engine:first"),
+        ("c", "doc", "done", "doc-engine:Okta"), ("d", "spl", "done", "spl-engine:second"),
+        ("e", "dmgen", "done", "dm-engine:raw log"), ("f", "spl", "done", "spl-engine:third"),
+    ]
+    assert results[1]["session_group"] == "g" and results[0]["row"] == 0
@@ -0,0 +1,161 @@
+import json
+import asyncio
+
+import pytest
+
+from web_common.chat import BlockingOps, ChatTurn, drive, run
+from web_common.engine_pool import EngineRegistry
+from web_common.fake_engine import FakeAgentEngine
+from web_common.metrics import RequestTimer
+from web_common.rate_limit import RateLimited, SharedRateLimiter
+from web_common.response_cache import ResponseCache
+
+
+def make_ops(tmp_path, engine, async_mode=False):
+    registry = EngineRegistry(loader=lambda engine_id: engine)
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    budget = SharedRateLimiter(state_dir=str(tmp_path))
+    if async_mode:
+        from web_common.asgi import AsyncOps
+
+        return AsyncOps(cache, registry=registry, budget=budget)
+    return BlockingOps(cache, registry=registry, budget=budget)
+
+
+def parse(frames):
+    return [(frame.split("\n")[0][len("event: "):], json.loads(frame.split("\n")[1][len("data: "):]))
+            for frame in frames]
+
+
+# Its own engine label, so the process-wide metrics other tests read stay untouched
+ENGINE_KEY = "chat-test"
+
+
+def blocking_turn(ops, data, stream=False, engine_key=ENGINE_KEY):
+    with RequestTimer(engine_key, "chat") as timer:
+        turn = ChatTurn(engine_key, "engine" if engine_key == ENGINE_KEY else None, data, timer)
+        reply = run(turn.stream() if stream else turn.reply(), ops)
+        if reply.frames is not None:
+            reply.frames = list(drive(reply.frames, ops))
+    return turn, reply
+
+
+def async_turn(ops, data, stream=False, engine_key=ENGINE_KEY):
+    from web_common.asgi import drive as drive_async, run as run_async
+
+    async def main():
+        with RequestTimer(engine_key, "chat") as timer:
+            turn = ChatTurn(engine_key, "engine" if engine_key == ENGINE_KEY else None, data, timer)
+            reply = await run_async(turn.stream() if stream else turn.reply(), ops)
+            if reply.frames is not None:
+                reply.frames = [frame async for frame in drive_async(reply.frames, ops)]
+        return turn, reply
+
+    return asyncio.run(main())
+
+
+@pytest.fixture(params=["blocking", "async"])
+def serve(request, tmp_path):
+    if request.param == "async":
+        pytest.importorskip("starlette")
+        pytest.importorskip("a2wsgi")
+    engine = FakeAgentEngine(stream_chunks=3, tool_latency=0.001)
+    ops = make_ops(tmp_path, engine, async_mode=request.param == "async")
+    turn = async_turn if request.param == "async" else blocking_turn
+    return engine, lambda data, **kwargs: turn(ops, data, **kwargs)
+
+
+def test_json_turn_answers_then_serves_the_cache(serve):
+    engine, serve_turn = serve
+    turn, reply = serve_turn({"message": "Okta"})
+    assert reply.status == 200 and reply.body["response"] == "echo: Okta" and reply.body["session_id"]
+    assert {"engine_get", "create_session", "rate_limit_wait", "generation", "tool.retrieve_rag_documentation",
+            "xql_review"} <= set(turn.timer.phases)
+
+    _, reply = serve_turn({"message": "Okta"})
+    assert reply.body["cached"] is True and reply.body["response"] == "echo: Okta"
+    assert engine.calls["stream_query"] == 1
+
+
+def test_stream_turn_relays_deltas_and_rejects_bad_requests(serve):
+    engine, serve_turn = serve
+    _, reply = serve_turn({"message": "Okta", "session_id": None}, stream=True)
+    frames = parse(reply.frames)
+    assert [name for name, _ in frames] == ["session", "tool", "delta", "delta", "delta", "message", "done"]
+    assert frames[-2][1] == {"text": "echo: Okta"}
+
+    assert serve_turn({"message": "  "}, stream=True)[1].body == {"error": "Message is required"}
+    assert serve_turn(None)[1].status == 400
+    assert serve_turn({"message": "x"}, engine_key="nope")[1].status == 404
+
+
+def test_engine_failure_invalidates_the_handle(serve):
+    engine, serve_turn = serve
+    engine.error_rate = 1.0
+    turn, reply = serve_turn({"message": "Okta"})
+    assert reply.status == 500 and reply.body["error"].startswith("Internal server error")
+    assert turn.timer.status == 500 and turn.timer.errors
+
+
+class ExhaustedBudget:
+    def acquire(self, engine_id, priority, timeout=None):
+        raise RateLimited(f"Request budget for {engine_id} exhausted")
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_rate_limited_turn_opens_no_session(tmp_path, stream):
+    engine = FakeAgentEngine()
+    ops = make_ops(tmp_path, engine)
+    ops.budget = ExhaustedBudget()
+    _, reply = blocking_turn(ops, {"message": "Okta"}, stream=stream)
+    assert reply.status == 429 and engine.calls["create_session"] == 0
+
+
+def test_quota_errors_keep_the_engine_handle(tmp_path):
+    engine = FakeAgentEngine(quota_rps=0.001)  # less than one query's worth of tokens
+    ops = make_ops(tmp_path, engine)
+    _, reply = blocking_turn(ops, {"message": "Okta"})
+    assert reply.status == 500 and engine.calls["quota_errors"] == 1
+    assert ops.registry.stats()["invalidations"] == 0
+    engine.quota_rps, engine.error_rate = None, 1.0
+    blocking_turn(ops, {"message": "Okta"})
+    assert ops.registry.stats()["invalidations"] == 1
+
+
+def test_asgi_chat_is_timed_like_the_flask_views(tmp_path):
+    flask = pytest.importorskip("flask")
+    pytest.importorskip("starlette")
+    pytest.importorskip("a2wsgi")
+    from web_common import metrics
+    from web_common.asgi import create_asgi_app
+
+    flask_app = flask.Flask(__name__)
+    metrics.install(flask_app, "test-asgi", timed={}, engines={ENGINE_KEY}, directory=str(tmp_path))
+    registry = EngineRegistry(loader=lambda engine_id: FakeAgentEngine())
+    app = create_asgi_app(flask_app, {ENGINE_KEY: "engine"}, registry=registry)
+    before = metrics.REQUESTS.values.get((ENGINE_KEY, "stream", "200"), 0)
+
+    async def call(path, body):
+        sent = [{"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}]
+        received = []
+
+        async def receive():
+            if sent:
+                return sent.pop(0)
+            await asyncio.Event().wait()  # the client stays connected until the reply ends
+
+        async def send(message):
+            received.append(message)
+
+        scope = {"type": "http", "method": "POST", "path": path, "raw_path": path.encode(), "query_string": b"",
+                 "headers": [(b"content-type", b"application/json")], "http_version": "1.1", "scheme": "http",
+                 "server": ("test", 80), "client": ("test", 1), "root_path": ""}
+        await app(scope, receive, send)
+        start = received[0]
+        return start["status"], dict(start["headers"]), b"".join(m.get("body", b"") for m in received[1:])
+
+    status, headers, body = asyncio.run(call(f"/api/chat/{ENGINE_KEY}/stream", {"message": "Okta"}))
+    assert status == 200 and b"event: done" in body
+    assert b"create_session;dur=" in headers[b"server-timing"]
+    assert metrics.REQUESTS.values[(ENGINE_KEY, "stream", "200")] == before + 1
+    assert metrics.IN_FLIGHT.values[("stream",)] == 0
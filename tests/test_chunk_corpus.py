@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+# Importing the agent package pulls in google-adk via ingestion_doc_tool/__init__.py
+pytest.importorskip("google.adk")
+
+from ingestion_doc_tool.shared_libraries import chunk_corpus
+from ingestion_doc_tool.shared_libraries.chunk_corpus import chunk_lines, estimate_tokens
+
+TABLE = "\n".join(
+    ["| Parameter | Description |", "| --- | --- |"]
+    + [f"| param_{i} | Setting number {i} of the integration instance |" for i in range(40)]
+)
+
+MARKETPLACE = f"""# Data source name: Okta
+
+Okta system log events are pulled by the Okta event collector.
+
+## Configure Okta on Cortex XSIAM
+
+{TABLE}
+
+# Data source name: AzureFirewall
+
+Azure Firewall network rule logs are collected through Event Hub.
+"""
+
+
+def chunks(text, budget):
+    return list(chunk_lines(text.split("\n"), "market.txt", budget=budget))
+
+
+def test_records_carry_data_source_and_section():
+    records = chunks(MARKETPLACE, budget=2000)
+    assert [(r["data_source"], r["section"]) for r in records] == [
+        ("Okta", "Overview"),
+        ("Okta", "Configure Okta on Cortex XSIAM"),
+        ("AzureFirewall", "Overview"),
+    ]
+    assert records[1]["text"].startswith("Data source: Okta\nSection: Configure Okta on Cortex XSIAM\n\n")
+    assert records[1]["text"].endswith(TABLE)
+    assert all(r["source_file"] == "market.txt" for r in records)
+
+
+def test_oversized_table_is_split_between_rows_with_its_header():
+    records = [r for r in chunks(MARKETPLACE, budget=200) if r["section"].startswith("Configure")]
+    assert len(records) > 1
+    for record in records:
+        assert record["tokens"] <= 200
+        body = record["text"].split("\n\n", 1)[1]
+        assert body.startswith("| Parameter | Description |\n| --- | --- |\n| param_")
+    rows = [line for r in records for line in r["text"].split("\n") if line.startswith("| param_")]
+    assert rows == TABLE.split("\n")[2:]
+
+
+def test_code_blocks_are_not_cut_within_the_budget():
+    code = "```\n" + "\n".join(f"dataset = okta_raw | filter id = {i}" for i in range(10)) + "\n```"
+    text = "# Data source name: Okta\n\n" + "Intro paragraph. " * 20 + "\n\n" + code
+    records = chunks(text, budget=estimate_tokens(code) + 20)
+    assert any(r["text"].endswith(code) for r in records)
+
+
+def test_readme_copies_of_marketplace_sections_are_skipped(tmp_path):
+    marketplace = tmp_path / "market.txt"
+    marketplace.write_text(MARKETPLACE)
+    copy = MARKETPLACE.split("# Data source name: AzureFirewall")[0].split("\n", 1)[1]
+    other = "## Zscaler\n\nThis integration collects logs from Zscaler ZIA."
+    # Named after the product, as in the name index, not after its opening sentence
+    corelight = "Extend Cortex XSIAM visibility into logs from Corelight Zeek.\n\n## Configure Corelight in Cortex\n"
+    readme = tmp_path / "readme.json"
+    readme.write_text(json.dumps([{"data": copy}, {"data": other}, {"data": corelight}]))
+
+    records = list(chunk_corpus.chunk_corpus(str(marketplace), str(readme), budget=2000))
+    readme_records = [r for r in records if r["source_file"] == "readme.json"]
+    assert [r["data_source"] for r in readme_records] == ["Zscaler ZIA", "Corelight"]
+    assert chunk_corpus.readme_products(corelight) == ["Corelight", "Corelight Zeek"]
+
+    out = tmp_path / "chunked" / "corpus.jsonl"
+    assert chunk_corpus.write_jsonl(records, str(out)) == len(records)
+    ids = [json.loads(line)["id"] for line in out.read_text().splitlines()]
+    assert ids[:3] == ["okta-001", "okta-002", "azurefirewall-001"]
@@ -0,0 +1,83 @@
+import pytest
+
+from web_common.concurrency import AdaptiveLimiter, is_quota_error
+from web_common.fake_engine import ResourceExhausted
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_limit_grows_after_a_window_of_successes():
+    limiter = AdaptiveLimiter(initial=2, max_limit=4)
+    for _ in range(2):
+        limiter.acquire()
+        limiter.release(0.1)
+    assert limiter.limit == 3
+
+
+def test_quota_error_halves_limit_once_per_episode():
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(initial=8, clock=clock)
+    for _ in range(3):
+        limiter.acquire()
+        limiter.release(0.1, "quota")
+    assert limiter.limit == 4
+    clock.now = 10
+    limiter.acquire()
+    limiter.release(0.1, "quota")
+    assert limiter.limit == 2
+
+
+def test_run_retries_quota_errors_with_backoff():
+    sleeps = []
+    limiter = AdaptiveLimiter(initial=2, sleep=sleeps.append, seed=1)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ResourceExhausted("429 Quota exceeded")
+        return "ok"
+
+    assert limiter.run(flaky) == "ok"
+    assert len(sleeps) == 2
+    assert limiter.stats()["retries"] == 2
+
+
+def test_run_does_not_retry_other_errors():
+    limiter = AdaptiveLimiter(sleep=lambda s: None)
+    with pytest.raises(ValueError):
+        limiter.run(lambda: (_ for _ in ()).throw(ValueError("bad input")))
+    assert limiter.stats()["retries"] == 0
+
+
+def test_quota_error_detection():
+    assert is_quota_error(ResourceExhausted("x"))
+    assert is_quota_error(RuntimeError("429 RESOURCE_EXHAUSTED"))
+    assert not is_quota_error(RuntimeError("Session not found"))
+
+
+def test_wait_before_each_attempt_holds_no_slot_and_is_not_latency():
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(initial=1, clock=clock, sleep=lambda s: None)
+    in_flight = []
+
+    def wait_for_budget():
+        in_flight.append(limiter.stats()["in_flight"])
+        clock.now += 30  # a long wait on the rate budget
+
+    def call():
+        clock.now += 0.1
+        if len(in_flight) < 2:
+            raise ResourceExhausted("429 Quota exceeded")
+        return "ok"
+
+    assert limiter.run(call, before=wait_for_budget) == "ok"
+    # Once per attempt, outside the slot, and only the call itself is timed
+    assert in_flight == [0, 0]
+    assert limiter.stats()["latency_ewma"] == pytest.approx(0.1)
@@ -0,0 +1,63 @@
+import pytest
+
+# Importing the agent package pulls in google-adk via ingestion_doc_tool/__init__.py
+pytest.importorskip("google.adk")
+
+from google.adk.models import LlmRequest
+from google.genai import types
+
+from ingestion_doc_tool import context_budget
+
+
+def user(text):
+    return types.Content(role="user", parts=[types.Part(text=text)])
+
+
+def model(text):
+    return types.Content(role="model", parts=[types.Part(text=text)])
+
+
+def retrieval(passages):
+    response = types.FunctionResponse(name="retrieve_rag_documentation", response={"result": passages})
+    return types.Content(role="user", parts=[types.Part(function_response=response)])
+
+
+class Context:
+    invocation_id = "e-1"
+
+
+def test_retrieved_passages_are_capped_newest_first():
+    contents = [
+        user("Okta"), retrieval(["a" * 400] * 3), model("doc"),
+        user("Zscaler"), retrieval(["b" * 400] * 3),
+    ]
+    capped = context_budget.cap_retrievals(contents, budget=400)
+    newest = capped[4].parts[0].function_response.response["result"]
+    oldest = capped[1].parts[0].function_response.response["result"]
+    assert newest == ["b" * 400] * 3
+    assert oldest == ["a" * 400, "[2 more passages omitted to fit the context budget]"]
+    # The session's own contents are left alone
+    assert len(contents[1].parts[0].function_response.response["result"]) == 3
+
+
+def test_old_turns_are_folded_into_a_summary():
+    contents = []
+    for i in range(4):
+        contents += [user(f"question {i} " + "x" * 400), model(f"answer {i} " + "y" * 400)]
+    compacted = context_budget.compact_history(contents, budget=300, keep=2)
+    assert len(compacted) == 5
+    summary = compacted[0].parts[0].text
+    assert "User asked: question 0" in summary and "You answered: answer 1" in summary
+    assert compacted[1:] == contents[4:]
+
+
+def test_callback_reports_and_fits_the_budget(monkeypatch, caplog):
+    monkeypatch.setattr(context_budget, "CONTEXT_BUDGET_TOKENS", 400)
+    request = LlmRequest(
+        contents=[user("q1 " + "x" * 2000), model("a1"), user("q2"), model("a2"), user("q3")],
+        config=types.GenerateContentConfig(system_instruction="You write ingestion docs."),
+    )
+    with caplog.at_level("INFO"):
+        assert context_budget.budget_prompt(Context(), request) is None
+    assert context_budget.measure(request)["total"] <= 400
+    assert "compacted_from=" in caplog.text
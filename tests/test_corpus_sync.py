@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+# Importing the agent package pulls in google-adk via ingestion_doc_tool/__init__.py
+pytest.importorskip("google.adk")
+
+from ingestion_doc_tool.shared_libraries import corpus_sync
+from ingestion_doc_tool.shared_libraries.corpus_sync import RemoteFile
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+class FakeCorpus:
+    def __init__(self, fail_uploads=0):
+        self.files = {}
+        self.fail_uploads = fail_uploads
+        self.uploads = 0
+
+    def remote(self):
+        return [RemoteFile(name, display, corpus_sync.parse_hash(desc)) for name, (display, desc) in self.files.items()]
+
+    def upload(self, local):
+        if self.fail_uploads:
+            self.fail_uploads -= 1
+            raise RuntimeError("503")
+        self.uploads += 1
+        name = f"ragFiles/{self.uploads}"
+        self.files[name] = (local.display_name, corpus_sync.describe(local))
+        return name
+
+    def delete(self, remote):
+        del self.files[remote.name]
+
+    def sync(self, root):
+        manifest_path = os.path.join(root, corpus_sync.MANIFEST_NAME)
+        manifest = corpus_sync.load_manifest(manifest_path)
+        local = corpus_sync.scan(root, manifest=manifest)
+        plan = corpus_sync.plan_sync(local, self.remote(), manifest)
+        uploaded, deleted, errors = corpus_sync.execute(plan, self.upload, self.delete, backoff=0)
+        corpus_sync.save_manifest(manifest_path, "corpus", local, plan, uploaded)
+        return plan, errors
+
+
+def test_rerun_is_a_noop_and_changes_replace_old_versions(tmp_path):
+    write(tmp_path / "a.txt", "alpha")
+    write(tmp_path / "docs" / "b.json", "[]")
+    write(tmp_path / "local_index" / "bm25.json", "{}")
+    write(tmp_path / "notes.py", "ignored")
+    corpus = FakeCorpus()
+    # Uploaded by hand before the sync existed: same name, no hash
+    corpus.files["ragFiles/legacy"] = ("a.txt", "Explain ingestion")
+
+    plan, errors = corpus.sync(str(tmp_path))
+    assert sorted(f.display_name for f in plan.upload) == ["a.txt", "docs/b.json"]
+    assert [r.name for r in plan.delete] == ["ragFiles/legacy"]
+    assert not errors
+
+    plan, _ = corpus.sync(str(tmp_path))
+    assert plan.is_noop() and len(plan.unchanged) == 2
+
+    write(tmp_path / "a.txt", "alpha v2")
+    (tmp_path / "docs" / "b.json").unlink()
+    plan, _ = corpus.sync(str(tmp_path))
+    assert [f.display_name for f in plan.upload] == ["a.txt"]
+    assert sorted(r.display_name for r in plan.delete) == ["a.txt", "docs/b.json"]
+    assert sorted(display for display, _ in corpus.files.values()) == ["a.txt"]
+
+
+def test_failed_upload_keeps_the_old_version(tmp_path):
+    write(tmp_path / "a.txt", "alpha")
+    corpus = FakeCorpus()
+    corpus.sync(str(tmp_path))
+    write(tmp_path / "a.txt", "alpha v2")
+
+    # One transient failure is retried; four in a row exhaust the retries
+    corpus.fail_uploads = 1
+    _, errors = corpus.sync(str(tmp_path))
+    assert not errors and len(corpus.files) == 1
+
+    write(tmp_path / "a.txt", "alpha v3")
+    corpus.fail_uploads = 4
+    plan, errors = corpus.sync(str(tmp_path))
+    assert [name for name, _ in errors] == ["a.txt"]
+    assert [display for display, _ in corpus.files.values()] == ["a.txt"]
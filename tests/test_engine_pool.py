@@ -0,0 +1,38 @@
+from web_common.engine_pool import EngineRegistry
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_resolves_each_engine_once_until_ttl():
+    calls = []
+    clock = FakeClock()
+    registry = EngineRegistry(loader=lambda eid: calls.append(eid) or object(), ttl=60, clock=clock)
+
+    first = registry.get("engine-a")
+    assert registry.get("engine-a") is first
+    assert calls == ["engine-a"]
+
+    clock.now = 61
+    assert registry.get("engine-a") is not first
+    assert calls == ["engine-a", "engine-a"]
+
+    stats = registry.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["refreshes"] == 1
+
+
+def test_invalidate_forces_new_lookup():
+    calls = []
+    registry = EngineRegistry(loader=lambda eid: calls.append(eid) or object())
+    registry.get("engine-a")
+    registry.invalidate("engine-a")
+    registry.get("engine-a")
+    assert calls == ["engine-a", "engine-a"]
+    assert registry.stats()["invalidations"] == 1
@@ -0,0 +1,42 @@
+import pytest
+
+from web_common.fake_engine import FakeAgentEngine
+from benchmarks.bench_web_tier import regressions
+
+
+def query(engine, **kwargs):
+    session_id = engine.create_session(user_id="u")["id"]
+    return list(engine.stream_query(message="hello world", user_id="u", session_id=session_id, **kwargs))
+
+
+def test_streaming_mode_gets_partial_chunks_then_the_full_reply():
+    engine = FakeAgentEngine(stream_chunks=4)
+    events = query(engine, run_config={"streaming_mode": "sse"})
+    deltas = [e["content"]["parts"][0]["text"] for e in events if e.get("partial")]
+    assert len(deltas) == 4 and "".join(deltas) == "echo: hello world"
+    assert not events[-1].get("partial") and events[-1]["content"]["parts"][0]["text"] == "echo: hello world"
+    # Batch callers do not ask for streaming and only see the final event
+    assert len(query(engine)) == 1
+
+
+def test_lognormal_latency_is_centred_on_the_median():
+    engine = FakeAgentEngine(query_latency=1.0, latency_distribution="lognormal", latency_spread=0.5, seed=3)
+    samples = sorted(engine.sample_latency() for _ in range(2001))
+    assert 0.9 < samples[1000] < 1.1
+    assert samples[-1] > 2 * samples[1000]
+
+
+def test_stream_errors_happen_after_the_first_chunk():
+    engine = FakeAgentEngine(stream_chunks=3, stream_error_rate=1.0)
+    session_id = engine.create_session(user_id="u")["id"]
+    events = engine.stream_query(message="m", user_id="u", session_id=session_id, run_config={"streaming_mode": "sse"})
+    assert next(events)["partial"]
+    with pytest.raises(RuntimeError):
+        next(events)
+    assert engine.calls["errors"] == 1
+
+
+def test_regressions_respect_direction_and_tolerance():
+    baseline = {"doc-spl/chat": {"p95_s": 1.0, "requests_per_s": 100, "peak_rss_mib": 80}}
+    current = {"doc-spl/chat": {"p95_s": 1.1, "requests_per_s": 70, "peak_rss_mib": 60}}
+    assert regressions(current, baseline, tolerance=0.2) == [("doc-spl/chat", "requests_per_s", 100, 70)]
@@ -0,0 +1,163 @@
+import csv
+import time
+
+from web_common.concurrency import AdaptiveLimiter
+from web_common.job_runner import JobRunner
+from web_common.job_store import JobStore, JOB_COMPLETED, JOB_RUNNING
+from web_common.response_cache import normalize_prompt
+
+
+def test_claim_is_exclusive_until_lease_expires(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    store.create_job("job-1", "spl", "engine", "job-1.csv", ["a", "b"])
+
+    assert store.claim_job("worker-1", lease=60)["id"] == "job-1"
+    assert store.claim_job("worker-2", lease=60) is None
+    # A lease of zero seconds has always expired, as if worker-1 had died
+    time.sleep(0.01)
+    assert store.claim_job("worker-2", lease=0)["owner"] == "worker-2"
+    assert store.heartbeat("job-1", "worker-1") is False
+
+
+def test_resumed_job_only_processes_pending_rows(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    store.create_job("job-1", "spl", "engine", "job-1.csv", ["a", "b", "c"])
+    store.claim_job("dead-worker", lease=60)
+    store.complete_rows("job-1", [0], "A")
+
+    processed = []
+
+    def process_row(text, engine_id):
+        processed.append(text)
+        if text == "c":
+            raise RuntimeError("boom")
+        return text.upper()
+
+    runner = JobRunner(store, process_row, str(tmp_path), limiter=AdaptiveLimiter(initial=2, max_limit=2), lease=0)
+    runner.run_job(store.claim_job(runner.owner, lease=0))
+
+    assert sorted(processed) == ["b", "c"]
+    job = store.get_job("job-1")
+    assert job["status"] == JOB_COMPLETED
+    assert (job["rows_done"], job["rows_failed"]) == (2, 1)
+    with open(tmp_path / "job-1.csv", newline="") as f:
+        assert list(csv.reader(f)) == [["Input", "Output"], ["a", "A"], ["b", "B"], ["c", "ERROR: boom"]]
+
+
+def test_get_job_reports_running_state(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    store.create_job("job-1", "doc", "engine", "job-1.csv", iter(["x"]))
+    store.claim_job("worker-1", lease=60)
+    job = store.get_job("job-1")
+    assert job["status"] == JOB_RUNNING
+    assert job["total_rows"] == 1 and job["rows_pending"] == 1
+
+
+def test_result_file_is_written_incrementally_in_input_order(tmp_path):
+    from web_common.result_writer import OrderedCsvWriter
+
+    path = tmp_path / "out.csv"
+    with OrderedCsvWriter(str(path)) as writer:
+        writer.add(1, "b", "B")
+        assert path.read_text().splitlines() == ["Input,Output"]
+        writer.add(0, "a", "A")
+        assert path.read_text().splitlines() == ["Input,Output", "a,A", "b,B"]
+        assert writer.held_back == 0
+
+
+def test_slow_row_stops_reading_once_enough_rows_are_held_back(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    store.create_job("job-1", "doc", "engine", "job-1.csv", [f"row {i}" for i in range(40)])
+    processed = []
+    overtaken = []
+
+    def process_row(text, engine_id):
+        if text == "row 0":
+            time.sleep(0.3)
+            overtaken.append(len(processed))
+        processed.append(text)
+        return text.upper()
+
+    runner = JobRunner(store, process_row, str(tmp_path), limiter=AdaptiveLimiter(initial=4, max_limit=4), lease=0,
+                       inflight_rows=4, max_held_back=4)
+    runner.run_job(store.claim_job(runner.owner, lease=0))
+
+    # Rows already in flight when the bound is hit still finish, but nothing more is read
+    assert overtaken[0] <= 4 + 4
+    assert store.get_job("job-1")["rows_done"] == 40
+    with open(tmp_path / "job-1.csv", newline="") as f:
+        assert [row[1] for row in list(csv.reader(f))[1:]] == [f"ROW {i}" for i in range(40)]
+
+
+def test_progress_reports_throughput_and_eta(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    store.create_job("job-1", "spl", "engine", "job-1.csv", ["a", "b", "c", "d"])
+    store.claim_job("worker-1", lease=60)
+    store.complete_rows("job-1", [0], "A")
+    store.complete_rows("job-1", [1], "ERROR: x", failed=True)
+    job = store.get_job("job-1")
+    assert (job["rows_done"], job["rows_failed"], job["rows_pending"]) == (1, 1, 2)
+    assert job["throughput"] > 0
+    assert job["eta_seconds"] is not None
+
+
+def test_duplicate_inputs_are_queried_once_and_fanned_out(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    inputs = ["index=a | stats count", "x", "INDEX = a|stats count", "index=a | stats count"]
+    store.create_job("job-1", "spl", "engine", "job-1.csv", inputs, dedup_key=lambda t: normalize_prompt("spl", t))
+
+    processed = []
+
+    def process_row(text, engine_id):
+        processed.append(text)
+        return f"answer:{text}"
+
+    runner = JobRunner(store, process_row, str(tmp_path), limiter=AdaptiveLimiter(initial=2, max_limit=2), lease=0)
+    runner.run_job(store.claim_job(runner.owner, lease=0))
+
+    assert sorted(processed) == ["index=a | stats count", "x"]
+    job = store.get_job("job-1")
+    assert (job["rows_done"], job["unique_rows"], job["dedup_ratio"]) == (4, 2, 0.5)
+    with open(tmp_path / "job-1.csv", newline="") as f:
+        rows = list(csv.reader(f))[1:]
+    assert [row[0] for row in rows] == inputs
+    assert [row[1] for row in rows] == ["answer:index=a | stats count", "answer:x"] + ["answer:index=a | stats count"] * 2
+
+
+def test_queue_depth_counts_pending_rows_by_job_state(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    store.create_job("job-1", "doc", "engine", "job-1.csv", ["a", "b", "c"])
+    store.create_job("job-2", "doc", "engine", "job-2.csv", ["d", "e"])
+    store.claim_job("worker-1", lease=60)
+    store.complete_rows("job-1", [0], "answer")
+
+    assert store.queue_depth() == {"pending": (1, 2), "running": (1, 2)}
+
+
+def test_review_follow_up_is_a_budgeted_call_of_its_own(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    store.create_job("job-1", "spl", "engine", "job-1.csv", ["a", "b"])
+    limiter = AdaptiveLimiter(initial=1, max_limit=1)
+    calls, budget_waits, remembered = [], [], []
+
+    class Budget:
+        def acquire(self, engine_id, priority):
+            # Drawn before the slot is taken, never while holding it
+            budget_waits.append(limiter.stats()["in_flight"])
+
+    def process_row(text, engine_id, followup=False):
+        calls.append((text, followup))
+        return text.upper()
+
+    def review(output, engine_id, ask):
+        return ask(f"fix {output}") if output == "B" else output
+
+    runner = JobRunner(store, process_row, str(tmp_path), limiter=limiter, budget=Budget(), lease=0, review=review,
+                       remember=lambda text, engine_id, output: remembered.append((text, output)))
+    runner.run_job(store.claim_job(runner.owner, lease=0))
+
+    assert sorted(calls) == [("a", False), ("b", False), ("fix B", True)]
+    assert budget_waits == [0, 0, 0]
+    # The reviewed answer is the one stored and cached
+    assert sorted(remembered) == [("a", "A"), ("b", "FIX B")]
+    assert [row["output"] for row in store.iter_finished("job-1")] == ["A", "FIX B"]
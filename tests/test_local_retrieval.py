@@ -0,0 +1,61 @@
+import pytest
+
+# Importing the agent package pulls in google-adk via ingestion_doc_tool/__init__.py
+pytest.importorskip("google.adk")
+
+from ingestion_doc_tool import local_retrieval
+from ingestion_doc_tool.local_retrieval import LocalIndex, named_source_passages, tokenize
+from ingestion_doc_tool.name_index import NameIndex
+from ingestion_doc_tool.shared_libraries.chunk_corpus import chunk_lines
+
+CORPUS = """# Data source name: AzureFirewall
+
+Azure Firewall network rule logs are collected through Event Hub.
+
+## Configure
+Create a diagnostic setting that streams to the Event Hub.
+
+# Data source name: Okta
+
+Okta system log events are pulled by the Okta event collector.
+"""
+
+
+def build():
+    records = chunk_lines(CORPUS.split("\n"), "market.txt", budget=40)
+    chunks = [{"source": record["data_source"], "text": record["text"]} for record in records]
+    return LocalIndex.build(chunks, dense=False)
+
+
+def test_sections_are_chunked_on_headings_and_keep_their_source():
+    index = build()
+    assert [c["source"] for c in index.chunks] == ["AzureFirewall", "AzureFirewall", "Okta"]
+    assert all(c["text"].startswith(f"Data source: {c['source']}\n") for c in index.chunks)
+
+
+def test_camel_case_names_match_spaced_queries():
+    assert {"azurefirewall", "azure", "firewall"} <= set(tokenize("AzureFirewall"))
+    index = build()
+    top, _ = index.search("How do I ingest Azure Firewall logs?", k=1, mode="bm25")[0]
+    assert index.chunks[top]["source"] == "AzureFirewall"
+
+
+def test_saved_index_ranks_the_same(tmp_path):
+    index = build()
+    index.save(str(tmp_path))
+    loaded = LocalIndex.load(str(tmp_path))
+    assert loaded.search("okta system log", k=3, mode="bm25") == index.search("okta system log", k=3, mode="bm25")
+
+
+def test_every_named_source_gets_passages_and_the_rest_is_ranked(tmp_path, monkeypatch):
+    (tmp_path / "market.txt").write_text(CORPUS, encoding="utf-8")
+    monkeypatch.setattr(local_retrieval, "name_index", NameIndex.build(str(tmp_path / "market.txt"), None))
+    monkeypatch.setattr(local_retrieval, "local_index", build())
+
+    passages = named_source_passages("AzureFirewall vs Okta")
+    assert [p.split("\n")[0] for p in passages] == ["# Data source name: AzureFirewall", "# Data source name: Okta"]
+    # Words besides the name: the named section first, then the best chunks of the other sources
+    passages = named_source_passages("okta event hub setup")
+    assert passages[0].startswith("# Data source name: Okta")
+    assert passages[1:] and all(p.startswith("Data source: AzureFirewall") for p in passages[1:])
+    assert named_source_passages("event hub") is None
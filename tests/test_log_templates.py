@@ -0,0 +1,93 @@
+import io
+import csv
+import random
+
+import pytest
+
+from web_common.log_templates import LogTemplateMiner, main, mask
+
+
+def sshd(rng, outcome):
+    return (f"May {rng.randint(1, 28)} 12:0{rng.randint(0, 9)}:11 host sshd[{rng.randint(100, 9999)}]: "
+            f"{outcome} password for user{rng.randint(1, 500)} from 10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)} "
+            f"port {rng.randint(1024, 65535)} ssh2")
+
+
+def disconnect(rng):
+    return f"May {rng.randint(1, 28)} 12:00:11 host sshd[{rng.randint(100, 9999)}]: Received disconnect from 10.0.0.{rng.randint(1, 254)}"
+
+
+def cef(rng):
+    return (f"<134>1 2024-05-0{rng.randint(1, 9)}T10:{rng.randint(10, 59)}:00Z fw01 CEF:0|Palo Alto|PAN-OS|10.1|"
+            f"TRAFFIC|end|3|src=192.168.1.{rng.randint(1, 254)} dpt={rng.choice([22, 443])} act=allow "
+            f"session={rng.getrandbits(64):016x}")
+
+
+def test_variable_fields_are_masked():
+    assert mask("2024-05-01T10:00:00.123Z 10.1.2.3:443 aa:bb:cc:dd:ee:ff port=8080 id 0x1f v1.2") == \
+        "<TS> <IP> <MAC> port=<NUM> id <HEX> v1.2"
+    assert mask('user@corp.com 123e4567-e89b-12d3-a456-426614174000 "GET /a/7"') == '<EMAIL> <UUID> "GET /a/<NUM>"'
+
+
+def test_lines_cluster_by_template():
+    rng = random.Random(7)
+    miner = LogTemplateMiner()
+    ids = {kind: {miner.add(line()) for _ in range(300)} for kind, line in {
+        "accepted": lambda: sshd(rng, "Accepted"),
+        "disconnect": lambda: disconnect(rng),
+        "cef": lambda: cef(rng),
+    }.items()}
+    assert all(len(cluster_ids) == 1 for cluster_ids in ids.values())
+    assert len(set.union(*ids.values())) == len(miner.clusters) == 3
+    accepted = miner.clusters[next(iter(ids["accepted"]))]
+    assert accepted.size == 300
+    assert accepted.text == "<TS> host sshd[<NUM>]: Accepted password for <*> from <IP> port <NUM> ssh2"
+    # One word apart is still one template, and one data model rule parses both
+    assert miner.add(sshd(rng, "Failed")) in ids["accepted"]
+
+
+def test_dissimilar_lines_of_the_same_shape_stay_apart():
+    miner = LogTemplateMiner(similarity=0.5)
+    first = miner.add("kernel: usb device attached to port one")
+    assert miner.add("kernel: eth0 link is down on switch") != first
+    assert miner.add("kernel: usb device detached from port one") == first
+
+
+def test_dmgen_batch_sends_one_row_per_template(tmp_path, capsys):
+    pytest.importorskip("werkzeug")
+    from web_common.batch_input import BatchInput
+    from web_common.concurrency import AdaptiveLimiter
+    from web_common.job_runner import JobRunner
+    from web_common.job_store import JobStore
+
+    rng = random.Random(3)
+    lines = [rng.choice([lambda: sshd(rng, "Accepted"), lambda: disconnect(rng), lambda: cef(rng)])()
+             for _ in range(500)]
+    upload = io.StringIO("".join(f'"{line}"\n' for line in lines), newline="")
+    batch = BatchInput(upload, "csv", "dmgen", {"dmgen": "dm-engine"})
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    store.create_job("job-1", "dmgen", "dm-engine", "job-1.csv", batch.rows(), dedup_key=batch.dedup_key)
+
+    sent = []
+
+    def process_row(text, engine_id):
+        sent.append(text)
+        return f"rule for {text.split()[5 if text.startswith('May') else 3]}"
+
+    # A small in-flight window spreads each template over many pages
+    runner = JobRunner(store, process_row, str(tmp_path), limiter=AdaptiveLimiter(initial=2, max_limit=2), lease=0,
+                       inflight_rows=16)
+    runner.run_job(store.claim_job(runner.owner, lease=0))
+
+    assert len(sent) == 3
+    job = store.get_job("job-1")
+    assert (job["rows_done"], job["unique_rows"]) == (500, 3)
+    with open(tmp_path / "job-1.csv", newline="") as f:
+        results = list(csv.reader(f))[1:]
+    assert [row[0] for row in results] == lines
+    assert len({row[1] for row in results}) == 3
+
+    path = tmp_path / "samples.log"
+    path.write_text("\n".join(lines))
+    main([str(path), "--top", "2"])
+    assert capsys.readouterr().out.startswith("500 samples, 3 templates")
@@ -0,0 +1,144 @@
+import os
+import json
+import socket
+
+import pytest
+
+from web_common import metrics
+from web_common.metrics import (MetricsRegistry, RequestTimer, fold_exited, merge, read_snapshots, render,
+                                write_snapshot)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def tool_event(kind, name, call_id):
+    return {"content": {"parts": [{kind: {"name": name, "id": call_id}}]}}
+
+
+def test_timer_splits_stream_into_tool_and_generation_time():
+    clock = FakeClock()
+    timer = RequestTimer("doc", "chat", clock=clock)
+    with timer.phase("create_session"):
+        clock.now += 0.2
+    events = [
+        tool_event("functionCall", "retrieve_rag_documentation", "c1"),
+        tool_event("functionResponse", "retrieve_rag_documentation", "c1"),
+        {"content": {"parts": [{"text": "answer"}]}},
+    ]
+
+    def stream():
+        for event, delay in zip(events, (0.5, 0.3, 1.0)):
+            clock.now += delay
+            yield event
+
+    assert list(timer.events(stream())) == events
+    assert timer.phases == pytest.approx(
+        {"create_session": 0.2, "tool.retrieve_rag_documentation": 0.3, "generation": 1.5})
+    assert timer.server_timing() == (
+        "create_session;dur=200.0, tool.retrieve_rag_documentation;dur=300.0, generation;dur=1500.0, total;dur=2000.0")
+
+
+def test_finish_records_phases_requests_and_in_flight_once():
+    key = ("bench-engine", "batch_row", "total")
+    before = metrics.PHASE_SECONDS.values.get(key, [0] * 17)[:-1]
+    with RequestTimer("bench-engine", "batch_row") as timer:
+        assert metrics.IN_FLIGHT.values[("batch_row",)] >= 1
+        timer.error("ValueError")
+    timer.finish()
+
+    assert sum(metrics.PHASE_SECONDS.values[key][:-1]) == sum(before) + 1
+    assert metrics.REQUESTS.values[("bench-engine", "batch_row", "200")] == 1
+    assert metrics.ENGINE_ERRORS.values[("bench-engine", "ValueError")] == 1
+
+
+def test_render_histogram_is_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram("latency_seconds", "Latency", ("phase",), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        latency.observe(value, phase="generation")
+
+    text = render({"latency_seconds": latency.values}, "doc-spl", registry)
+    assert 'latency_seconds_bucket{service="doc-spl",phase="generation",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{service="doc-spl",phase="generation",le="1"} 2' in text
+    assert 'latency_seconds_bucket{service="doc-spl",phase="generation",le="+Inf"} 3' in text
+    assert 'latency_seconds_sum{service="doc-spl",phase="generation"} 5.55' in text
+    assert 'latency_seconds_count{service="doc-spl",phase="generation"} 3' in text
+
+
+def test_merge_sums_workers_and_drops_gauges_of_exited_ones(tmp_path):
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests", ("engine",))
+    in_flight = registry.gauge("in_flight", "In flight")
+    requests.inc(3, engine="doc")
+    in_flight.inc(2)
+    write_snapshot(str(tmp_path), "doc-spl", registry)
+    # A worker of this host that has exited, and one of another service
+    dead = {"host": socket.gethostname(), "pid": 2 ** 22 + 1,
+            "metrics": {"requests_total": [[["doc"], 4]], "in_flight": [[[], 5]]}}
+    (tmp_path / "doc-spl-old.json").write_text(json.dumps(dead))
+    (tmp_path / "dm-gen-1.json").write_text(json.dumps(dead))
+
+    merged = merge(read_snapshots(str(tmp_path), "doc-spl"), registry)
+    assert merged["requests_total"] == {("doc",): 7}
+    assert merged["in_flight"] == {(): 2}
+
+
+def test_counters_of_exited_workers_survive_pid_reuse_and_folding(tmp_path):
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests", ("engine",))
+    in_flight = registry.gauge("in_flight", "In flight")
+    requests.inc(3, engine="doc")
+    in_flight.inc(2)
+    write_snapshot(str(tmp_path), "doc-spl", registry)
+    # An earlier run of a worker that had this process's pid
+    reused = {"host": socket.gethostname(), "pid": os.getpid(), "start": "1",
+              "metrics": {"requests_total": [[["doc"], 4]], "in_flight": [[[], 5]]}}
+    (tmp_path / "doc-spl-reused.json").write_text(json.dumps(reused))
+    before = merge(read_snapshots(str(tmp_path), "doc-spl"), registry)
+    assert before["requests_total"] == {("doc",): 7} and before["in_flight"] == {(): 2}
+
+    for _ in range(2):
+        snapshots = fold_exited(read_snapshots(str(tmp_path), "doc-spl"), str(tmp_path), "doc-spl", registry)
+        assert merge(snapshots, registry) == before
+    assert not (tmp_path / "doc-spl-reused.json").exists()
+    assert merge(read_snapshots(str(tmp_path), "doc-spl"), registry) == before
+
+
+def test_app_serves_metrics_and_server_timing(tmp_path):
+    flask = pytest.importorskip("flask")
+    app = flask.Flask(__name__)
+
+    @app.route("/api/chat/<engine_key>", methods=["POST"])
+    def chat(engine_key):
+        with metrics.current_timer().phase("create_session"):
+            pass
+        return flask.jsonify({"response": "ok"})
+
+    @app.route("/api/chat/<engine_key>/stream", methods=["POST"])
+    def chat_stream(engine_key):
+        timer = metrics.current_timer()
+        events = [{"content": {"parts": [{"text": text}]}} for text in ("a", "b")]
+        body = (f"data: {event}\n\n" for event in timer.events(iter(events)))
+        return flask.Response(flask.stream_with_context(metrics.timed_stream(timer, body)))
+
+    metrics.install(app, "test-svc", timed={"chat": "chat", "chat_stream": "stream"}, engines={"doc"},
+                    queue_depth=lambda: {"pending": (1, 4), "running": (0, 0)}, directory=str(tmp_path))
+    client = app.test_client()
+    response = client.post("/api/chat/doc", json={"message": "hi"})
+    assert "create_session;dur=" in response.headers["Server-Timing"]
+    client.post("/api/chat/not-an-engine", json={"message": "hi"})
+    assert client.post("/api/chat/doc/stream", json={"message": "hi"}).get_data(as_text=True).count("data:") == 2
+
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'xsiam_requests_total{service="test-svc",engine="doc",endpoint="chat",status="200"} 1' in body
+    assert 'engine="unknown",endpoint="chat"' in body
+    assert 'xsiam_request_phase_seconds_count{service="test-svc",engine="doc",endpoint="stream",phase="generation"} 1' in body
+    assert 'xsiam_batch_queue_rows{service="test-svc",state="pending"} 4' in body
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(metrics.snapshot_path(str(tmp_path), "test-svc")),
+                                            "test-svc.lock"]
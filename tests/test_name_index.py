@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+# Importing the agent package pulls in google-adk via ingestion_doc_tool/__init__.py
+pytest.importorskip("google.adk")
+
+from ingestion_doc_tool.name_index import NameIndex
+
+MARKETPLACE = """# Data source name: Tenable_io
+
+Tenable.io assets and vulnerabilities – collected by API.
+
+## Configure Tenable Vulnerability Management on Cortex XSOAR
+
+1. Navigate to Settings.
+
+# Data source name: OktaEventCollector
+
+Okta system log events.
+
+# Data source name: MicrosoftECM
+
+Endpoint Configuration Manager logs.
+
+# Data source name: Microsoft365
+
+Audit logs from Microsoft 365.
+"""
+
+README = [
+    {"index": 0, "data": "Tenable.io assets and vulnerabilities – collected by API.\n\n## Configure"},
+    {"index": 1, "data": "Abstract\n\nExtend Cortex XSIAM visibility into logs from Windows DHCP.\n\nUse Filebeat."},
+    # A reflowed copy of a marketplace section
+    {"index": 2, "data": "Audit  logs from Microsoft 365.\n"},
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    (tmp_path / "market.txt").write_text(MARKETPLACE, encoding="utf-8")
+    (tmp_path / "readme.json").write_text(json.dumps(README, indent=2), encoding="utf-8")
+    return NameIndex.build(str(tmp_path / "market.txt"), str(tmp_path / "readme.json"))
+
+
+def test_exact_alias_and_fuzzy_tiers(index):
+    assert index.match("tenable.io") == ("Tenable_io", "exact")
+    assert index.match("Change request for Tenable Vulnerability Management") == ("Tenable_io", "alias")
+    assert index.match("okta") == ("OktaEventCollector", "alias")
+    assert index.match("Tenabel io") == ("Tenable_io", "fuzzy")
+    assert index.match("what does a broker vm do with syslog") == (None, None)
+
+
+def test_every_named_source_is_matched_in_query_order(index):
+    assert index.matches("okta vs tenable.io data model") == (
+        [("OktaEventCollector", "alias"), ("Tenable_io", "exact")], ["vs", "data", "model"])
+    assert index.matches("Okta and okta") == ([("OktaEventCollector", "alias")], ["and"])
+
+
+def test_fuzzy_hit_needs_a_margin_over_the_runner_up(index):
+    # As close to MicrosoftECM as to Microsoft365: ranked search decides instead
+    assert index.matches("Microsoft") == ([], ["Microsoft"])
+    assert index.matches("MicrosoftECN") == ([("MicrosoftECM", "fuzzy")], [])
+
+
+def test_sections_are_read_by_byte_offset(index):
+    [(name, tier, texts)], rest = index.lookup("Tenable_io")
+    assert texts == [MARKETPLACE[:MARKETPLACE.index("# Data source name: Okta")].strip()]
+    # README pages without a marketplace section are indexed under the product they describe
+    assert index.lookup("Windows DHCP")[0][0][2] == [README[1]["data"]]
+    # ...while copies of a marketplace section are not indexed twice
+    assert index.lookup("Microsoft365")[0][0][2] == ["# Data source name: Microsoft365\n\nAudit logs from Microsoft 365."]
+
+
+def test_saved_index_reads_the_same_files(index, tmp_path):
+    index.save(str(tmp_path / "names.json"))
+    loaded = NameIndex.load(str(tmp_path / "names.json"), root=str(tmp_path))
+    assert loaded.lookup("okta") == index.lookup("okta")
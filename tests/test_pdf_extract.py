@@ -0,0 +1,65 @@
+import pytest
+
+# Importing the agent package pulls in google-adk via ingestion_doc_tool/__init__.py
+pytest.importorskip("google.adk")
+
+from ingestion_doc_tool.shared_libraries import chunk_corpus, pdf_extract
+
+LAYOUT_PAGE = """
+    1.3 | Activate Database Collector
+    Abstract
+    Configure the connection.
+
+      Field               Description
+
+
+
+      Port                Specify the port number of the database.
+
+
+
+      Test                Select to validate the database connection.
+      Connection
+
+
+    Database Query
+"""
+
+
+def test_page_becomes_markdown_with_a_rebuilt_table():
+    markdown = pdf_extract.page_markdown(LAYOUT_PAGE)
+    lines = [line for line in markdown.split("\n") if line]
+    assert lines == [
+        "## 1.3 Activate Database Collector",
+        "Configure the connection.",
+        "| Field | Description |",
+        "| --- | --- |",
+        "| Port | Specify the port number of the database. |",
+        "| Test Connection | Select to validate the database connection. |",
+        "Database Query",
+    ]
+
+
+def test_prose_with_wide_gaps_is_not_a_table():
+    page = "Intro\n  Run the collector    on every host in the cluster and then check the status page for errors\n"
+    assert "|" not in pdf_extract.page_markdown(page)
+
+
+def test_front_matter_and_repeated_edges_are_stripped():
+    pages = [
+        "Cortex XSIAM Premium\nDocumentation\nConfidential - Copyright © Palo Alto Networks",
+        "Broker VM data collector applets1.",
+        "Broker VM\n## 1 Broker VM\nApplets.\n3",
+        "Broker VM\nMore text.\n4",
+        "Broker VM\n## 2 XDR Collectors\nCollectors.\n5",
+    ]
+    stripped = pdf_extract.strip_boilerplate(pages)
+    assert stripped[:2] == ["", ""]
+    assert stripped[2:] == ["## 1 Broker VM\nApplets.", "More text.", "## 2 XDR Collectors\nCollectors."]
+
+
+def test_chunks_record_their_pages():
+    pages = ["## 1 Kafka\nKafka intro.", "Kafka setup.", "## 2 CSV\nCSV intro."]
+    records = list(chunk_corpus.chunk_lines(pdf_extract.pdf_lines(pages), "broker.pdf", data_source="Broker VM"))
+    assert [(r["section"], r["pages"]) for r in records] == [("1 Kafka", [1, 2]), ("2 CSV", [3, 3])]
+    assert all(r["data_source"] == "Broker VM" for r in records)
@@ -0,0 +1,74 @@
+from web_common.concurrency import AdaptiveLimiter
+from web_common.job_runner import JobRunner
+from web_common.job_store import JobStore
+from web_common.response_cache import ResponseCache, is_first_turn, normalize_prompt, with_prior_turn
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_spl_normalization_ignores_spacing_and_case_outside_quotes():
+    a = normalize_prompt("spl", 'index=main  sourcetype="Access Combined" |  STATS count BY host')
+    b = normalize_prompt("spl", 'INDEX = main sourcetype = "Access Combined"|stats count by host')
+    assert a == b
+    assert normalize_prompt("spl", 'search "Error"') != normalize_prompt("spl", 'search "error"')
+
+
+def test_doc_normalization_canonicalizes_data_source_names():
+    assert normalize_prompt("doc", "Tenable_io") == normalize_prompt("doc", " tenable.IO ") == "tenable io"
+    # Free-text questions are not folded, so questions that differ only in case or separators stay apart
+    assert normalize_prompt("doc", "How do I parse Okta logs?") != normalize_prompt("doc", "how do I parse okta-logs?")
+    assert normalize_prompt("doc", "Which fields map to\n  xdm.source.ip?") == "Which fields map to xdm.source.ip?"
+
+
+def test_hits_come_from_memory_then_disk_and_expire(tmp_path):
+    clock = FakeClock()
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResponseCache(path, ttl=60, clock=clock)
+    assert cache.get("doc", "engine", "Okta") is None
+    cache.put("doc", "engine", "Okta", "answer")
+    assert cache.get("doc", "engine", "okta") == "answer"
+
+    # Another worker shares the SQLite tier
+    other = ResponseCache(path, ttl=60, clock=clock)
+    assert other.get("doc", "engine", "OKTA") == "answer"
+    assert other.stats("doc")["doc"]["disk_hits"] == 1
+    assert other.get("doc", "other-engine", "Okta") is None
+
+    clock.now += 61
+    assert cache.get("doc", "engine", "Okta") is None
+    assert cache.stats("doc")["doc"]["hit_rate"] == 0.3333
+
+
+def test_only_first_turns_are_cacheable():
+    assert is_first_turn({"message": "hi"})
+    assert not is_first_turn({"message": "hi", "session_id": "s1"})
+    prior = {"message": "Okta", "response": "cached answer"}
+    assert not is_first_turn({"message": "and Duo?", "prior_turn": prior})
+    folded = with_prior_turn("and Duo?", prior)
+    assert "cached answer" in folded and folded.endswith("and Duo?")
+
+
+def test_runner_completes_cached_rows_without_calling_the_engine(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    cache.put("spl", "engine", "index=a", "A")
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    store.create_job("job-1", "spl", "engine", "job-1.csv", ["index = a", "index=b"])
+    processed = []
+
+    def process_row(text, engine_id):
+        processed.append(text)
+        return text.upper()
+
+    runner = JobRunner(store, process_row, str(tmp_path), limiter=AdaptiveLimiter(initial=2, max_limit=2), lease=0,
+                       lookup=lambda text, engine_id: cache.get("spl", engine_id, text))
+    runner.run_job(store.claim_job(runner.owner, lease=0))
+
+    assert processed == ["index=b"]
+    assert [row["output"] for row in store.iter_finished("job-1")] == ["A", "INDEX=B"]
+    assert store.get_job("job-1")["unique_rows"] == 1
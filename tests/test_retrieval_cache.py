@@ -0,0 +1,85 @@
+import pickle
+
+import pytest
+
+# Importing the agent package pulls in google-adk via ingestion_doc_tool/__init__.py
+pytest.importorskip("google.adk")
+
+from ingestion_doc_tool import retrieval_cache
+from ingestion_doc_tool.agent import deployment_env_vars
+from ingestion_doc_tool.retrieval_cache import RetrievalCache
+
+
+class FakeCorpus:
+    def __init__(self):
+        self.calls = []
+        self.version = "v1"
+
+    def retrieve(self, query, top_k, threshold):
+        self.calls.append(query)
+        return [f"{query} passage {i}" for i in range(top_k)]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_normalized_queries_share_an_entry():
+    corpus = FakeCorpus()
+    lookup = RetrievalCache().cached(corpus.retrieve, top_k=2, threshold=0.6)
+    first = lookup("Okta  logs")
+    assert lookup("okta LOGS") == first
+    assert corpus.calls == ["Okta  logs"]
+
+
+def test_least_recently_used_entries_are_evicted_by_size():
+    corpus = FakeCorpus()
+    cache = RetrievalCache(max_bytes=500)
+    lookup = cache.cached(corpus.retrieve, top_k=1, threshold=0.6)
+    for query in ("a", "b", "a", "c"):
+        lookup(query)
+    assert cache.bytes <= 500
+    assert [key[0] for key in cache.entries] == ["a", "c"]
+
+
+def test_corpus_version_change_clears_the_cache():
+    corpus, clock = FakeCorpus(), Clock()
+    cache = RetrievalCache(version=lambda: corpus.version, version_interval=60, clock=clock)
+    lookup = cache.cached(corpus.retrieve, top_k=1, threshold=0.6)
+    lookup("okta")
+    corpus.version = "v2"
+    clock.now = 30
+    lookup("okta")  # version not re-read yet
+    assert corpus.calls == ["okta"]
+    clock.now = 61
+    lookup("okta")
+    assert corpus.calls == ["okta", "okta"]
+    assert cache.hits == 1
+
+
+def test_pickled_cache_starts_empty():
+    corpus = FakeCorpus()
+    cache = RetrievalCache(max_bytes=1000)
+    cache.cached(corpus.retrieve, top_k=1, threshold=0.6)("okta")
+    restored = pickle.loads(pickle.dumps(cache))
+    assert restored.max_bytes == 1000 and not restored.entries and restored.calls == 0
+
+
+def test_missing_corpus_fails_before_any_vertex_call(monkeypatch):
+    monkeypatch.setattr(retrieval_cache, "RAG_CORPUS", None)
+    with pytest.raises(ValueError, match="RAG_CORPUS"):
+        retrieval_cache.vertex_retrieve("okta")
+
+
+def test_deployed_agent_is_given_the_corpus():
+    corpus = "projects/p/locations/us-central1/ragCorpora/1"
+    environ = {"RAG_CORPUS": corpus, "RETRIEVAL_CACHE_MAX_BYTES": "1000", "KEEP_RECENT_TURNS": "4", "HOME": "/root"}
+    assert deployment_env_vars(environ) == \
+        {"RAG_CORPUS": corpus, "RETRIEVAL_CACHE_MAX_BYTES": "1000", "KEEP_RECENT_TURNS": "4"}
+    assert deployment_env_vars({"RAG_BACKEND": "local"}) == {"RAG_BACKEND": "local"}
+    with pytest.raises(ValueError, match="RAG_CORPUS"):
+        deployment_env_vars({"HOME": "/root"})
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+
+import pytest
+
+from web_common.fair_queue import RoundRobinDispatcher
+from web_common.rate_limit import SharedRateLimiter, RateLimited, BATCH, INTERACTIVE
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def make_budget(tmp_path, clock, **kwargs):
+    kwargs.setdefault("project_rpm", 60)  # 1 token/s, capacity 4
+    kwargs.setdefault("engine_rpm", 0)
+    return SharedRateLimiter(state_dir=str(tmp_path), project="p", burst_seconds=4,
+                             interactive_reserve=0.5, clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_batch_leaves_reserve_for_interactive(tmp_path):
+    clock = FakeClock()
+    budget = make_budget(tmp_path, clock)
+    # Capacity 4 with half reserved: batch may take tokens only while 3+ remain
+    assert budget.try_acquire("e", BATCH) == 0
+    assert budget.try_acquire("e", BATCH) == 0
+    assert budget.try_acquire("e", BATCH) > 0
+    assert budget.try_acquire("e", INTERACTIVE) == 0
+    assert budget.try_acquire("e", INTERACTIVE) == 0
+    assert budget.try_acquire("e", INTERACTIVE) > 0
+
+
+def test_budget_is_shared_between_limiter_instances(tmp_path):
+    clock = FakeClock()
+    worker_a = make_budget(tmp_path, clock)
+    worker_b = make_budget(tmp_path, clock)
+    for _ in range(2):
+        assert worker_a.try_acquire("e") == 0
+        assert worker_b.try_acquire("e") == 0
+    assert worker_a.try_acquire("e") > 0
+
+
+def test_acquire_waits_for_refill_or_times_out(tmp_path):
+    clock = FakeClock()
+    budget = make_budget(tmp_path, clock)
+    for _ in range(4):
+        budget.acquire("e")
+    with pytest.raises(RateLimited):
+        budget.acquire("e", timeout=0.5)
+    budget.acquire("e", timeout=5)
+    assert clock.now > 1000.0
+
+
+def test_async_acquire_leaves_the_event_loop_running_while_the_lock_is_held(tmp_path):
+    budget = make_budget(tmp_path, FakeClock())
+    budget._thread_lock.acquire()  # another thread is inside try_acquire()
+    threading.Timer(0.5, budget._thread_lock.release).start()
+
+    async def main():
+        task = asyncio.create_task(budget.acquire_async("e"))
+        ticks = 0
+        while not task.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        return ticks
+
+    # Had the lock been taken on the loop, no tick could run before it was released
+    assert asyncio.run(main()) > 10
+
+
+def test_dispatcher_alternates_between_jobs():
+    gate = threading.Event()
+    order = []
+    dispatcher = RoundRobinDispatcher(workers=1)
+    # Park the single worker so both jobs are fully queued before anything runs
+    blocker = dispatcher.submit("warmup", gate.wait)
+    futures = [dispatcher.submit("big", order.append, f"big-{i}") for i in range(4)]
+    futures += [dispatcher.submit("small", order.append, f"small-{i}") for i in range(2)]
+    gate.set()
+    for future in [blocker] + futures:
+        future.result(timeout=5)
+    assert order[:4] == ["big-0", "small-0", "big-1", "small-1"]
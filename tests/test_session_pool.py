@@ -0,0 +1,93 @@
+import time
+import concurrent.futures
+
+from web_common.engine_pool import EngineRegistry
+from web_common.fake_engine import FakeAgentEngine
+from web_common.session_pool import SessionPool
+
+
+def make_pool(engine, **kwargs):
+    registry = EngineRegistry(loader=lambda engine_id: engine)
+    return SessionPool("fake", registry=registry, **kwargs)
+
+
+def wait_ready(pool, count, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while pool.stats()["ready"] < count and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+def wait_deleted(pool, count, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while pool.stats()["deleted"] < count and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+def test_sessions_are_prewarmed_and_single_use():
+    engine = FakeAgentEngine()
+    pool = make_pool(engine, size=3)
+    wait_ready(pool, 3)
+
+    first = pool.acquire()
+    pool.release(first)
+    second = pool.acquire()
+    assert first != second
+    assert pool.stats()["warm"] == 2
+    assert pool.stats()["cold"] == 0
+    # The used session is deleted on the engine, not just dropped
+    wait_deleted(pool, 1)
+    assert first not in engine.sessions
+    pool.close()
+
+
+def test_reuse_policy_returns_session_to_pool():
+    pool = make_pool(FakeAgentEngine(), size=1, max_uses=2, fillers=0)
+    session_id = pool.acquire()
+    pool.release(session_id)
+    assert pool.acquire() == session_id
+    pool.release(session_id)
+    assert pool.stats()["retired"] == 1
+
+
+def test_prewarming_hides_session_latency():
+    engine = FakeAgentEngine(session_latency=0.03, query_latency=0.03)
+    pool = make_pool(engine, size=4, fillers=4)
+    wait_ready(pool, 4)
+
+    def row(msg):
+        session_id = pool.acquire()
+        try:
+            return list(engine.stream_query(message=msg, user_id="batch_job", session_id=session_id))
+        finally:
+            pool.release(session_id)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(row, range(16)))
+
+    # Rows only pay for a session when the fillers fall behind; the pre-warmed ones never do
+    stats = pool.stats()
+    assert stats["warm"] >= 4
+    assert stats["warm"] + stats["cold"] == stats["retired"] == 16
+    assert engine.calls["stream_query"] == 16
+    wait_ready(pool, 4)  # fillers idle, so closing leaves nothing half-created
+    pool.close()
+    wait_deleted(pool, pool.stats()["created"])
+    assert pool.stats()["deleted"] == pool.stats()["created"]
+    assert engine.calls["delete_session"] == engine.calls["create_session"]
+
+
+def test_stale_ready_sessions_are_retired_not_handed_out():
+    clock = [0.0]
+    engine = FakeAgentEngine()
+    pool = make_pool(engine, size=1, max_uses=2, fillers=0, max_age=60, clock=lambda: clock[0])
+    session_id = pool.acquire()
+    pool.release(session_id)
+    clock[0] = 61
+    fresh = pool.acquire()
+    assert fresh != session_id and pool.stats()["expired"] == 1
+    pool.release(fresh)
+    # Closing deletes the ready session before it returns
+    pool.close()
+    assert fresh not in engine.sessions
+    wait_deleted(pool, 2)
+    assert engine.calls["delete_session"] == engine.calls["create_session"] == 2
@@ -0,0 +1,90 @@
+import io
+import csv
+
+import pytest
+
+from web_common.spl_template import compact, fingerprint, parameterize, reinstantiate
+
+FIREWALL = 'index=fw sourcetype=pan:traffic user=admin action="blocked" | where bytes > 1000 | head 10'
+FIREWALL_XQL = 'dataset = panw_ngfw_traffic_raw | filter action = "blocked" and user = "admin" and bytes > 1000 | limit 10'
+
+
+def test_layout_case_and_term_order_do_not_change_the_template():
+    assert parameterize('index=fw src_ip="10.0.0.1"  | stats count BY user,host') == \
+        ("index = fw src_ip = ? | stats count by user , host", ["10.0.0.1"])
+    assert fingerprint('search src_ip="10.9.9.9"\n   index=fw | STATS count by user host') == \
+        fingerprint('index=fw src_ip="10.0.0.1" | stats count by user, host')
+    assert fingerprint("index=fw | table a, b") == fingerprint("index=fw | TABLE a b")
+    # The values that pick the dataset, field references in `where` and column order are structure
+    assert fingerprint("index=fw user=a") != fingerprint("index=proxy user=a")
+    assert fingerprint("index=fw | where a=b") != fingerprint("index=fw | where a=c")
+    assert fingerprint("index=fw | table a b") != fingerprint("index=fw | table b a")
+    assert fingerprint("index=fw | stats count by a b") != fingerprint("index=fw | stats count by b a")
+    assert fingerprint("index=a (user=x OR host=y)") != fingerprint("index=a (host=y OR user=x)")
+    assert fingerprint("Which data sources does Okta have?") is None
+
+
+def test_answer_is_reinstantiated_with_the_rows_literals():
+    other = 'index=fw  action="allowed" sourcetype=pan:traffic user=root | where bytes > 5000 | head 10'
+    assert fingerprint(other) == fingerprint(FIREWALL)
+    assert reinstantiate(FIREWALL, FIREWALL_XQL, other) == \
+        'dataset = panw_ngfw_traffic_raw | filter action = "allowed" and user = "root" and bytes > 5000 | limit 10'
+    assert reinstantiate(FIREWALL, FIREWALL_XQL, FIREWALL) == FIREWALL_XQL
+
+
+def test_literals_that_cannot_be_located_are_not_guessed():
+    # Missing from the answer
+    assert reinstantiate(FIREWALL, FIREWALL_XQL.replace('"admin"', '"administrator"'),
+                         FIREWALL.replace("admin", "root")) is None
+    # A short value that also occurs elsewhere in the answer
+    assert reinstantiate(FIREWALL, FIREWALL_XQL + " // first 10 rows", FIREWALL.replace("head 10", "head 20")) is None
+    # One value in the answer that would have to become two
+    assert reinstantiate("index=a x=1 y=1", "filter x = 1 and y = 1", "index=a x=1 y=2") is None
+    # A short value inside another value is not an occurrence of it
+    ip = 'index=fw src_ip="10.0.0.1" | head {}'
+    assert reinstantiate(ip.format(1), 'dataset = fw | filter src_ip = "10.0.0.1" | limit 1', ip.format(5)) == \
+        'dataset = fw | filter src_ip = "10.0.0.1" | limit 5'
+
+
+def test_compact_drops_comments_and_layout_but_keeps_code_fences():
+    assert compact('index=a ```old filter``` user="a  b"\n   | stats   count') == 'index=a user="a  b" | stats count'
+    assert compact("```index=a | stats count```") == "```index=a | stats count```"
+
+
+def test_spl_batch_sends_one_row_per_template(tmp_path):
+    pytest.importorskip("werkzeug")
+    from web_common.batch_input import BatchInput, carry_answer
+    from web_common.concurrency import AdaptiveLimiter
+    from web_common.job_runner import JobRunner
+    from web_common.job_store import JobStore
+
+    users = [f"user{i}" for i in range(40)]
+    queries = [f'index=fw user="{user}" | head 5' for user in users]
+    queries.append('index=fw user="late" | head 20')
+    upload = io.StringIO("".join(f'"{query.replace(chr(34), chr(34) * 2)}"\n' for query in queries), newline="")
+    batch = BatchInput(upload, "csv", "spl", {"spl": "spl-engine"})
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    store.create_job("job-1", "spl", "spl-engine", "job-1.csv", batch.rows(), dedup_key=batch.dedup_key)
+
+    sent = []
+
+    def translate(text):
+        user, limit = text.split('"')[1], text.split()[-1]
+        return f'dataset = fw | filter user = "{user}" | limit {limit} // first {limit} rows'
+
+    def process_row(text, engine_id):
+        sent.append(text)
+        return translate(text)
+
+    runner = JobRunner(store, process_row, str(tmp_path), limiter=AdaptiveLimiter(initial=2, max_limit=2), lease=0,
+                       inflight_rows=8, adapt=lambda sent_text, output, text, engine_id:
+                       carry_answer("spl", sent_text, output, text))
+    runner.run_job(store.claim_job(runner.owner, lease=0))
+
+    # "5" occurs twice in the shared answer, so the last row cannot swap it for its own limit
+    assert sent == [queries[0], queries[-1]]
+    job = store.get_job("job-1")
+    assert (job["rows_done"], job["unique_rows"]) == (41, 2)
+    with open(tmp_path / "job-1.csv", newline="") as f:
+        results = list(csv.reader(f))[1:]
+    assert results == [[query, translate(query)] for query in queries]
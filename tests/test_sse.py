@@ -0,0 +1,29 @@
+import json
+
+from web_common.sse import sse_frames
+
+
+def parse(frames):
+    out = []
+    for frame in frames:
+        event, data = frame.strip().split("\n")
+        out.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return out
+
+
+def test_partial_events_become_deltas_then_done():
+    events = [
+        {"content": {"parts": [{"functionCall": {"name": "retrieve_rag_documentation"}}]}},
+        {"partial": True, "content": {"parts": [{"text": "Hel"}]}},
+        {"partial": True, "content": {"parts": [{"text": "lo"}]}},
+        {"content": {"parts": [{"text": "Hello"}]}, "timestamp": 1.5},
+    ]
+    frames = parse(sse_frames(iter(events), "s-1"))
+    assert [name for name, _ in frames] == ["session", "tool", "delta", "delta", "message", "done"]
+    assert frames[-1][1]["session_id"] == "s-1"
+    assert frames[-1][1]["first_token_ms"] is not None
+
+
+def test_stream_without_text_reports_error():
+    frames = parse(sse_frames(iter([{"error": "quota"}]), "s-1"))
+    assert frames[-1] == ("error", {"error": "quota"})
@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+from web_common.fake_engine import FakeAgentEngine
+from web_common.tracing import Trace, TraceWriter, load_traces, main, summarize
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def part_event(kind, name, call_id):
+    return {"author": "agent", "content": {"parts": [{kind: {"name": name, "id": call_id}}]}}
+
+
+def text_event(text):
+    return {"author": "agent", "content": {"parts": [{"text": text}]}}
+
+
+def timed(clock, events_with_delays):
+    for delay, event in events_with_delays:
+        clock.now += delay
+        yield event
+
+
+def test_stream_alternates_generation_and_tool_spans():
+    clock = FakeClock()
+    trace = Trace(clock)
+    events = [
+        (0.4, part_event("functionCall", "retrieve_rag_documentation", "a")),
+        (0.2, part_event("functionResponse", "retrieve_rag_documentation", "a")),
+        (0.3, part_event("functionCall", "retrieve_rag_documentation", "b")),
+        (0.1, part_event("functionResponse", "retrieve_rag_documentation", "b")),
+        (0.5, text_event("done")),
+    ]
+    assert len(list(trace.stream(timed(clock, events)))) == 5
+
+    spans = [(s["kind"], round(s["start"], 3), round(s["end"], 3)) for s in trace.spans if s["kind"] != "event"]
+    assert spans == [
+        ("generation", 0.0, 0.4), ("tool", 0.4, 0.6), ("generation", 0.6, 0.9),
+        ("tool", 0.9, 1.0), ("generation", 1.0, 1.5),
+    ]
+    assert trace.seconds("tool") == pytest.approx({"retrieve_rag_documentation": 0.3})
+    assert sum(1 for s in trace.spans if s["kind"] == "event") == 5
+
+    records = trace.records(engine="doc")
+    assert records[0]["kind"] == "request" and records[0]["duration_ms"] == 1500.0
+    assert {r["parent_id"] for r in records[1:]} == {0}
+
+
+def test_unanswered_tool_call_is_closed_when_the_stream_fails():
+    trace = Trace()
+
+    def failing():
+        yield part_event("functionCall", "retrieve_rag_documentation", "a")
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        list(trace.stream(failing()))
+    tools = [s for s in trace.spans if s["kind"] == "tool"]
+    assert tools[0]["attrs"] == {"unfinished": True}
+
+
+def test_fake_engine_tool_call_is_traced():
+    engine = FakeAgentEngine(tool_latency=0.02)
+    session_id = engine.create_session(user_id="u")["id"]
+    trace = Trace()
+    events = list(trace.stream(engine.stream_query(message="Okta", user_id="u", session_id=session_id)))
+    assert events[-1]["content"]["parts"][0]["text"] == "echo: Okta"
+    assert trace.seconds("tool")["retrieve_rag_documentation"] >= 0.02
+
+
+def test_writer_samples_and_report_splits_the_tail(tmp_path, capsys):
+    writer = TraceWriter(str(tmp_path), "doc-spl", sample_rate=0.5, sample=iter([0.9, 0.1, 0.1, 0.1]).__next__)
+    for tool_seconds in (0.1, 0.1, 0.1, 2.0):
+        clock = FakeClock()
+        trace = Trace(clock)
+        events = [(0.1, part_event("functionCall", "retrieve_rag_documentation", "a")),
+                  (tool_seconds, part_event("functionResponse", "retrieve_rag_documentation", "a")),
+                  (0.4, text_event("answer"))]
+        list(trace.stream(timed(clock, events)))
+        writer.write(trace.records())
+
+    traces = load_traces([writer.path])
+    assert len(traces) == 3
+    summary = summarize(traces, slowest=0.34)
+    assert summary["latency"]["tool.retrieve_rag_documentation"]["count"] == 3
+    assert summary["latency"]["request"]["p99_ms"] == 2500.0
+    assert summary["share_slowest"] == {"generation": 0.2, "tool.retrieve_rag_documentation": 0.8}
+
+    main([writer.path, "--json"])
+    assert json.loads(capsys.readouterr().out)["traces"] == 3
+    main([writer.path])
+    assert "tool.retrieve_rag_documentation: n=3" in capsys.readouterr().out
@@ -0,0 +1,96 @@
+import io
+import csv
+import time
+import threading
+
+import pytest
+
+pytest.importorskip("werkzeug")
+
+from web_common.concurrency import AdaptiveLimiter
+from web_common.job_runner import JobRunner
+from web_common.job_store import JobStore, JOB_COMPLETED, JOB_FAILED
+from web_common.upload_stream import MultipartFileReader, UploadError, open_upload
+
+BOUNDARY = "b0undary"
+
+
+class FakeRequest:
+    def __init__(self, body, content_type=f"multipart/form-data; boundary={BOUNDARY}"):
+        self.stream = io.BytesIO(body)
+        self.content_type = content_type
+
+
+def form(*parts):
+    body = b""
+    for name, filename, content in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename is not None else "")
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + content + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def test_file_field_is_read_in_small_chunks():
+    rows = b'Okta\r\n"line one\r\nline two",x\r\nAzure\r\n'
+    body = form(("note", None, b"ignored"), ("file", "rows.csv", rows), ("after", None, b"also ignored"))
+    reader = MultipartFileReader(io.BytesIO(body), BOUNDARY.encode(), chunk_size=7)
+
+    assert reader.find_file() == "rows.csv"
+    text = io.TextIOWrapper(io.BufferedReader(reader, 16), encoding="utf-8", newline="")
+    assert list(csv.reader(text)) == [["Okta"], ["line one\r\nline two", "x"], ["Azure"]]
+    assert reader.bytes_received < len(body)  # the trailing field is never read
+
+
+def test_missing_file_and_truncated_body_are_upload_errors():
+    with pytest.raises(UploadError, match="No file uploaded"):
+        open_upload(FakeRequest(form(("note", None, b"x"))))
+    with pytest.raises(UploadError, match="No file uploaded"):
+        open_upload(FakeRequest(b"message=hi", content_type="application/x-www-form-urlencoded"))
+    _, text = open_upload(FakeRequest(form(("file", "rows.csv", b"a\r\nb\r\n"))[:-20]))
+    with pytest.raises(UploadError):
+        text.read()
+
+
+def runner_for(store, tmp_path, process_row, **kwargs):
+    return JobRunner(store, process_row, str(tmp_path), limiter=AdaptiveLimiter(initial=2, max_limit=2), lease=60,
+                     upload_poll_interval=0.01, **kwargs)
+
+
+def test_job_is_drained_while_its_rows_are_still_arriving(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    store.open_job("job-1", "dmgen", "engine", "job-1.csv")
+    processed = []
+    runner = runner_for(store, tmp_path, lambda text, engine_id: processed.append(text) or text.upper(),
+                        inflight_rows=3)
+    worker = threading.Thread(target=runner.run_job, args=(store.claim_job(runner.owner, lease=60),))
+    worker.start()
+
+    store.append_rows("job-1", ["a", "b"])
+    deadline = time.monotonic() + 5
+    while len(processed) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted(processed) == ["a", "b"]
+    assert store.get_job("job-1")["status"] != JOB_COMPLETED
+
+    store.append_rows("job-1", [f"row{i}" for i in range(10)], first_idx=2)
+    assert store.seal_job("job-1") == 12
+    worker.join(5)
+
+    job = store.get_job("job-1")
+    assert (job["status"], job["rows_done"], job["unique_rows"]) == (JOB_COMPLETED, 12, 12)
+    with open(tmp_path / "job-1.csv", newline="") as f:
+        assert [row[1] for row in csv.reader(f)][1:] == ["A", "B"] + [f"ROW{i}" for i in range(10)]
+
+
+def test_broken_or_stalled_upload_stops_the_job(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    store.open_job("broken", "dmgen", "engine", "broken.csv")
+    store.finish_job("broken", JOB_FAILED, error="Upload failed: client went away")
+    runner = runner_for(store, tmp_path, lambda text, engine_id: text)
+    runner.run_job(store.get_job("broken"))
+    assert store.get_job("broken")["error"] == "Upload failed: client went away"
+
+    store.open_job("stalled", "dmgen", "engine", "stalled.csv")
+    store.append_rows("stalled", ["a"])
+    runner_for(store, tmp_path, lambda text, engine_id: text, upload_stall=0).run_job(store.get_job("stalled"))
+    job = store.get_job("stalled")
+    assert job["status"] == JOB_FAILED and job["error"].startswith("Upload stalled")
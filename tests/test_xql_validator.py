@@ -0,0 +1,81 @@
+import json
+
+from web_common.sse import SseRelay
+from web_common.xql_validator import answer_queries, check_answer, review, validate
+
+VALID = [
+    'dataset = xdr_data | filter action_local_ip = "10.0.0.1" and event_type = ENUM.NETWORK '
+    '| comp count() as c by agent_hostname | sort desc c | limit 10',
+    'config case_sensitive = false | dataset in (panw_ngfw_traffic_raw, xdr_data) // both\n'
+    '| filter user ~= "adm.*|root" | alter t = format_timestamp("%Y-%m-%d", _time) | fields user, t',
+    "dataset = a | join type = left (dataset = b | fields x, y) as b b.x = x | fields x, b.y",
+]
+
+
+def test_valid_queries_pass():
+    assert [validate(query) for query in VALID] == [[], [], []]
+
+
+def test_spl_leftovers_and_broken_pipelines_are_reported():
+    assert validate("dataset = a | stats dc(user) by host | head 10") == [
+        "stage 2: 'stats' is not an XQL stage (SPL; use comp)",
+        "stage 3: 'head' is not an XQL stage (SPL; use limit)",
+        "'dc()' is not an XQL function (SPL; use count_distinct)",
+    ]
+    assert validate("filter x = 1 | limit ten |") == [
+        "stage 1 (filter): the query must start with dataset, preset, datamodel or call",
+        "stage 2 (limit): expects a row count",
+        "stage 3 is empty",
+    ]
+    assert validate('dataset = a | filter x = "abc | limit 5') == ['unterminated " quote']
+    assert validate("dataset = a | comp by host | sort host") == [
+        "stage 2 (comp): has no aggregate function", "stage 3 (sort): must start with asc or desc",
+    ]
+    assert validate("dataset = a | union (dataset = b | where x = 1)") == [
+        "stage 2 subquery: stage 2: 'where' is not an XQL stage (SPL; use filter)",
+    ]
+
+
+def test_queries_are_found_in_fenced_and_bare_answers():
+    answer = f"Translation:\n```xql\n{VALID[0]}\n```\nNotes:\n```\nnot a query\n```\n```sql\n{VALID[1]}\n```"
+    assert answer_queries(answer) == [VALID[0], VALID[1]]
+    assert answer_queries(VALID[2]) == [VALID[2]]
+    assert answer_queries("This SPL has no XQL equivalent.") == []
+    assert check_answer("```xql\ndataset = a | eval x = 1\n```\n```xql\ndataset = b\n```") == [
+        "query 1: stage 2: 'eval' is not an XQL stage (SPL; use alter)",
+    ]
+
+
+def test_review_runs_one_repair_turn_and_keeps_the_better_answer():
+    bad = "```xql\ndataset = a | stats count() by host\n```"
+    good = "```xql\ndataset = a | comp count() by host\n```"
+    prompts = []
+
+    def ask(prompt):
+        prompts.append(prompt)
+        return good
+
+    assert review("spl", bad, ask) == (good, {"valid": True, "errors": [], "repaired": True})
+    assert len(prompts) == 1 and "'stats' is not an XQL stage" in prompts[0] and "stats count() by host" in prompts[0]
+    # A standalone prompt quotes the whole answer, for a session that never saw it
+    review("spl", "Translation:\n" + bad, ask, standalone=True)
+    assert "Translation:\n" + bad in prompts[1]
+
+    # A worse repair, a failed repair turn or no repair at all leave the answer as it was
+    report = {"valid": False, "errors": ["stage 2: 'stats' is not an XQL stage (SPL; use comp)"], "repaired": False}
+    assert review("spl", bad, lambda prompt: "Sorry, I cannot.") == (bad, report)
+    assert review("spl", bad, lambda prompt: 1 / 0) == (bad, report)
+    assert review("spl", bad) == (bad, report)
+    # Passing answers and other engines are never sent back
+    assert review("spl", good, lambda prompt: 1 / 0) == (good, None)
+    assert review("doc", bad, lambda prompt: 1 / 0) == (bad, None)
+
+
+def test_stream_relay_replaces_the_reply_after_a_repair():
+    relay = SseRelay("s-1")
+    relay.feed({"content": {"parts": [{"text": "old"}]}})
+    assert relay.review("old", None) == []
+    frames = relay.review("new", {"valid": True, "errors": [], "repaired": True})
+    assert [frame.split("\n")[0] for frame in frames] == ["event: validation", "event: message"]
+    assert json.loads(frames[1].split("\n")[1][len("data: "):]) == {"text": "new"}
+    assert relay.final_text == "new"
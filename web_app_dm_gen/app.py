@@ -4,6 +4,8 @@ Vertex AI Chat Backend using Python Flask and Google Cloud SDK
 """
 
 import os
+import sys
+import atexit
 import logging
 from datetime import datetime
 import asyncio
@@ -20,16 +22,31 @@ from google.oauth2 import service_account
 from google.auth import default
 import vertexai
 import uuid, threading
-import csv, json
+import csv, json, io
 import tempfile
 import asyncio
 import concurrent.futures
 
 from werkzeug.utils import secure_filename
 
+# Shared web-tier helpers live next to the app directories (bind-mounted into /app in the containers)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from web_common import metrics
+from web_common.chat import BlockingOps, ChatTurn, flask_reply
+from web_common.engine_pool import engine_registry
+from web_common.session_pool import close_session_pools, get_session_pool
+from web_common.job_store import JobStore, JOB_COMPLETED, JOB_FAILED, JOB_RUNNING
+from web_common.job_runner import JobRunner
+from web_common.concurrency import batch_limiter, is_quota_error
+from web_common.rate_limit import request_budget
+from web_common.response_cache import ResponseCache
+from web_common.upload_stream import UploadError, open_upload
+from web_common.batch_input import BatchInput, batch_engines, carry_answer, detect_format
+from web_common.spl_template import compact
+from web_common.xql_validator import review
+
 
 RESULTS_DIR = os.path.join(os.getcwd(), "results")
-MAX_CONCURRENCY = 5  # tune based on server and Vertex AI quota
 JOB_DIR = os.path.join(os.getcwd(), "job_status")
 os.makedirs(JOB_DIR, exist_ok=True)
 os.makedirs(RESULTS_DIR, exist_ok=True)
@@ -40,6 +57,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 load_dotenv()
+# Map engine_key to the Agent Engine resource configured for it
+ENGINE_ENV_MAP = {
+    "dmgen": os.getenv("DM_AGENT_ENGINE_ID"),
+}
+# Batch rows may also name the other service's engines when their IDs are configured here
+BATCH_ENGINES = batch_engines(ENGINE_ENV_MAP)
+ENGINE_KEY_BY_ID = {engine_id: key for key, engine_id in BATCH_ENGINES.items()}
 # Flask app setup
 app = Flask(__name__)
 CORS(app)
@@ -52,269 +76,195 @@ vertexai.init(
 #session_service = VertexAiSessionService(project=os.getenv("GOOGLE_CLOUD_PROJECT"),location=os.getenv("GOOGLE_CLOUD_LOCATION"))
 #AGENT_ENGINE_ID = os.getenv("AGENT_ENGINE_ID")
 #agent_engine = agent_engines.get(AGENT_ENGINE_ID)
-def save_job_status(job_id, status):
-    path = os.path.join(JOB_DIR, f"{job_id}.json")
-    with open(path, "w") as f:
-        json.dump(status, f)
-
-
-def load_job_status(job_id):
-    path = os.path.join(JOB_DIR, f"{job_id}.json")
-    if not os.path.exists(path):
-        return None
-    with open(path) as f:
-        return json.load(f)
-    
+job_store = JobStore(os.path.join(JOB_DIR, "jobs.sqlite3"))
+# First-turn answers, shared by all workers through the SQLite tier
+response_cache = ResponseCache(os.path.join(JOB_DIR, "response_cache.sqlite3"))
+# Phase timings, in-flight and batch-queue gauges and engine error counters, served on /metrics
+metrics.install(app, "dm-gen", timed={"chat": "chat", "chat_stream": "stream"}, engines=ENGINE_ENV_MAP,
+                queue_depth=job_store.queue_depth)
+# Chat turns (web_common.chat) run here with blocking calls and in asgi.py on asyncio
+chat_ops = BlockingOps(response_cache)
+
+
+def describe_job(job):
+    """Public view of a batch job for /api/batch_status"""
+    file_url = f"/results/{job['engine_key']}/{job['output_filename']}"
+    has_file = os.path.exists(os.path.join(RESULTS_DIR, job["output_filename"]))
+    return {
+        "status": job["status"],
+        "result_url": file_url if job["status"] == JOB_COMPLETED else None,
+        # Rows are appended in input order as they finish, so the file is a valid prefix while running
+        "partial_result_url": file_url if job["status"] == JOB_RUNNING and has_file else None,
+        "error": job["error"],
+        # False while the upload is still arriving; rows_total and eta_seconds grow until then
+        "upload_complete": bool(job["sealed"]),
+        "rows_total": job["total_rows"],
+        "rows_done": job["rows_done"],
+        "rows_failed": job["rows_failed"],
+        "rows_unique": job["unique_rows"],
+        "dedup_ratio": job["dedup_ratio"],
+        "throughput_rows_per_sec": job["throughput"],
+        "eta_seconds": job["eta_seconds"],
+    }
 
-def chat_to_engine(engine_id):
-    agent_engine = agent_engines.get(engine_id)
-    if not agent_engine:
-        return jsonify({"error": "Invalid engine ID"}), 400
 
-    try:
-        # Parse request JSON
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "No JSON data provided"}), 400
-
-        message = data.get('message', '').strip()
-        if not message:
-            return jsonify({"error": "Message is required"}), 400
-
-        session_id = data.get('session_id')
-        if not session_id:
-            session = agent_engine.create_session(user_id="web_app")
-            session_id = session.get('id')
-
-        logger.info(f"Session {session_id} - Received chat message: {message[:100]}...")
-
-        result = None
-        for response in agent_engine.stream_query(
-            message=message,
-            user_id="web_app",
-            session_id=session_id
-        ):
-            result = response  # assuming the last one is the final result
-
-        if not result:
-            return jsonify({"error": "No response from agent engine"}), 500
-
-        content_parts = result.get("content", {}).get("parts", [])
-        text = content_parts[0].get("text") if content_parts else None
-
-        if text:
-            logger.info(f"Returning response...")
-            return jsonify({
-                "response": text,
-                "session_id": session_id,
-                "timestamp": result.get("timestamp")
-            })
-        else:
-            error_msg = result.get("error", "Unknown error")
-            logger.info(f"Returning error: {error_msg}")
-            return jsonify({
-                "error": error_msg,
-                "timestamp": result.get("timestamp")
-            }), 500
+def query_agent(msg, engine_id, session_id=None, followup=False):
+    """
+    Answer one batch row; rows of a session group come with their group's session.
+    A follow-up (the XQL repair turn) is sent as written, without compaction.
+    """
+    engine_key = ENGINE_KEY_BY_ID.get(engine_id)
+    with metrics.RequestTimer(engine_key, "batch_row") as timer:
+        with timer.phase("engine_get"):
+            agent_engine = engine_registry.get(engine_id)
+        session_pool = get_session_pool(engine_id) if session_id is None else None
+        if session_pool is not None:
+            with timer.phase("session_acquire"):
+                session_id = session_pool.acquire()
+        healthy = False
+        try:
+            result_text = ""
+            for response in timer.events(agent_engine.stream_query(
+                # SPL is sent without comments and layout whitespace
+                message=compact(msg) if engine_key == "spl" and not followup else msg,
+                user_id="batch_job",
+                session_id=session_id
+            )):
+                result = response
+            healthy = True
+            text = result.get("content").get("parts")[0].get("text", "")
+        except Exception as e:
+            timer.error(type(e).__name__)
+            # A quota error says nothing about the handle; re-resolving it would only add a round trip
+            if not is_quota_error(e):
+                engine_registry.invalidate(engine_id)
+            raise
+        finally:
+            if session_pool is not None:
+                session_pool.release(session_id, healthy=healthy)
+        return text
+
+
+def review_batch_answer(output, engine_id, ask):
+    """
+    XQL check of a batch answer. The repair turn goes through the job runner
+    as a call of its own, possibly in a fresh pooled session, so its prompt
+    quotes the whole answer.
+    """
+    text, xql_report = review(ENGINE_KEY_BY_ID.get(engine_id), output, ask=ask, standalone=True)
+    if xql_report is not None and not xql_report["valid"]:
+        logger.warning(f"Batch row XQL still fails validation: {'; '.join(xql_report['errors'])}")
+    return text
 
-    except Exception as e:
-        logger.error(f"Error in chat endpoint: {e}")
-        return jsonify({
-            "error": f"Internal server error: {str(e)}",
-            "timestamp": datetime.now().isoformat()
-        }), 500
-
-def query_agent(msg,engine_id):
-    agent_engine = agent_engines.get(engine_id)
-    session = agent_engine.create_session(user_id="batch_job")
-    session_id = session.get("id")
-    result_text = ""
-    for response in agent_engine.stream_query(
-        message=msg,
-        user_id="batch_job",
-        session_id=session_id
-    ):
-        result = response
-    return result.get("content").get("parts")[0].get("text", "")
-
-
-def process_and_save(file_path, job_id, output_filename, engine_id):
-    """Background worker: process CSV and save results locally"""
-    #agent_engine = agent_engines.get(engine_id)
-    try:
-        save_job_status(job_id, {"status": "running", "result_url": None, "error": None})
-        results = []
-        # Load all messages
-        with open(file_path, newline='', encoding="utf-8") as infile:
-            reader = [row[0].strip() for row in csv.reader(infile) if row]
-
-        # Run queries in parallel
-        with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
-            futures = {executor.submit(query_agent, msg, engine_id): msg for msg in reader}
-            for future in concurrent.futures.as_completed(futures):
-                msg = futures[future]
-                try:
-                    result_text = future.result()
-                except Exception as e:
-                    result_text = f"ERROR: {str(e)}"
-                results.append([msg, result_text])
-
-
-        # Save results file
-        output_path = os.path.join(RESULTS_DIR, output_filename)
-        with open(output_path, "w", newline='', encoding="utf-8") as out_csv:
-            writer = csv.writer(out_csv)
-            writer.writerow(["Input", "Output"])
-            for r in results:
-                writer.writerow(r)
-
-        save_job_status(job_id, {"status": "completed", "result_url": f"/results/{output_filename}", "error": None})
 
-    except Exception as e:
-        save_job_status(job_id, {"status": "failed", "result_url": None, "error": str(e)})
+def remember_answer(msg, engine_id, output):
+    """Response cache store for a first-turn batch answer, once reviewed"""
+    response_cache.put(ENGINE_KEY_BY_ID.get(engine_id), engine_id, msg, output)
+
+
+def open_batch_session(engine_id):
+    """A session of its own for one session group of a batch job"""
+    return engine_registry.get(engine_id).create_session(user_id="batch_job").get("id")
+
+
+def carry_batch_answer(sent, output, msg, engine_id):
+    """Answer to `sent` for a row that shared its call, e.g. an SPL query with other literals; None to send it"""
+    return carry_answer(ENGINE_KEY_BY_ID.get(engine_id), sent, output, msg)
+
+
+def cached_answer(msg, engine_id):
+    """Response cache lookup the job runner does before spending a request on a row"""
+    return response_cache.get(ENGINE_KEY_BY_ID.get(engine_id), engine_id, msg)
 
 
+# Every worker drains the shared job queue; jobs left behind by a dead worker are resumed by the others
+# Batch parallelism adapts to Vertex AI quota feedback (BATCH_CONCURRENCY_* env vars)
+# and every row draws from the cross-worker request budget at batch priority
+job_runner = JobRunner(job_store, query_agent, RESULTS_DIR, limiter=batch_limiter, budget=request_budget,
+                       lookup=cached_answer, open_session=open_batch_session, adapt=carry_batch_answer,
+                       review=review_batch_answer, remember=remember_answer).start()
+# Pre-warmed sessions would otherwise outlive the worker on the engine
+atexit.register(close_session_pools)
+
 
 @app.route('/api/chat/<engine_key>', methods=['POST'])
 def chat(engine_key):
-    # Map engine_key to environment variable or direct engine_id
-    engine_env_map = {
-        "dmgen": os.getenv("DM_AGENT_ENGINE_ID"),
-    }
-    engine_id = engine_env_map.get(engine_key)
-    if not engine_id:
-        return jsonify({"error": f"Unknown engine '{engine_key}'"}), 404
+    turn = ChatTurn(engine_key, ENGINE_ENV_MAP.get(engine_key), request.get_json(silent=True), metrics.current_timer())
+    return flask_reply(turn, chat_ops)
+
 
-    return chat_to_engine(engine_id)
+@app.route('/api/chat/<engine_key>/stream', methods=['POST'])
+def chat_stream(engine_key):
+    """Same contract as chat() but relays the reply as Server-Sent Events"""
+    turn = ChatTurn(engine_key, ENGINE_ENV_MAP.get(engine_key), request.get_json(silent=True), metrics.current_timer())
+    return flask_reply(turn, chat_ops, stream=True)
 
 
 @app.route('/api/batch_chat/<engine_key>', methods=['POST'])
 def batch_chat(engine_key):
-    engine_env_map = {
-        "dmgen": os.getenv("DM_AGENT_ENGINE_ID")
-    }
-    engine_id = engine_env_map.get(engine_key)
+    engine_id = ENGINE_ENV_MAP.get(engine_key)
     logger.info(engine_id)
     if not engine_id:
         return jsonify({"error": f"Unknown engine"}), 404
-    #agent_engine = agent_engines.get(engine_id)
-    """Batch chat endpoint: upload CSV -> process each line concurrently -> return CSV"""
-    """ Return result directly to user
+    """Batch chat endpoint: stream the CSV or JSONL into a durable job -> poll status, download CSV or JSONL"""
     try:
-        if 'file' not in request.files:
-            return jsonify({"error": "No file uploaded"}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({"error": "Empty filename"}), 400
-        
-        filename = secure_filename(file.filename)
-
-        # Read uploaded CSV (assume first column = prompt)
-        messages = []
-        reader = csv.reader(file.stream.read().decode("utf-8").splitlines())
-        for row in reader:
-            if row:
-                messages.append(row[0].strip())
-
-        # Async processing
-        async def process_message(msg, semaphore):
-            async with semaphore:
-                try:
-                    session = agent_engine.create_session(user_id="batch_job")
-                    session_id = session.get("id")
-
-                    result_text = ""
-                    for response in agent_engine.stream_query(
-                        message=msg,
-                        user_id="batch_job",
-                        session_id=session_id
-                    ):
-                        result = response
-                    result_text = result.get("content").get("parts")[0].get("text", "")
-                    return {"input": msg, "output": result_text}
-                except Exception as e:
-                    return {"input": msg, "output": f"ERROR: {str(e)}"}
-
-        async def run_batch():
-            semaphore = asyncio.Semaphore(5)  # limit concurrency to 5
-            tasks = [process_message(m, semaphore) for m in messages]
-            return await asyncio.gather(*tasks)
-
-        results = asyncio.run(run_batch())
-
-        # Write results to a temporary CSV
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".csv")
-        with open(temp_file.name, "w", newline='', encoding="utf-8") as out_csv:
-            writer = csv.writer(out_csv)
-            writer.writerow(["Input", "Output"])
-            for r in results:
-                writer.writerow([r["input"], r["output"]])
-
-        return send_from_directory(
-            directory=os.path.dirname(temp_file.name),
-            path=os.path.basename(temp_file.name),
-            as_attachment=True,
-            download_name=f"batch_results_{filename}"
-        )
-
-    except Exception as e:
-        logger.error(f"Error in batch_chat endpoint: {e}")
-        return jsonify({
-            "error": f"Internal server error: {str(e)}",
-            "timestamp": datetime.now().isoformat()
-        }), 500
-    """
-    """ New version: Save results to a file and return URL """
+        # Parsed straight off the request body; request.files would stage the whole upload first
+        filename, upload = open_upload(request)
+        # Rows default to this URL's engine; headed CSV and JSONL rows may name another (see web_common.batch_input)
+        batch = BatchInput(upload, detect_format(filename, request.args.get("format")), engine_key, BATCH_ENGINES)
+        output_format = detect_format(None, request.args.get("output") or batch.format)
+    except (UploadError, csv.Error, UnicodeDecodeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Rows are persisted as they arrive and the job starts on the first batch,
+    # so the job survives worker restarts and work overlaps the upload
+    job_id = str(uuid.uuid4())
+    output_filename = f"{job_id}.{output_format}"
     try:
-        if 'file' not in request.files:
-            return jsonify({"error": "No file uploaded"}), 400
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({"error": "Empty filename"}), 400
-
-        # Save upload temporarily
-        tmp_in = tempfile.NamedTemporaryFile(delete=False, suffix=".csv")
-        file.save(tmp_in.name)
-
-        # Define output filename + public URL
-        job_id = str(uuid.uuid4())
-        output_filename = f"{job_id}.csv"
-        output_url = f"/results/{engine_id}/{output_filename}"
-
-        # Start background job
-        threading.Thread(
-            target=process_and_save,
-            args=(tmp_in.name, job_id, output_filename, engine_id),
-            daemon=True
-        ).start()
-        job_status = {
-            "status": "pending",
-            "result_url": None,
-            "error": None
-        }
-        save_job_status(job_id, job_status)
+        job_store.open_job(job_id, engine_key, engine_id, output_filename, input_format=batch.format)
+        job_runner.wake()
+        job_store.append_rows(job_id, batch.rows(), dedup_key=batch.dedup_key)
+        total = job_store.seal_job(job_id)
+        logger.info(f"Queued batch job {job_id} with {total} rows")
+
         return jsonify({
             "job_id": job_id,
-            "status_url": f"/api/batch_status/{engine_id}/{job_id}"
+            "status_url": f"/api/batch_status/{engine_key}/{job_id}"
         })
 
     except Exception as e:
         logger.error(f"Error in batch_chat: {e}")
-        return jsonify({"error": str(e)}), 500
+        job_store.finish_job(job_id, JOB_FAILED, error=f"Upload failed: {e}")
+        return jsonify({"error": str(e)}), 400 if isinstance(e, (UploadError, csv.Error, UnicodeDecodeError)) else 500
     
     
 @app.route('/api/batch_status/<engine_key>/<job_id>', methods=['GET'])
-def batch_status(job_id):
-    job = load_job_status(job_id)
-    if not job:
+def batch_status(engine_key, job_id):
+    job = job_store.get_job(job_id)
+    if not job or job["engine_key"] != engine_key:
         return jsonify({"error": "Job not found"}), 404
-    return jsonify(job)
+    return jsonify(describe_job(job))
+
+
+@app.route('/api/engine_pool/<engine_key>', methods=['GET'])
+def engine_pool_stats(engine_key):
+    """Engine handle cache counters for the worker that served the request"""
+    if engine_key not in ENGINE_ENV_MAP:
+        return jsonify({"error": f"Unknown engine '{engine_key}'"}), 404
+    return jsonify(engine_registry.stats())
+
+
+@app.route('/api/cache/<engine_key>', methods=['GET'])
+def cache_stats(engine_key):
+    """Response cache hit rates for the worker that served the request"""
+    if engine_key not in ENGINE_ENV_MAP:
+        return jsonify({"error": f"Unknown engine '{engine_key}'"}), 404
+    return jsonify(response_cache.stats(engine_key)[engine_key])
 
 
 # Serve result files
 @app.route('/results/<engine_key>/<path:filename>')
-def download_result(filename):
+def download_result(engine_key, filename):
     return send_from_directory(RESULTS_DIR, filename, as_attachment=True)
 
 # Error handlers
@@ -0,0 +1,10 @@
+"""
+ASGI entry point: chat endpoints run on asyncio, every other route is served by the Flask app.
+
+    gunicorn -w 4 -k uvicorn.workers.UvicornWorker asgi:app
+"""
+
+from app import app as flask_app, ENGINE_ENV_MAP, response_cache
+from web_common.asgi import create_asgi_app
+
+app = create_asgi_app(flask_app, ENGINE_ENV_MAP, response_cache=response_cache)
@@ -51,23 +51,30 @@ async function sendMessage(event) {
     }
     try {
         const requestBody = { message: message };
-        if (sessionId != null && sessionId != "null") requestBody.session_id = sessionId;
+        if (sessionId != null && sessionId != "null") {
+            requestBody.session_id = sessionId;
+        } else {
+            // The previous answer came from the response cache, so no session holds it yet
+            const priorTurn = sessionStorage.getItem('chatPriorTurn');
+            if (priorTurn) requestBody.prior_turn = JSON.parse(priorTurn);
+        }
 
         const agentType = document.getElementById('agentSelector').value;
         let endpoint;
         if (agentType === 'doc') {
-            endpoint = '/api/chat/doc';
+            endpoint = '/api/chat/doc/stream';
         } else if (agentType === 'spl') {
-            endpoint = '/api/chat/spl';
+            endpoint = '/api/chat/spl/stream';
         } else if (agentType === 'dmgen') {
-            endpoint = '/api/chat/dmgen';
+            endpoint = '/api/chat/dmgen/stream';
         } else {
             throw new Error('Unknown agent type');
         }
 
+        const requestStart = performance.now();
         const response = await fetch(endpoint, {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
             body: JSON.stringify(requestBody)
         });
 
@@ -76,14 +83,47 @@ async function sendMessage(event) {
             throw new Error(errorData.error || `Server error (${response.status})`);
         }
 
-        const data = await response.json();
-        if (data.session_id) sessionId = data.session_id;
-        sessionStorage.setItem('chatSessionId', sessionId);
-        storedSessionId = sessionStorage.getItem('chatSessionId');
+        let agentDiv = null;
+        let agentText = '';
+        const render = (text) => {
+            if (!agentDiv) {
+                hideTyping();
+                addMessage('', 'agent');
+                agentDiv = document.getElementById('chatMessages').lastElementChild;
+                console.log(`⏱️ Time to first token: ${Math.round(performance.now() - requestStart)} ms`);
+            }
+            agentText = text;
+            agentDiv.textContent = agentText;
+            const chatMessages = document.getElementById('chatMessages');
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+        };
 
-        if (data.response) {
-            addMessage(data.response, 'agent');
-        } else {
+        let finished = false;
+        await readEventStream(response, (event, data) => {
+            if (event === 'session') {
+                sessionId = data.session_id;
+                sessionStorage.setItem('chatSessionId', sessionId);
+                sessionStorage.removeItem('chatPriorTurn');
+            } else if (event === 'delta') {
+                render(agentText + data.text);
+            } else if (event === 'message') {
+                render(data.text);
+            } else if (event === 'validation') {
+                // XQL check of an SPL translation; a repaired answer follows as a new 'message'
+                console.warn('XQL validation:', data);
+            } else if (event === 'done') {
+                finished = true;
+                console.log('⏱️ Stream timings:', data);
+                if (data.cached) {
+                    sessionStorage.removeItem('chatSessionId');
+                    sessionStorage.setItem('chatPriorTurn', JSON.stringify({ message: message, response: agentText }));
+                }
+            } else if (event === 'error') {
+                throw new Error(data.error || 'No response received from agent');
+            }
+        });
+
+        if (!finished && !agentText) {
             throw new Error('No response received from agent');
         }
 
@@ -98,6 +138,30 @@ async function sendMessage(event) {
     }
 }
 
+// Parse a text/event-stream response body and call onEvent(event, data) per frame
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let event = 'message';
+            let data = '';
+            for (const line of frame.split('\n')) {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            }
+            onEvent(event, data ? JSON.parse(data) : {});
+        }
+    }
+}
+
 function handleKeyDown(event) {
     if (event.key === 'Enter' && !event.shiftKey) {
         event.preventDefault();
@@ -158,6 +222,34 @@ document.getElementById('agentSelector').addEventListener('change', (e) => {
     chatMessages.scrollTo({ top: chatMessages.scrollHeight, behavior: 'smooth' });
 });
 
+function formatDuration(seconds) {
+    if (seconds == null) return '…';
+    if (seconds < 60) return `${Math.round(seconds)}s`;
+    if (seconds < 3600) return `${Math.round(seconds / 60)}m`;
+    return `${(seconds / 3600).toFixed(1)}h`;
+}
+
+function renderBatchProgress(progressDiv, statusData) {
+    const finished = statusData.rows_done + statusData.rows_failed;
+    let text = `⏳ ${finished}/${statusData.rows_total} rows processed`;
+    if (statusData.rows_failed) text += ` (${statusData.rows_failed} failed)`;
+    if (statusData.dedup_ratio) {
+        text += ` · ${statusData.rows_unique} engine calls (${Math.round(statusData.dedup_ratio * 100)}% deduplicated)`;
+    }
+    if (statusData.throughput_rows_per_sec) {
+        text += ` · ${statusData.throughput_rows_per_sec.toFixed(2)} rows/s · ETA ${formatDuration(statusData.eta_seconds)}`;
+    }
+    progressDiv.textContent = text + ' ';
+    if (statusData.partial_result_url) {
+        const link = document.createElement('a');
+        link.href = statusData.partial_result_url;
+        link.textContent = "Download partial results";
+        link.target = "_blank";
+        link.className = "download-link";
+        progressDiv.appendChild(link);
+    }
+}
+
 // === New: Batch Upload Handler ===
 async function uploadBatchFile(event) {
     const agentType = document.getElementById('agentSelector').value;
@@ -195,6 +287,8 @@ async function uploadBatchFile(event) {
         const statusUrl = data.status_url;
 
         addMessage(`✅ Batch job started! Tracking status...`, 'system');
+        addMessage(`⏳ Waiting for a worker...`, 'system');
+        const progressDiv = document.getElementById('chatMessages').lastElementChild;
 
         // Poll job status
         const interval = setInterval(async () => {
@@ -202,8 +296,12 @@ async function uploadBatchFile(event) {
             if (!res.ok) return;
             const statusData = await res.json();
 
-            if (statusData.status === "completed") {
+            if (statusData.status === "running") {
+                renderBatchProgress(progressDiv, statusData);
+            }
+            else if (statusData.status === "completed") {
                 clearInterval(interval);
+                renderBatchProgress(progressDiv, statusData);
                 const link = document.createElement('a');
                 link.href = statusData.result_url;
                 link.textContent = "🔗 Download Result File";
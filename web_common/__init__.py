@@ -0,0 +1 @@
+"""Shared helpers for the doc-spl and dm-gen Flask services."""
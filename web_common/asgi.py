@@ -0,0 +1,210 @@
+"""
+ASGI serving mode for the web apps.
+
+The chat endpoints run natively on asyncio using the Agent Engine async APIs
+(`async_create_session` / `async_stream_query`), so every in-flight chat is a
+coroutine on the worker's event loop rather than a thread or greenlet holding
+a blocking call. They run the same web_common.chat.ChatTurn as the Flask
+views, with its Ops awaited here instead of called, and are timed the same
+way: phase metrics, a Server-Timing header and trace spans, with /metrics
+itself served by the Flask app. Everything else (index page, batch upload,
+status, results) is served by the existing Flask app through a WSGI adapter.
+
+Run with:  gunicorn -w 4 -k uvicorn.workers.UvicornWorker asgi:app
+"""
+
+import asyncio
+import logging
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from . import metrics
+from .chat import SSE_HEADERS, ChatTurn, Op
+from .engine_pool import engine_registry
+from .rate_limit import request_budget, INTERACTIVE, INTERACTIVE_MAX_WAIT
+from .sse import event_text
+from .xql_validator import review_async
+
+logger = logging.getLogger(__name__)
+
+
+async def get_engine(engine_id, registry=engine_registry):
+    """Engine handle without blocking the loop; only a cache miss goes to a thread"""
+    handle = registry.peek(engine_id)
+    if handle is None:
+        handle = await asyncio.to_thread(registry.get, engine_id)
+    return handle
+
+
+async def create_session(agent_engine, user_id):
+    if hasattr(agent_engine, "async_create_session"):
+        return await agent_engine.async_create_session(user_id=user_id)
+    return await asyncio.to_thread(agent_engine.create_session, user_id=user_id)
+
+
+async def stream_query(agent_engine, **kwargs):
+    """Async iterator over stream_query() events"""
+    if hasattr(agent_engine, "async_stream_query"):
+        async for event in agent_engine.async_stream_query(**kwargs):
+            yield event
+        return
+
+    # Engines deployed without the async operations: drain the sync stream on a helper thread
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    end = object()
+
+    def pump():
+        try:
+            for event in agent_engine.stream_query(**kwargs):
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+            loop.call_soon_threadsafe(queue.put_nowait, end)
+        except BaseException as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+
+    pumping = loop.run_in_executor(None, pump)
+    while True:
+        item = await queue.get()
+        if item is end:
+            break
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+    await pumping
+
+
+class AsyncOps:
+    """Ops of a ChatTurn as coroutines that never block the event loop"""
+
+    def __init__(self, response_cache=None, registry=engine_registry, budget=request_budget):
+        self.response_cache = response_cache
+        self.registry = registry
+        self.budget = budget
+
+    async def engine(self, engine_id):
+        return await get_engine(engine_id, self.registry)
+
+    async def invalidate(self, engine_id):
+        self.registry.invalidate(engine_id)
+
+    async def cache_get(self, engine_key, engine_id, message):
+        if self.response_cache is None:
+            return None
+        return await asyncio.to_thread(self.response_cache.get, engine_key, engine_id, message)
+
+    async def cache_put(self, engine_key, engine_id, message, text):
+        if self.response_cache is not None and text:
+            await asyncio.to_thread(self.response_cache.put, engine_key, engine_id, message, text)
+
+    async def create_session(self, agent_engine, user_id):
+        return await create_session(agent_engine, user_id)
+
+    async def acquire(self, engine_id):
+        await self.budget.acquire_async(engine_id, INTERACTIVE, timeout=INTERACTIVE_MAX_WAIT)
+
+    async def open_stream(self, agent_engine, kwargs):
+        return stream_query(agent_engine, **kwargs)
+
+    async def next_event(self, stream):
+        return await anext(stream, None)
+
+    async def review(self, engine_key, engine_id, agent_engine, session_id, text):
+        async def repair_turn(prompt):
+            # One more turn of the chat session; spends a request from the budget like any other
+            await self.acquire(engine_id)
+            last = None
+            async for event in stream_query(agent_engine, message=prompt, user_id="web_app", session_id=session_id):
+                last = event
+            return event_text(last) if last else ""
+
+        return await review_async(engine_key, text, ask=repair_turn)
+
+
+async def drive(steps, ops):
+    """chat.drive() with the async `ops`: yields everything `steps` yield that is not an Op"""
+    value = error = None
+    try:
+        while True:
+            try:
+                step = steps.send(value) if error is None else steps.throw(error)
+            except StopIteration:
+                return
+            value = error = None
+            if not isinstance(step, Op):
+                yield step
+                continue
+            try:
+                value = await getattr(ops, step.name)(*step.args)
+            except Exception as e:
+                error = e
+    finally:
+        steps.close()
+
+
+async def run(steps, ops):
+    """First Reply of `steps`, driven with the async `ops`"""
+    driver = drive(steps, ops)
+    try:
+        return await anext(driver)
+    finally:
+        await driver.aclose()
+
+
+async def _timed_stream(timer, frames):
+    """Pass the frames through, finishing `timer` once they have been sent or abandoned"""
+    try:
+        async for frame in frames:
+            yield frame
+    finally:
+        timer.finish()
+
+
+async def _json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+def create_asgi_app(flask_app, engine_env_map, response_cache=None, registry=engine_registry):
+    """Async chat routes in front of `flask_app`, which serves every other path"""
+    ops = AsyncOps(response_cache, registry=registry)
+
+    async def turn(request, endpoint):
+        engine_key = request.path_params["engine_key"]
+        timer = metrics.RequestTimer(engine_key if engine_key in engine_env_map else None, endpoint)
+        return ChatTurn(engine_key, engine_env_map.get(engine_key), await _json_body(request), timer)
+
+    async def first_reply(chat_turn, steps):
+        try:
+            return await run(steps, ops)
+        except BaseException:
+            chat_turn.timer.finish(500)
+            raise
+
+    async def chat(request):
+        chat_turn = await turn(request, "chat")
+        reply = await first_reply(chat_turn, chat_turn.reply())
+        chat_turn.timer.finish()
+        return JSONResponse(reply.body, status_code=reply.status,
+                            headers={"Server-Timing": chat_turn.timer.server_timing()})
+
+    async def chat_stream(request):
+        chat_turn = await turn(request, "stream")
+        reply = await first_reply(chat_turn, chat_turn.stream())
+        # As in the Flask views, a streamed reply's header only has the setup phases
+        headers = {"Server-Timing": chat_turn.timer.server_timing()}
+        if reply.frames is None:
+            chat_turn.timer.finish()
+            return JSONResponse(reply.body, status_code=reply.status, headers=headers)
+        return StreamingResponse(_timed_stream(chat_turn.timer, drive(reply.frames, ops)),
+                                 media_type="text/event-stream", headers=dict(SSE_HEADERS, **headers))
+
+    return Starlette(routes=[
+        Route("/api/chat/{engine_key}", chat, methods=["POST"]),
+        Route("/api/chat/{engine_key}/stream", chat_stream, methods=["POST"]),
+        Mount("/", app=WSGIMiddleware(flask_app)),
+    ])
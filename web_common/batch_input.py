@@ -0,0 +1,180 @@
+"""
+Row formats accepted by /api/batch_chat.
+
+  csv, one column   the original format: no header, the first column of every
+                    row is the input
+  csv, with header  a header row naming an `input` (or `message`) column, and
+                    optionally `engine`, `session_group` and `id` columns;
+                    any other column is ignored
+  jsonl             one JSON object per line with the same fields, or a bare
+                    JSON string as the input. Multi-line SPL and raw logs need
+                    no quoting beyond JSON's own
+
+`engine` sends the row to another engine (doc, spl, dmgen) than the one in
+the upload URL; a service can route to every engine it has an ID for (see
+batch_engines()). Rows sharing a `session_group` are answered in input order
+in one Agent Engine session, so later rows can refer to earlier answers.
+`id` is copied to the results unchanged.
+
+Raw-log samples for dmgen are clustered by log template as they are read (see
+log_templates): every row of a cluster shares a dedup key, so one engine call
+answers the whole cluster. DMGEN_LOG_CLUSTERING=false keeps per-row keys.
+SPL queries are keyed by their template with literals parameterized (see
+spl_template), and carry_answer() re-instantiates the shared translation with
+each row's own literals. SPL_QUERY_TEMPLATES=false keys them by normalized
+text only.
+
+The format follows the file extension (.jsonl / .ndjson, anything else is
+CSV) unless the request names one with ?format=.
+"""
+
+import os
+import csv
+import json
+
+from .log_templates import LogTemplateMiner
+from .response_cache import normalize_prompt
+from .spl_template import fingerprint, reinstantiate
+from .upload_stream import UploadError
+
+FORMATS = ("csv", "jsonl")
+JSONL_EXTENSIONS = (".jsonl", ".ndjson")
+INPUT_FIELDS = ("input", "message")
+SESSION_FIELDS = ("session_group", "session")
+DMGEN_LOG_CLUSTERING = os.getenv("DMGEN_LOG_CLUSTERING", "true").lower() == "true"
+SPL_QUERY_TEMPLATES = os.getenv("SPL_QUERY_TEMPLATES", "true").lower() == "true"
+# Every engine a batch row may name, by the variable holding its Agent Engine ID
+BATCH_ENGINE_ENV_VARS = {
+    "doc": "DOC_AGENT_ENGINE_ID",
+    "spl": "SPL_AGENT_ENGINE_ID",
+    "dmgen": "DM_AGENT_ENGINE_ID",
+}
+
+
+class BatchInputError(UploadError):
+    """A row of the upload cannot be read; the job fails and the upload gets a 400"""
+
+
+def batch_engines(engine_env_map):
+    """{engine key: engine ID} for every engine configured in this process, plus the service's own"""
+    engines = {key: os.getenv(var) for key, var in BATCH_ENGINE_ENV_VARS.items() if os.getenv(var)}
+    engines.update({key: engine_id for key, engine_id in engine_env_map.items() if engine_id})
+    return engines
+
+
+def carry_answer(engine_key, sent, output, text):
+    """
+    `output`, the answer to `sent`, for a row of the same dedup key whose text
+    is `text`; None when the row needs its own engine call.
+    """
+    if engine_key == "spl":
+        return reinstantiate(sent, output, text)
+    return output
+
+
+def detect_format(filename, requested=None):
+    if requested:
+        if requested not in FORMATS:
+            raise UploadError(f"Unknown batch format '{requested}', expected one of {', '.join(FORMATS)}")
+        return requested
+    return "jsonl" if (filename or "").lower().endswith(JSONL_EXTENSIONS) else "csv"
+
+
+class BatchInput:
+    """
+    Rows of one upload, parsed as they are read from `upload` (a text stream).
+
+    `format` is None for a one-column CSV, whose rows are plain input texts
+    exactly as before; otherwise "csv" or "jsonl" and rows are dicts for
+    JobStore.append_rows().
+    """
+
+    def __init__(self, upload, fmt, default_engine, engines, log_clustering=DMGEN_LOG_CLUSTERING,
+                 spl_templates=SPL_QUERY_TEMPLATES):
+        self.default_engine = default_engine
+        self.engines = engines
+        self.templates = LogTemplateMiner() if log_clustering else None
+        self.spl_templates = spl_templates
+        self.format = fmt
+        self._upload = upload
+        self._columns = None
+        self._first = None
+        if fmt == "csv":
+            self._reader = csv.reader(upload)
+            self._first = next(self._reader, None)
+            header = [cell.strip().lower() for cell in self._first or []]
+            input_column = next((header.index(name) for name in INPUT_FIELDS if name in header), None)
+            if input_column is None:
+                self.format = None
+            else:
+                self._columns = {
+                    "input": input_column,
+                    "engine": header.index("engine") if "engine" in header else None,
+                    "session_group": next((header.index(name) for name in SESSION_FIELDS if name in header), None),
+                    "id": header.index("id") if "id" in header else None,
+                }
+
+    def rows(self):
+        if self.format is None:
+            if self._first:
+                yield self._first[0].strip()
+            for row in self._reader:
+                if row:
+                    yield row[0].strip()
+        elif self.format == "csv":
+            for row in self._reader:
+                if row:
+                    yield self._csv_row(row)
+        else:
+            for line_number, line in enumerate(self._upload, 1):
+                if line.strip():
+                    yield self._jsonl_row(line, line_number)
+
+    def _csv_row(self, row):
+        def cell(column):
+            index = self._columns[column]
+            return row[index].strip() if index is not None and index < len(row) else ""
+
+        return self._row(cell("input"), cell("engine"), cell("session_group"), cell("id"),
+                         f"Row {self._reader.line_num}")
+
+    def _jsonl_row(self, line, line_number):
+        where = f"Line {line_number}"
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise BatchInputError(f"{where}: invalid JSON ({e})") from e
+        if isinstance(record, str):
+            return self._row(record, None, None, None, where)
+        if not isinstance(record, dict):
+            raise BatchInputError(f"{where}: expected a JSON object or string")
+        text = next((record[name] for name in INPUT_FIELDS if name in record), None)
+        if not isinstance(text, str):
+            raise BatchInputError(f"{where}: no '{INPUT_FIELDS[0]}' string")
+        session_group = next((record[name] for name in SESSION_FIELDS if record.get(name) is not None), None)
+        return self._row(text, record.get("engine"), session_group, record.get("id"), where)
+
+    def _row(self, text, engine, session_group, row_id, where):
+        engine_key = str(engine).strip().lower() if engine else self.default_engine
+        if engine_key not in self.engines:
+            raise BatchInputError(f"{where}: unknown engine '{engine_key}', this service has "
+                                  f"{', '.join(sorted(self.engines))}")
+        return {
+            "input": text.strip(),
+            "engine_key": engine_key,
+            "engine_id": self.engines[engine_key],
+            "session_group": None if session_group in (None, "") else str(session_group),
+            "row_id": None if row_id in (None, "") else str(row_id),
+        }
+
+    def dedup_key(self, row):
+        """Rows answered by one engine call share this key; it includes the engine"""
+        text, engine_key = (row, self.default_engine) if isinstance(row, str) else (row["input"], row["engine_key"])
+        query = fingerprint(text) if engine_key == "spl" and self.spl_templates else None
+        if engine_key == "dmgen" and self.templates is not None:
+            key = f"template:{self.templates.add(text)}"
+        elif query is not None:
+            key = f"query:{query}"
+        else:
+            key = normalize_prompt(engine_key, text)
+        return key if isinstance(row, str) else f"{engine_key}:{key}"
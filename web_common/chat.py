@@ -0,0 +1,314 @@
+"""
+One chat turn, written once for both serving modes.
+
+The Flask views (blocking calls under gevent) and the asyncio endpoints in
+web_common.asgi serve /api/chat/<engine_key> and its /stream variant through
+the same ChatTurn. Its steps are generators that yield each engine, cache or
+budget operation they need as an Op; a driver performs the Op and sends the
+result back in, blocking (`drive` with BlockingOps, below) or awaited (the
+async driver and AsyncOps in web_common.asgi). Request validation, the
+response cache, session setup, the XQL review, phase timings and the reply
+format therefore live here, and the two modes only differ in how an Op is
+carried out.
+
+Steps yield, besides Ops, a Reply (a JSON body and status, or SSE frames
+still to be driven) or, while streaming, the SSE frames themselves.
+"""
+
+import logging
+from datetime import datetime
+from collections import namedtuple
+
+from . import metrics
+from .concurrency import is_quota_error
+from .engine_pool import engine_registry
+from .rate_limit import request_budget, RateLimited, INTERACTIVE, INTERACTIVE_MAX_WAIT
+from .response_cache import is_first_turn, with_prior_turn
+from .sse import SseRelay, cached_reply_frames, final_text, format_sse, stream_run_kwargs
+from .xql_validator import review
+
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# `name` is the method of the serving mode's ops object that carries it out
+Op = namedtuple("Op", "name args")
+
+
+def _op(name, *args):
+    return Op(name, args)
+
+
+class Reply:
+    """What a chat endpoint sends: a JSON `body` with `status`, or the steps of an SSE stream in `frames`"""
+
+    def __init__(self, body=None, status=200, frames=None):
+        self.body = body
+        self.status = status
+        self.frames = frames
+
+
+def _replay(frames):
+    yield from frames
+
+
+class ChatTurn:
+    """One /api/chat request; `data` is its JSON body (None if it had none)"""
+
+    def __init__(self, engine_key, engine_id, data, timer, user_id="web_app"):
+        self.engine_key = engine_key
+        self.engine_id = engine_id
+        self.data = data or {}
+        self.timer = timer
+        self.user_id = user_id
+        self.message = (self.data.get("message") or "").strip()
+        self.first_turn = is_first_turn(self.data)
+        self.agent_engine = None
+        self.session_id = None
+        self.query_message = self.message
+
+    def _error(self, error, status, kind=None, **fields):
+        if kind is not None:
+            self.timer.error(kind)
+        self.timer.status = status
+        return Reply(dict({"error": error}, **fields), status)
+
+    def _invalid(self):
+        """Reply for a request that cannot be served at all, else None"""
+        if not self.engine_id:
+            return self._error(f"Unknown engine '{self.engine_key}'", 404)
+        if not self.data:
+            return self._error("No JSON data provided", 400)
+        if not self.message:
+            return self._error("Message is required", 400)
+        return None
+
+    def _cached(self):
+        with self.timer.phase("cache"):
+            return (yield _op("cache_get", self.engine_key, self.engine_id, self.message))
+
+    def _engine(self):
+        with self.timer.phase("engine_get"):
+            self.agent_engine = yield _op("engine", self.engine_id)
+
+    def _session(self):
+        """Session for the turn; a first turn gets a new one, seeded with a cached prior turn if any"""
+        self.session_id = self.data.get("session_id")
+        if not self.session_id:
+            with self.timer.phase("create_session"):
+                session = yield _op("create_session", self.agent_engine, self.user_id)
+            self.session_id = session.get("id")
+            self.query_message = with_prior_turn(self.message, self.data.get("prior_turn"))
+
+    def _budget(self):
+        # Chat draws from the shared project/engine budget ahead of batch rows
+        with self.timer.phase("rate_limit_wait"):
+            yield _op("acquire", self.engine_id)
+
+    def _query(self, on_event=None, **kwargs):
+        """Steps of the turn's stream_query(); `on_event(event)` gives the frames to relay per event"""
+        last = None
+        with self.timer.recording() as recorder:
+            stream = yield _op("open_stream", self.agent_engine, dict(
+                message=self.query_message, user_id=self.user_id, session_id=self.session_id, **kwargs))
+            while True:
+                event = yield _op("next_event", stream)
+                if event is None:
+                    return last
+                recorder.observe(event)
+                last = event
+                if on_event is not None:
+                    yield from on_event(event)
+
+    def _review(self, text):
+        with self.timer.phase("xql_review"):
+            return (yield _op("review", self.engine_key, self.engine_id, self.agent_engine, self.session_id, text))
+
+    def _failed(self, e, context):
+        logger.error(f"Error in {context}: {e}")
+        if not is_quota_error(e):
+            yield _op("invalidate", self.engine_id)
+
+    def reply(self):
+        """Steps of a JSON chat turn, ending with its Reply"""
+        invalid = self._invalid()
+        if invalid is not None:
+            yield invalid
+            return
+        try:
+            if self.first_turn:
+                cached = yield from self._cached()
+                if cached is not None:
+                    logger.info(f"Returning cached response for: {self.message[:100]}...")
+                    yield Reply({"response": cached, "session_id": None, "cached": True,
+                                 "timestamp": datetime.now().isoformat()})
+                    return
+            # The budget comes before the session, so a rate-limited turn leaves no session behind
+            yield from self._engine()
+            yield from self._budget()
+            yield from self._session()
+            logger.info(f"Session {self.session_id} - Received chat message: {self.message[:100]}...")
+
+            result = yield from self._query()  # the last event carries the final answer
+            if not result:
+                yield self._error("No response from agent engine", 500, "no_response")
+                return
+
+            content_parts = result.get("content", {}).get("parts", [])
+            text = content_parts[0].get("text") if content_parts else None
+            if not text:
+                error_msg = result.get("error", "Unknown error")
+                logger.info(f"Returning error: {error_msg}")
+                yield self._error(error_msg, 500, "engine_error", timestamp=result.get("timestamp"))
+                return
+
+            text, xql_report = yield from self._review(text)
+            if self.first_turn:
+                yield _op("cache_put", self.engine_key, self.engine_id, self.message, text)
+            body = {"response": text, "session_id": self.session_id, "timestamp": result.get("timestamp")}
+            if xql_report is not None:
+                body["xql_validation"] = xql_report
+            logger.info(f"Returning response...")
+            yield Reply(body)
+        except RateLimited as e:
+            logger.warning(f"Chat rejected: {e}")
+            yield self._error(str(e), 429, "rate_limited", timestamp=datetime.now().isoformat())
+        except Exception as e:
+            yield from self._failed(e, "chat endpoint")
+            yield self._error(f"Internal server error: {str(e)}", 500, type(e).__name__,
+                              timestamp=datetime.now().isoformat())
+
+    def stream(self):
+        """Steps of a streamed chat turn up to its Reply, whose `frames` relay the answer"""
+        invalid = self._invalid()
+        if invalid is not None:
+            yield invalid
+            return
+        try:
+            if self.first_turn:
+                cached = yield from self._cached()
+                if cached is not None:
+                    logger.info(f"Streaming cached response for: {self.message[:100]}...")
+                    yield Reply(frames=_replay(cached_reply_frames(cached)))
+                    return
+            yield from self._engine()
+            yield from self._budget()
+            yield from self._session()
+        except RateLimited as e:
+            logger.warning(f"Chat stream rejected: {e}")
+            yield self._error(str(e), 429, "rate_limited")
+            return
+        except Exception as e:
+            yield from self._failed(e, "chat stream setup")
+            yield self._error(f"Internal server error: {str(e)}", 500, type(e).__name__)
+            return
+        logger.info(f"Session {self.session_id} - Received streaming chat message: {self.message[:100]}...")
+        yield Reply(frames=self._frames())
+
+    def _frames(self):
+        relay = SseRelay(self.session_id)
+        try:
+            yield from relay.start()
+            yield from self._query(relay.feed, **stream_run_kwargs())
+            if relay.final_text:
+                # The XQL check, and its repair turn, land before `done`
+                text, xql_report = yield from self._review(relay.final_text)
+                yield from relay.review(text, xql_report)
+            for frame in relay.finish():
+                if frame.startswith("event: done"):
+                    logger.info(f"Session {self.session_id} - Stream finished: {frame.splitlines()[1]}")
+                    if self.first_turn:
+                        yield _op("cache_put", self.engine_key, self.engine_id, self.message, relay.final_text)
+                yield frame
+        except Exception as e:
+            self.timer.error(type(e).__name__)
+            self.timer.status = 500
+            yield from self._failed(e, "chat stream")
+            yield format_sse("error", {"error": f"Internal server error: {str(e)}"})
+
+
+class BlockingOps:
+    """Ops of a ChatTurn as plain blocking calls, for the Flask views"""
+
+    def __init__(self, response_cache=None, registry=engine_registry, budget=request_budget):
+        self.response_cache = response_cache
+        self.registry = registry
+        self.budget = budget
+
+    def engine(self, engine_id):
+        return self.registry.get(engine_id)
+
+    def invalidate(self, engine_id):
+        self.registry.invalidate(engine_id)
+
+    def cache_get(self, engine_key, engine_id, message):
+        if self.response_cache is None:
+            return None
+        return self.response_cache.get(engine_key, engine_id, message)
+
+    def cache_put(self, engine_key, engine_id, message, text):
+        if self.response_cache is not None and text:
+            self.response_cache.put(engine_key, engine_id, message, text)
+
+    def create_session(self, agent_engine, user_id):
+        return agent_engine.create_session(user_id=user_id)
+
+    def acquire(self, engine_id):
+        self.budget.acquire(engine_id, INTERACTIVE, timeout=INTERACTIVE_MAX_WAIT)
+
+    def open_stream(self, agent_engine, kwargs):
+        return iter(agent_engine.stream_query(**kwargs))
+
+    def next_event(self, stream):
+        return next(stream, None)
+
+    def review(self, engine_key, engine_id, agent_engine, session_id, text):
+        def repair_turn(prompt):
+            # One more turn of the chat session; spends a request from the budget like any other
+            self.acquire(engine_id)
+            return final_text(agent_engine.stream_query(message=prompt, user_id="web_app", session_id=session_id))
+
+        return review(engine_key, text, ask=repair_turn)
+
+
+def drive(steps, ops):
+    """Run `steps` with the blocking `ops`, yielding everything they yield that is not an Op"""
+    value = error = None
+    try:
+        while True:
+            try:
+                step = steps.send(value) if error is None else steps.throw(error)
+            except StopIteration:
+                return
+            value = error = None
+            if not isinstance(step, Op):
+                yield step
+                continue
+            try:
+                value = getattr(ops, step.name)(*step.args)
+            except Exception as e:
+                error = e
+    finally:
+        steps.close()
+
+
+def run(steps, ops):
+    """First Reply of `steps`, driven with the blocking `ops`"""
+    driver = drive(steps, ops)
+    try:
+        return next(driver)
+    finally:
+        driver.close()
+
+
+# --- Flask integration ---
+
+def flask_reply(turn, ops, stream=False):
+    """Flask response for `turn`, served as JSON or, with `stream`, as Server-Sent Events"""
+    from flask import Response, jsonify, stream_with_context
+
+    reply = run(turn.stream() if stream else turn.reply(), ops)
+    if reply.frames is None:
+        return jsonify(reply.body), reply.status
+    return Response(stream_with_context(metrics.timed_stream(turn.timer, drive(reply.frames, ops))),
+                    mimetype="text/event-stream", headers=SSE_HEADERS)
@@ -0,0 +1,169 @@
+"""
+Adaptive (AIMD) concurrency limit for batch calls to Vertex AI.
+
+The limit grows by one after a full "window" of healthy calls (one success per
+slot in use) and is cut multiplicatively when Vertex AI answers with a quota
+error (429 / ResourceExhausted) or when the error rate spikes. Growth pauses
+while latency sits well above the best level seen so far. Calls rejected for
+quota are retried with full-jitter exponential backoff.
+
+One limiter is shared by every batch job in the process, so two concurrent
+uploads split the capacity instead of doubling the load.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+BATCH_CONCURRENCY_INITIAL = int(os.getenv("BATCH_CONCURRENCY_INITIAL", "5"))
+BATCH_CONCURRENCY_MIN = int(os.getenv("BATCH_CONCURRENCY_MIN", "1"))
+BATCH_CONCURRENCY_MAX = int(os.getenv("BATCH_CONCURRENCY_MAX", "32"))
+QUOTA_MAX_RETRIES = int(os.getenv("QUOTA_MAX_RETRIES", "6"))
+QUOTA_BACKOFF_BASE = float(os.getenv("QUOTA_BACKOFF_BASE", "1.0"))  # seconds
+QUOTA_BACKOFF_CAP = float(os.getenv("QUOTA_BACKOFF_CAP", "60"))  # seconds
+
+QUOTA_MARKERS = ("429", "resource_exhausted", "resourceexhausted", "quota exceeded", "too many requests")
+
+
+def is_quota_error(exc):
+    """True for 429 / ResourceExhausted errors from the Vertex AI clients"""
+    if getattr(exc, "code", None) == 429 or getattr(exc, "status_code", None) == 429:
+        return True
+    if type(exc).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    text = str(exc).lower()
+    return any(marker in text for marker in QUOTA_MARKERS)
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial=BATCH_CONCURRENCY_INITIAL, min_limit=BATCH_CONCURRENCY_MIN,
+                 max_limit=BATCH_CONCURRENCY_MAX, decrease_factor=0.5, latency_tolerance=2.0,
+                 error_rate_threshold=0.2, window=20, max_retries=QUOTA_MAX_RETRIES,
+                 backoff_base=QUOTA_BACKOFF_BASE, backoff_cap=QUOTA_BACKOFF_CAP,
+                 clock=time.monotonic, sleep=time.sleep, seed=None):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(max(initial, self.min_limit), self.max_limit)
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.error_rate_threshold = error_rate_threshold
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._clock = clock
+        self._sleep = sleep
+        self._random = random.Random(seed)
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._successes = 0  # healthy completions since the last limit change
+        self._outcomes = deque(maxlen=window)  # True for non-quota errors
+        self._latency_ewma = None
+        self._latency_floor = None
+        self._last_decrease = float("-inf")
+        self._stats = {"ok": 0, "quota_errors": 0, "errors": 0, "retries": 0, "increases": 0, "decreases": 0}
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= self.limit:
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self, latency=None, outcome="ok"):
+        """Return a slot and feed the call's outcome ('ok', 'quota' or 'error') into the limit"""
+        with self._cond:
+            self._in_flight -= 1
+            if outcome == "quota":
+                self._stats["quota_errors"] += 1
+                self._decrease("quota")
+            elif outcome == "error":
+                self._stats["errors"] += 1
+                self._outcomes.append(True)
+                errors = sum(self._outcomes)
+                if len(self._outcomes) >= self._outcomes.maxlen // 2 and errors / len(self._outcomes) > self.error_rate_threshold:
+                    self._decrease("error rate")
+                    self._outcomes.clear()
+            else:
+                self._stats["ok"] += 1
+                self._outcomes.append(False)
+                self._observe_latency(latency)
+                # Slow responses mean the backend is saturating: hold the limit instead of probing higher
+                if not self._latency_degraded():
+                    self._successes += 1
+                    if self._successes >= self.limit and self.limit < self.max_limit:
+                        self.limit += 1
+                        self._successes = 0
+                        self._stats["increases"] += 1
+            self._cond.notify_all()
+
+    def _observe_latency(self, latency):
+        if latency is None:
+            return
+        self._latency_ewma = latency if self._latency_ewma is None else 0.8 * self._latency_ewma + 0.2 * latency
+        if self._latency_floor is None or self._latency_ewma < self._latency_floor:
+            self._latency_floor = self._latency_ewma
+        else:
+            # Let the floor creep up slowly so one lucky fast call doesn't pin it forever
+            self._latency_floor *= 1.001
+
+    def _latency_degraded(self):
+        return (self._latency_floor is not None
+                and self._latency_ewma > self._latency_floor * self.latency_tolerance)
+
+    def _decrease(self, reason):
+        now = self._clock()
+        # A burst of failures from one overload episode should only cut the limit once
+        if now - self._last_decrease < (self._latency_ewma or 1.0):
+            return
+        new_limit = max(self.min_limit, int(self.limit * self.decrease_factor))
+        if new_limit < self.limit:
+            logger.info(f"Batch concurrency {self.limit} -> {new_limit} ({reason})")
+            self.limit = new_limit
+            self._stats["decreases"] += 1
+        self._last_decrease = now
+        self._successes = 0
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff delay for the given retry attempt"""
+        return self._random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def run(self, fn, *args, before=None, **kwargs):
+        """
+        Call `fn` inside a slot, retrying quota errors with jittered backoff.
+        `before` runs ahead of every attempt without holding a slot, so time
+        spent waiting in it (e.g. on a rate budget) is not taken for latency.
+        """
+        attempt = 0
+        while True:
+            if before is not None:
+                before()
+            self.acquire()
+            started = self._clock()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                quota = is_quota_error(e)
+                self.release(self._clock() - started, "quota" if quota else "error")
+                if not quota or attempt >= self.max_retries:
+                    raise
+                with self._cond:
+                    self._stats["retries"] += 1
+                self._sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+            self.release(self._clock() - started, "ok")
+            return result
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(limit=self.limit, in_flight=self._in_flight, latency_ewma=self._latency_ewma)
+        return stats
+
+
+# Shared by every batch job in this worker process
+batch_limiter = AdaptiveLimiter()
@@ -0,0 +1,101 @@
+"""
+Process-wide registry of Agent Engine handles.
+
+`agent_engines.get()` is a remote resource lookup. The registry resolves each
+engine ID once per worker, keeps the handle for ENGINE_POOL_TTL seconds and
+refreshes it lazily on the next request after expiry. Callers invalidate a
+handle when a call through it fails so the next request re-resolves it.
+"""
+
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+ENGINE_POOL_TTL = float(os.getenv("ENGINE_POOL_TTL", "1800"))  # seconds
+# "fake" serves every engine ID from web_common.fake_engine, for offline benchmarks
+AGENT_ENGINE_BACKEND = os.getenv("AGENT_ENGINE_BACKEND", "vertex")
+
+
+def _default_loader(engine_id):
+    if AGENT_ENGINE_BACKEND == "fake":
+        from .fake_engine import FakeAgentEngine
+        return FakeAgentEngine.from_env()
+    from vertexai import agent_engines
+    return agent_engines.get(engine_id)
+
+
+class EngineRegistry:
+    """Thread-safe cache of engine handles keyed by engine ID."""
+
+    def __init__(self, loader=None, ttl=ENGINE_POOL_TTL, clock=time.monotonic):
+        self._loader = loader or _default_loader
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._entries = {}  # engine_id -> (handle, expires_at)
+        self._stats = {"hits": 0, "misses": 0, "refreshes": 0, "invalidations": 0, "load_errors": 0}
+
+    def _key_lock(self, engine_id):
+        with self._lock:
+            return self._key_locks.setdefault(engine_id, threading.Lock())
+
+    def _lookup(self, engine_id):
+        with self._lock:
+            entry = self._entries.get(engine_id)
+            if entry and entry[1] > self._clock():
+                self._stats["hits"] += 1
+                return entry[0]
+        return None
+
+    def peek(self, engine_id):
+        """Cached handle for `engine_id`, or None if it would need a remote lookup"""
+        return self._lookup(engine_id)
+
+    def get(self, engine_id):
+        """Return the handle for `engine_id`, resolving it on first use or after expiry."""
+        handle = self._lookup(engine_id)
+        if handle is not None:
+            return handle
+
+        # Only one caller per engine ID performs the remote lookup; the rest wait for it.
+        with self._key_lock(engine_id):
+            handle = self._lookup(engine_id)
+            if handle is not None:
+                return handle
+            with self._lock:
+                stale = engine_id in self._entries
+            try:
+                handle = self._loader(engine_id)
+            except Exception:
+                with self._lock:
+                    self._stats["load_errors"] += 1
+                raise
+            with self._lock:
+                self._stats["refreshes" if stale else "misses"] += 1
+                if handle is not None:
+                    self._entries[engine_id] = (handle, self._clock() + self._ttl)
+            logger.info(f"Resolved agent engine {engine_id} ({'refresh' if stale else 'miss'})")
+            return handle
+
+    def invalidate(self, engine_id):
+        """Drop the cached handle so the next `get()` resolves it again."""
+        with self._lock:
+            if self._entries.pop(engine_id, None) is not None:
+                self._stats["invalidations"] += 1
+                logger.info(f"Invalidated agent engine handle {engine_id}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"] + stats["refreshes"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["pid"] = os.getpid()
+        return stats
+
+
+engine_registry = EngineRegistry()
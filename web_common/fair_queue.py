@@ -0,0 +1,53 @@
+"""
+Worker pool that serves batch jobs round-robin.
+
+Each job gets its own queue. Whenever a worker thread frees up it takes the
+next item from the next job in rotation, so a 10k-row upload and a 20-row
+upload submitted a minute later both make progress instead of the small one
+waiting behind the large one.
+"""
+
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+
+
+class RoundRobinDispatcher:
+    def __init__(self, workers, name="batch-worker"):
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()  # job_id -> deque of (future, fn, args); order is the rotation
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True).start()
+
+    def submit(self, job_id, fn, *args):
+        future = Future()
+        with self._cond:
+            self._queues.setdefault(job_id, deque()).append((future, fn, args))
+            self._cond.notify()
+        return future
+
+    def _next(self):
+        with self._cond:
+            while not self._queues:
+                self._cond.wait()
+            job_id, queue = next(iter(self._queues.items()))
+            item = queue.popleft()
+            # Move the job to the back of the rotation (or drop it once drained)
+            del self._queues[job_id]
+            if queue:
+                self._queues[job_id] = queue
+            return item
+
+    def _work(self):
+        while True:
+            future, fn, args = self._next()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def pending(self):
+        with self._cond:
+            return {job_id: len(queue) for job_id, queue in self._queues.items()}
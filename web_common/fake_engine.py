@@ -0,0 +1,227 @@
+"""
+In-process stand-in for a deployed Agent Engine.
+
+Implements the subset of the `agent_engines.AgentEngine` surface the web apps
+use (`create_session`, `delete_session`, `stream_query`) with configurable
+latencies and error injection, so pools, batch runners and benchmarks can be
+exercised offline.
+Query latency is the time to the first token; it is fixed, uniform or
+lognormal around `query_latency`. With `stream_chunks` > 1 the reply is
+generated over that many chunks `chunk_interval` apart and, when streaming
+mode is requested, sent as `partial` events like AdkApp does. With
+`tool_latency` set, each query first makes a retrieve_rag_documentation call
+that takes that long, as a functionCall/functionResponse event pair.
+A simulated project quota (concurrent queries and queries per second) answers
+excess load with 429 ResourceExhausted errors, like Vertex AI does.
+"""
+
+import os
+import time
+import uuid
+import random
+import asyncio
+import threading
+
+
+class ResourceExhausted(Exception):
+    """Mimics google.api_core.exceptions.ResourceExhausted"""
+    code = 429
+
+
+class FakeAgentEngine:
+    def __init__(self, session_latency=0.0, query_latency=0.0, error_rate=0.0, reply=None, seed=None,
+                 quota_concurrency=None, quota_rps=None, load_latency=0.0, strict_sessions=True,
+                 latency_distribution="fixed", latency_spread=0.0, stream_chunks=1, chunk_interval=0.0,
+                 stream_error_rate=0.0, tool_latency=0.0):
+        self.session_latency = session_latency
+        self.query_latency = query_latency
+        # fixed | uniform (query_latency * (1 +/- spread)) | lognormal (median query_latency, sigma spread)
+        self.latency_distribution = latency_distribution
+        self.latency_spread = latency_spread
+        self.stream_chunks = max(1, int(stream_chunks))
+        self.chunk_interval = chunk_interval
+        self.error_rate = error_rate
+        self.stream_error_rate = stream_error_rate  # failure after the first chunk of a reply
+        self.tool_latency = tool_latency
+        self.reply = reply or (lambda message: f"echo: {message}")
+        self.quota_concurrency = quota_concurrency
+        self.quota_rps = quota_rps
+        self.load_latency = load_latency  # extra seconds per query already in flight
+        # Behind several gunicorn workers a session may have been created by another worker's fake engine
+        self.strict_sessions = strict_sessions
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._tokens = float(quota_rps or 0)
+        self._refilled_at = time.monotonic()
+        self.sessions = {}  # session_id -> list of messages sent in it
+        self.calls = {"create_session": 0, "delete_session": 0, "stream_query": 0, "errors": 0, "quota_errors": 0}
+        self.peak_in_flight = 0
+
+    @classmethod
+    def from_env(cls):
+        """Engine configured from FAKE_ENGINE_* env vars (used with AGENT_ENGINE_BACKEND=fake)"""
+        def number(name, default=None):
+            value = os.getenv(name)
+            return float(value) if value else default
+
+        return cls(
+            session_latency=number("FAKE_ENGINE_SESSION_LATENCY", 0.05),
+            query_latency=number("FAKE_ENGINE_QUERY_LATENCY", 1.0),
+            error_rate=number("FAKE_ENGINE_ERROR_RATE", 0.0),
+            quota_concurrency=number("FAKE_ENGINE_QUOTA_CONCURRENCY"),
+            quota_rps=number("FAKE_ENGINE_QUOTA_RPS"),
+            strict_sessions=False,
+            latency_distribution=os.getenv("FAKE_ENGINE_LATENCY_DISTRIBUTION", "fixed"),
+            latency_spread=number("FAKE_ENGINE_LATENCY_SPREAD", 0.0),
+            stream_chunks=number("FAKE_ENGINE_STREAM_CHUNKS", 1),
+            chunk_interval=number("FAKE_ENGINE_CHUNK_INTERVAL", 0.0),
+            stream_error_rate=number("FAKE_ENGINE_STREAM_ERROR_RATE", 0.0),
+            tool_latency=number("FAKE_ENGINE_TOOL_LATENCY", 0.0),
+        )
+
+    def _count(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def _maybe_fail(self, rate=None):
+        rate = self.error_rate if rate is None else rate
+        with self._lock:
+            fail = rate and self._random.random() < rate
+        if fail:
+            self._count("errors")
+            raise RuntimeError("injected fake engine error")
+
+    def sample_latency(self):
+        """Seconds to the first token of one query"""
+        with self._lock:
+            if self.latency_distribution == "uniform":
+                return max(0.0, self.query_latency * self._random.uniform(1 - self.latency_spread, 1 + self.latency_spread))
+            if self.latency_distribution == "lognormal":
+                return self.query_latency * self._random.lognormvariate(0.0, self.latency_spread)
+            return self.query_latency
+
+    def _new_session(self, user_id):
+        self._maybe_fail()
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self.sessions[session_id] = []
+        return {"id": session_id, "user_id": user_id, "app_name": "fake-engine"}
+
+    def create_session(self, user_id):
+        self._count("create_session")
+        time.sleep(self.session_latency)
+        return self._new_session(user_id)
+
+    async def async_create_session(self, user_id):
+        self._count("create_session")
+        await asyncio.sleep(self.session_latency)
+        return self._new_session(user_id)
+
+    def delete_session(self, user_id, session_id):
+        self._count("delete_session")
+        with self._lock:
+            self.sessions.pop(session_id, None)
+
+    def _admit(self):
+        """Apply the simulated quota; returns the number of queries already in flight"""
+        with self._lock:
+            if self.quota_rps:
+                now = time.monotonic()
+                self._tokens = min(self.quota_rps, self._tokens + (now - self._refilled_at) * self.quota_rps)
+                self._refilled_at = now
+            over_rate = self.quota_rps and self._tokens < 1
+            over_concurrency = self.quota_concurrency and self._in_flight >= self.quota_concurrency
+            if over_rate or over_concurrency:
+                self.calls["quota_errors"] += 1
+                raise ResourceExhausted("429 Quota exceeded for aiplatform.googleapis.com")
+            if self.quota_rps:
+                self._tokens -= 1
+            self._in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+            return self._in_flight - 1
+
+    def _start_query(self, message, session_id):
+        self._count("stream_query")
+        with self._lock:
+            if session_id not in self.sessions and self.strict_sessions:
+                raise ValueError(f"Session not found: {session_id}")
+            self.sessions.setdefault(session_id, []).append(message)
+        return self._admit()
+
+    def _end_query(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _reply_event(self, message, text=None, partial=False):
+        if not partial:
+            self._maybe_fail()
+        event = {
+            "author": "fake_agent",
+            "content": {"parts": [{"text": self.reply(message) if text is None else text}], "role": "model"},
+            "timestamp": time.time(),
+        }
+        if partial:
+            event["partial"] = True
+        return event
+
+    @staticmethod
+    def _tool_event(kind, call_id, payload):
+        part = {kind: {"id": call_id, "name": "retrieve_rag_documentation", **payload}}
+        return {"author": "fake_agent", "content": {"parts": [part], "role": "model"}, "timestamp": time.time()}
+
+    def _tool_call(self, message):
+        """(functionCall event, functionResponse event) of one simulated retrieval"""
+        call_id = f"fake-{uuid.uuid4().hex[:12]}"
+        return (self._tool_event("functionCall", call_id, {"args": {"query": message}}),
+                self._tool_event("functionResponse", call_id, {"response": {"result": ["fake passage"]}}))
+
+    def _chunks(self, message):
+        """Deltas the reply is generated in"""
+        text = self.reply(message)
+        size = -(-len(text) // self.stream_chunks) or 1
+        return [text[i:i + size] for i in range(0, len(text), size)] or [text]
+
+    @staticmethod
+    def _streaming(kwargs):
+        return bool((kwargs.get("run_config") or {}).get("streaming_mode"))
+
+    def stream_query(self, message, user_id, session_id=None, **kwargs):
+        others = self._start_query(message, session_id)
+        try:
+            time.sleep(self.sample_latency() + others * self.load_latency)
+            if self.tool_latency:
+                call, response = self._tool_call(message)
+                yield call
+                time.sleep(self.tool_latency)
+                yield response
+            for i, chunk in enumerate(self._chunks(message)):
+                if i == 1:
+                    self._maybe_fail(self.stream_error_rate)
+                if i:
+                    time.sleep(self.chunk_interval)
+                if self._streaming(kwargs) and self.stream_chunks > 1:
+                    yield self._reply_event(message, chunk, partial=True)
+        finally:
+            self._end_query()
+        yield self._reply_event(message)
+
+    async def async_stream_query(self, message, user_id, session_id=None, **kwargs):
+        others = self._start_query(message, session_id)
+        try:
+            await asyncio.sleep(self.sample_latency() + others * self.load_latency)
+            if self.tool_latency:
+                call, response = self._tool_call(message)
+                yield call
+                await asyncio.sleep(self.tool_latency)
+                yield response
+            for i, chunk in enumerate(self._chunks(message)):
+                if i == 1:
+                    self._maybe_fail(self.stream_error_rate)
+                if i:
+                    await asyncio.sleep(self.chunk_interval)
+                if self._streaming(kwargs) and self.stream_chunks > 1:
+                    yield self._reply_event(message, chunk, partial=True)
+        finally:
+            self._end_query()
+        yield self._reply_event(message)
@@ -0,0 +1,391 @@
+"""
+Background runner that drains the batch job queue in a JobStore.
+
+Each gunicorn worker starts one JobRunner. It claims up to JOBS_PER_WORKER
+jobs from the shared SQLite store and feeds their pending rows to a
+round-robin worker pool, so concurrent jobs share capacity fairly. Every call
+goes through the process-wide adaptive limiter and, when configured, the
+cross-worker request budget at batch priority; the budget is drawn before a
+limiter slot is taken, so waiting on it neither holds a slot nor reads as
+engine latency. Each row is checkpointed as it completes and the job's lease
+is kept alive with a heartbeat. If the worker dies, the lease lapses and
+another worker resumes the job from its remaining rows.
+Rows are read from the store a page at a time and at most JOB_INFLIGHT_ROWS of
+a job are dispatched and not yet written, so memory stays flat however large
+the upload. Results are written in input order, so rows that finish ahead of a
+slow one are held in memory; once JOB_MAX_HELD_BACK_ROWS are held, no new rows
+are read until the slow row lands. A job that is still being uploaded is
+drained as its rows arrive and finished once the upload seals it. If the
+upload fails or stops sending rows for JOB_UPLOAD_STALL_SECONDS, the job
+fails.
+Duplicate inputs (same dedup key) are queried once and the answer is fanned
+out to every row in the group, including rows read in later pages: they join
+the call still in flight for their key, or take the answer already stored.
+Rows whose text differs from the one sent are given the answer through the
+optional `adapt` hook, which may rewrite it for the row (an SPL query with
+other literal values) or decline, in which case the row is sent on its own.
+Rows whose answer is already in the response cache (via the optional `lookup`
+hook) complete before dispatch, so they spend no budget and do not skew the
+limiter's latency signal. Each row is stored with the origin of its answer, so
+the job's stats count the engine calls actually made.
+Answers pass through the optional `review` hook, which may send one follow-up
+(e.g. an XQL repair turn) as a call of its own. First-turn answers are handed
+to the optional `remember` hook (the response cache) once reviewed.
+Rows may name their own engine; every engine's rows of a job share its turn on
+the worker pool. Rows of a session group are sent one at a time, in input
+order, to a session opened for the group through the `open_session` hook.
+"""
+
+import os
+import time
+import socket
+import logging
+import threading
+import concurrent.futures
+from collections import deque
+
+from .concurrency import batch_limiter
+from .fair_queue import RoundRobinDispatcher
+from .job_store import JOB_COMPLETED, JOB_FAILED, ORIGIN_CACHE, ORIGIN_CALL, ORIGIN_SHARED, ROW_DONE, ROW_FAILED
+from .rate_limit import BATCH
+from .result_writer import open_result_writer
+
+logger = logging.getLogger(__name__)
+
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+JOBS_PER_WORKER = int(os.getenv("JOBS_PER_WORKER", "2"))
+JOB_INFLIGHT_ROWS = int(os.getenv("JOB_INFLIGHT_ROWS", "256"))
+# Finished rows waiting in the result writer for an earlier row; rows in flight may add up to JOB_INFLIGHT_ROWS more
+JOB_MAX_HELD_BACK_ROWS = int(os.getenv("JOB_MAX_HELD_BACK_ROWS", "1024"))
+JOB_UPLOAD_POLL_INTERVAL = float(os.getenv("JOB_UPLOAD_POLL_INTERVAL", "0.25"))
+JOB_UPLOAD_STALL_SECONDS = float(os.getenv("JOB_UPLOAD_STALL_SECONDS", "300"))
+
+# Result columns of jobs uploaded as JSONL or headed CSV, or written as JSONL; one-column CSV jobs keep Input,Output
+RESULT_FIELDS = ("row", "id", "engine", "session_group", "input", "status", "output")
+
+
+class JobAborted(Exception):
+    """The job was failed elsewhere (its upload broke off) and must not be finished"""
+
+
+class CachedAnswer(concurrent.futures.Future):
+    """Future of an answer taken from the response cache rather than the engine"""
+
+
+class JobRunner:
+    def __init__(self, store, process_row, results_dir, limiter=batch_limiter, budget=None,
+                 lease=JOB_LEASE_SECONDS, poll_interval=JOB_POLL_INTERVAL, jobs_per_worker=JOBS_PER_WORKER, lookup=None,
+                 inflight_rows=JOB_INFLIGHT_ROWS, upload_poll_interval=JOB_UPLOAD_POLL_INTERVAL,
+                 upload_stall=JOB_UPLOAD_STALL_SECONDS, open_session=None, adapt=None, review=None, remember=None,
+                 max_held_back=JOB_MAX_HELD_BACK_ROWS):
+        self.store = store
+        # (input_text, engine_id[, session_id=][, followup=True]) -> output_text
+        self.process_row = process_row
+        self.results_dir = results_dir
+        self.limiter = limiter
+        self.budget = budget  # SharedRateLimiter or None
+        self.lookup = lookup  # (input_text, engine_id) -> cached output or None
+        self.open_session = open_session  # engine_id -> new session ID for a session group
+        # (sent_text, output, row_text, engine_id) -> output for a row sharing the call, or None to send it alone
+        self.adapt = adapt
+        # (output, engine_id, ask) -> output; ask(prompt) sends a follow-up turn and returns its text
+        self.review = review
+        self.remember = remember  # (input_text, engine_id, output) for answers to first turns
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.jobs_per_worker = jobs_per_worker
+        self.inflight_rows = inflight_rows
+        self.max_held_back = max_held_back
+        self.upload_poll_interval = upload_poll_interval
+        self.upload_stall = upload_stall
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        # Threads beyond the limiter's current limit simply wait for a slot
+        self.dispatcher = RoundRobinDispatcher(self.limiter.max_limit)
+        self._active = set()
+        self._active_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="job-runner", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self):
+        """Check the queue now instead of at the next poll"""
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            job = None
+            with self._active_lock:
+                has_capacity = len(self._active) < self.jobs_per_worker
+            if has_capacity:
+                try:
+                    job = self.store.claim_job(self.owner, self.lease)
+                except Exception as e:
+                    logger.error(f"Failed to claim batch job: {e}")
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            with self._active_lock:
+                self._active.add(job["id"])
+            threading.Thread(target=self._run_and_release, args=(job,), name=f"job-{job['id'][:8]}", daemon=True).start()
+
+    def _run_and_release(self, job):
+        try:
+            self.run_job(job)
+        finally:
+            with self._active_lock:
+                self._active.discard(job["id"])
+            self._wake.set()
+
+    def _keep_alive(self, job_id, done):
+        while not done.wait(self.lease / 3):
+            if not self.store.heartbeat(job_id, self.owner):
+                logger.warning(f"Lost lease on batch job {job_id}")
+                return
+
+    def _call(self, text, engine_id, session_id=None, followup=False):
+        kwargs = {}
+        if session_id is not None:
+            kwargs["session_id"] = session_id
+        if followup:
+            kwargs["followup"] = True
+        return self.process_row(text, engine_id, **kwargs)
+
+    def _run_row(self, text, engine_id, session_id=None, followup=False):
+        """One engine call; the budget is drawn before the limiter slot is taken"""
+        before = None
+        if self.budget is not None:
+            before = lambda: self.budget.acquire(engine_id, BATCH)
+        return self.limiter.run(self._call, text, engine_id, session_id, followup, before=before)
+
+    def _answer(self, text, engine_id, session_id=None, first_turn=True):
+        """Reviewed answer to a row; rows of a session group come with their session"""
+        output = self._run_row(text, engine_id, session_id)
+        if self.review is not None:
+            try:
+                output = self.review(output, engine_id,
+                                     lambda prompt: self._run_row(prompt, engine_id, session_id, followup=True))
+            except Exception as e:
+                logger.warning(f"Reviewing a batch answer failed: {e}")
+        if first_turn and self.remember is not None:
+            try:
+                self.remember(text, engine_id, output)
+            except Exception as e:
+                logger.warning(f"Response cache store failed: {e}")
+        return output
+
+    def _run_session_row(self, job_id, text, engine_id, session_group):
+        """Next turn of a session group, in the session its first row opened"""
+        session_id = self.store.group_session(job_id, engine_id, session_group)
+        if session_id is None and self.open_session is not None:
+            session_id = self.open_session(engine_id)
+            self.store.save_group_session(job_id, engine_id, session_group, session_id)
+        return self._answer(text, engine_id, session_id, first_turn=False)
+
+    def _cached(self, text, engine_id):
+        """Already-completed future for a cache hit, or None"""
+        if self.lookup is None:
+            return None
+        try:
+            output = self.lookup(text, engine_id)
+        except Exception as e:
+            logger.warning(f"Response cache lookup failed: {e}")
+            return None
+        if output is None:
+            return None
+        future = CachedAnswer()
+        future.set_result(output)
+        return future
+
+    def _submit(self, job, text, rows):
+        engine_id = rows[0]["engine_id"] or job["engine_id"]
+        session_group = rows[0]["session_group"]
+        if session_group is not None:
+            # Not a first turn, so neither looked up in nor stored to the response cache
+            return self.dispatcher.submit(job["id"], self._run_session_row, job["id"], text, engine_id, session_group)
+        future = self._cached(text, engine_id)
+        if future is None:
+            future = self.dispatcher.submit(job["id"], self._answer, text, engine_id)
+        return future
+
+    def _adapted(self, job, sent, output, row):
+        """`output`, the answer to `sent`, for `row`; None when the row must be sent itself"""
+        if self.adapt is None or row["input"] == sent:
+            return output
+        try:
+            return self.adapt(sent, output, row["input"], row["engine_id"] or job["engine_id"])
+        except Exception as e:
+            logger.warning(f"Adapting a shared answer failed: {e}")
+            return None
+
+    def _finish_rows(self, job, writer, rows, sent, output, failed, origin=ORIGIN_SHARED):
+        """
+        Complete `rows` with `output`, the answer to `sent`, which reached the first row by `origin`;
+        returns the rows it could not be carried over to
+        """
+        answers, unanswered = {}, []
+        for row in rows:
+            answer = output if failed else self._adapted(job, sent, output, row)
+            if answer is None:
+                unanswered.append(row)
+            else:
+                answers.setdefault(answer, []).append(row)
+        for answer, answered in answers.items():
+            self.store.complete_rows(job["id"], [row["idx"] for row in answered], answer, failed=failed,
+                                     origin=origin if answered[0] is rows[0] else ORIGIN_SHARED)
+            for row in answered:
+                writer.add(row["idx"], *self._result(job, row, answer, ROW_FAILED if failed else ROW_DONE))
+        return unanswered
+
+    @staticmethod
+    def _key_of(rows):
+        row = rows[0]
+        return None if row["dedup_key"] is None else (row["engine_id"], row["dedup_key"])
+
+    @staticmethod
+    def _session_of(rows):
+        row = rows[0]
+        return None if row["session_group"] is None else (row["engine_id"], row["session_group"])
+
+    def run_job(self, job):
+        job_id = job["id"]
+        done = threading.Event()
+        threading.Thread(target=self._keep_alive, args=(job_id, done), daemon=True).start()
+        try:
+            logger.info(f"Running batch job {job_id}: {job['total_rows']} rows stored"
+                        f"{'' if job.get('sealed', True) else ', upload in progress'}")
+            with self.open_writer(job) as writer:
+                self._drain(job, writer)
+            self.store.finish_job(job_id, JOB_COMPLETED)
+            logger.info(f"Batch job {job_id} completed")
+        except JobAborted as e:
+            logger.warning(f"Batch job {job_id} stopped: {e}")
+        except Exception as e:
+            logger.error(f"Batch job {job_id} failed: {e}")
+            self.store.finish_job(job_id, JOB_FAILED, error=str(e))
+        finally:
+            done.set()
+
+    def _upload_complete(self, job_id):
+        """Whether every row of the job is stored; raises when its upload broke off"""
+        state = self.store.job_state(job_id)
+        if state is None:
+            raise JobAborted("job no longer exists")
+        status, sealed, updated_at, error = state
+        if status == JOB_FAILED:
+            raise JobAborted(error or "failed elsewhere")
+        if not sealed and time.time() - updated_at > self.upload_stall:
+            raise RuntimeError(f"Upload stalled: no rows for {self.upload_stall:.0f}s")
+        return sealed
+
+    def _drain(self, job, writer):
+        """
+        Answer the job's pending rows, at most `inflight_rows` at a time, until its input is complete.
+        No rows are read while `max_held_back` finished ones wait in `writer` for an earlier row.
+        """
+        job_id = job["id"]
+        outstanding = {}  # future -> [row, ...]
+        # (engine ID, session group) -> rows read but waiting for the group's previous turn to finish
+        waiting = {}
+        calls = {}  # (engine ID, dedup key) -> future of the call answering that key
+        in_flight = 0
+        after = -1
+        try:
+            while True:
+                # Read the seal before the rows: a job sealed after this still gets one more pass
+                sealed = self._upload_complete(job_id)
+                groups = []
+                # The row the writer waits for is outstanding, unless the held rows were checkpointed
+                # by an earlier run and it has not been read yet: then reading has to go on
+                held_back = writer.held_back >= self.max_held_back and bool(outstanding)
+                if in_flight < self.inflight_rows and not held_back:
+                    groups = self.store.pending_groups(job_id, after=after, limit=self.inflight_rows - in_flight)
+                for text, rows in groups:
+                    after = max(after, rows[-1]["idx"])
+                    key = self._key_of(rows)
+                    if key in calls:
+                        outstanding[calls[key]].extend(rows)
+                        in_flight += len(rows)
+                        continue
+                    if key is not None:
+                        answer = self.store.answer_for(job_id, *key)
+                        if answer is not None:
+                            for row in self._finish_rows(job, writer, rows, *answer, False):
+                                in_flight += 1
+                                outstanding[self._submit(job, row["input"], [row])] = [row]
+                            continue
+                    in_flight += len(rows)
+                    session = self._session_of(rows)
+                    if session in waiting:
+                        waiting[session].append((text, rows))
+                        continue
+                    if session is not None:
+                        waiting[session] = deque()
+                    future = self._submit(job, text, rows)
+                    outstanding[future] = rows
+                    if key is not None:
+                        calls[key] = future
+                if not outstanding:
+                    if groups:
+                        continue  # the whole page was answered already; read the next one
+                    if sealed:
+                        return
+                    time.sleep(self.upload_poll_interval)
+                    continue
+                finished, _ = concurrent.futures.wait(
+                    outstanding, timeout=None if sealed else self.upload_poll_interval,
+                    return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+                for future in finished:
+                    rows = outstanding.pop(future)
+                    in_flight -= len(rows)
+                    try:
+                        output, failed = future.result(), False
+                    except Exception as e:
+                        output, failed = f"ERROR: {str(e)}", True
+                    origin = ORIGIN_CACHE if isinstance(future, CachedAnswer) else ORIGIN_CALL
+                    for row in self._finish_rows(job, writer, rows, rows[0]["input"], output, failed, origin):
+                        in_flight += 1
+                        outstanding[self._submit(job, row["input"], [row])] = [row]
+                    if calls.get(self._key_of(rows)) is future:
+                        del calls[self._key_of(rows)]
+                    session = self._session_of(rows)
+                    if session is not None:
+                        if waiting[session]:
+                            text, next_rows = waiting[session].popleft()
+                            outstanding[self._submit(job, text, next_rows)] = next_rows
+                        else:
+                            del waiting[session]
+        finally:
+            for future in outstanding:
+                future.cancel()
+
+    @staticmethod
+    def _detailed(job):
+        return bool(job.get("input_format")) or job["output_filename"].endswith(".jsonl")
+
+    def _result(self, job, row, output, status):
+        """Fields of a finished row in the job's result file"""
+        if not self._detailed(job):
+            return row["input"], output
+        return (row["idx"], row["row_id"], row["engine_key"] or job["engine_key"], row["session_group"],
+                row["input"], status, output)
+
+    def open_writer(self, job):
+        """Result file for `job`, pre-filled with rows checkpointed by earlier runs"""
+        writer = open_result_writer(os.path.join(self.results_dir, job["output_filename"]),
+                                    RESULT_FIELDS if self._detailed(job) else ("Input", "Output"))
+        for row in self.store.iter_finished(job["id"]):
+            writer.add(row["idx"], *self._result(job, row, row["output"], row["status"]))
+        return writer
@@ -0,0 +1,379 @@
+"""
+SQLite-backed store for batch jobs.
+
+Every uploaded row is persisted before it is queried and checkpointed as soon
+as its answer comes back, so a job interrupted by a worker restart resumes
+from the rows that are still pending instead of starting over. Any gunicorn
+worker can claim a queued job, or a running job whose owner stopped sending
+heartbeats.
+
+An upload is stored as it arrives: open_job() creates the job, append_rows()
+commits its rows a batch at a time and seal_job() marks the input complete.
+Runners may start on a job before it is sealed; they keep polling it for new
+rows until it is.
+
+Rows whose inputs normalize to the same dedup key are answered by a single
+engine call; the answer is written back to every row in the group. Each
+finished row records where its answer came from (its own call, the response
+cache, or another row's call), so get_job() reports the calls actually made.
+
+An answer is also reused for rows of the same group that are read in a
+later page, or after a restart (see answer_for()).
+
+A row may name its own engine, a session group and a caller-supplied id (see
+batch_input). Rows of a session group are never deduplicated: each is a turn
+of the conversation held in the group's session, whose ID is stored here so a
+resumed job carries on in the same session.
+"""
+
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    engine_key TEXT NOT NULL,
+    engine_id TEXT NOT NULL,
+    output_filename TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    total_rows INTEGER NOT NULL DEFAULT 0,
+    sealed INTEGER NOT NULL DEFAULT 1,
+    input_format TEXT,
+    owner TEXT,
+    heartbeat REAL,
+    started_at REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rows (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    input TEXT NOT NULL,
+    output TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    finished_at REAL,
+    dedup_key TEXT,
+    engine_key TEXT,
+    engine_id TEXT,
+    session_group TEXT,
+    row_id TEXT,
+    origin TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    job_id TEXT NOT NULL,
+    engine_id TEXT NOT NULL,
+    session_group TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    PRIMARY KEY (job_id, engine_id, session_group)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+# Created after MIGRATIONS, as they index migrated columns
+INDEXES = """
+CREATE INDEX IF NOT EXISTS rows_dedup ON rows (job_id, dedup_key);
+"""
+
+# Columns added after the first release: (table, column, declaration). Applied to older databases on open.
+MIGRATIONS = [
+    ("jobs", "started_at", "REAL"),
+    ("rows", "finished_at", "REAL"),
+    ("rows", "dedup_key", "TEXT"),
+    ("jobs", "sealed", "INTEGER NOT NULL DEFAULT 1"),
+    ("jobs", "input_format", "TEXT"),
+    ("rows", "engine_key", "TEXT"),
+    ("rows", "engine_id", "TEXT"),
+    ("rows", "session_group", "TEXT"),
+    ("rows", "row_id", "TEXT"),
+    ("rows", "origin", "TEXT"),
+]
+
+# Uploaded rows are committed in batches of this many rows or bytes, or whatever arrived within this many seconds
+APPEND_BATCH_ROWS = 500
+APPEND_BATCH_BYTES = 1024 * 1024
+APPEND_BATCH_SECONDS = 0.5
+
+# Row states: pending -> done | failed. Failed rows keep their error text as output and are not retried.
+ROW_PENDING, ROW_DONE, ROW_FAILED = "pending", "done", "failed"
+# Where a finished row's answer came from: an engine call for it, the response cache, or another row's call
+ORIGIN_CALL, ORIGIN_CACHE, ORIGIN_SHARED = "call", "cache", "shared"
+# Job states, as reported by /api/batch_status
+JOB_PENDING, JOB_RUNNING, JOB_COMPLETED, JOB_FAILED = "pending", "running", "completed", "failed"
+
+
+class JobStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        for table, column, decl in MIGRATIONS:
+            columns = {r["name"] for r in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+        conn.executescript(INDEXES)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _connect(self, immediate=False):
+        """Yield this thread's connection inside a transaction"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def create_job(self, job_id, engine_key, engine_id, output_filename, inputs, dedup_key=None):
+        """
+        Persist a job and all of its input rows; returns the number of rows.
+
+        `dedup_key(text)` maps inputs that should share one answer to the same
+        key. Without it every row is queried on its own.
+        """
+        self.open_job(job_id, engine_key, engine_id, output_filename)
+        self.append_rows(job_id, inputs, dedup_key)
+        return self.seal_job(job_id)
+
+    def open_job(self, job_id, engine_key, engine_id, output_filename, input_format=None):
+        """
+        Create a job whose rows are still to come; it is queued, but not
+        finished until seal_job(). `input_format` is None for one-column
+        uploads, otherwise the BatchInput format whose rows carry their own
+        engine, session group and id.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, engine_key, engine_id, output_filename, status, sealed, input_format,"
+                " created_at, updated_at) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?)",
+                (job_id, engine_key, engine_id, output_filename, JOB_PENDING, input_format, now, now),
+            )
+
+    def append_rows(self, job_id, inputs, dedup_key=None, first_idx=0):
+        """
+        Persist rows numbered from `first_idx` as `inputs` yields them,
+        committing every APPEND_BATCH_ROWS rows, APPEND_BATCH_BYTES bytes or
+        APPEND_BATCH_SECONDS so runners see them while the rest is still
+        arriving. Returns the number of rows added.
+
+        An input is the text to send to the job's engine, or a dict with an
+        `input` and any of `engine_key`, `engine_id`, `session_group` and
+        `row_id`. `dedup_key(input)` is called with each input as yielded.
+        """
+        batch, size, started, idx = [], 0, time.monotonic(), first_idx
+        for item in inputs:
+            row = {"input": item} if isinstance(item, str) else item
+            text = row["input"]
+            key = dedup_key(item) if dedup_key and not row.get("session_group") else None
+            batch.append((job_id, idx, text, key, row.get("engine_key"), row.get("engine_id"),
+                          row.get("session_group"), row.get("row_id")))
+            size += len(text)
+            idx += 1
+            if (len(batch) >= APPEND_BATCH_ROWS or size >= APPEND_BATCH_BYTES
+                    or time.monotonic() - started >= APPEND_BATCH_SECONDS):
+                self._insert_rows(job_id, batch)
+                batch, size, started = [], 0, time.monotonic()
+                # Under gevent a fast upload never blocks on the socket; yield so the runner picks the batch up
+                time.sleep(0)
+        if batch:
+            self._insert_rows(job_id, batch)
+        return idx - first_idx
+
+    def _insert_rows(self, job_id, batch):
+        with self._connect(immediate=True) as conn:
+            conn.executemany(
+                "INSERT INTO rows (job_id, idx, input, dedup_key, engine_key, engine_id, session_group, row_id)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                batch,
+            )
+            conn.execute(
+                "UPDATE jobs SET total_rows = total_rows + ?, updated_at = ? WHERE id = ?",
+                (len(batch), time.time(), job_id),
+            )
+
+    def seal_job(self, job_id):
+        """Mark the job's input complete; returns its number of rows"""
+        with self._connect(immediate=True) as conn:
+            conn.execute("UPDATE jobs SET sealed = 1, updated_at = ? WHERE id = ?", (time.time(), job_id))
+            return conn.execute("SELECT total_rows FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+
+    def claim_job(self, owner, lease):
+        """Take the oldest pending job, or a running one whose owner's lease expired"""
+        now = time.time()
+        with self._connect(immediate=True) as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? OR (status = ? AND heartbeat < ?)"
+                " ORDER BY created_at LIMIT 1",
+                (JOB_PENDING, JOB_RUNNING, now - lease),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, heartbeat = ?, started_at = ?, updated_at = ? WHERE id = ?",
+                (JOB_RUNNING, owner, now, now, now, row["id"]),
+            )
+        job = dict(row)
+        job.update(status=JOB_RUNNING, owner=owner, heartbeat=now, started_at=now)
+        return job
+
+    def heartbeat(self, job_id, owner):
+        """Extend the lease; returns False if another worker has taken the job over"""
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND owner = ? AND status = ?",
+                (time.time(), job_id, owner, JOB_RUNNING),
+            )
+        return cur.rowcount == 1
+
+    def pending_groups(self, job_id, after=-1, limit=None):
+        """
+        Pending rows grouped by engine and dedup key: [(input, [row, ...])],
+        each row a dict of its idx, input, dedup_key, engine_key, engine_id,
+        session_group and row_id.
+
+        The first row's input is the one sent to the engine. Groups are ordered
+        by their first row, so results still arrive roughly in input order.
+        `after` and `limit` page through the rows by index; rows are only
+        grouped with others in the same page.
+        """
+        groups = {}
+        with self._connect() as conn:
+            for r in conn.execute(
+                "SELECT idx, input, dedup_key, engine_key, engine_id, session_group, row_id FROM rows"
+                " WHERE job_id = ? AND status = ? AND idx > ? ORDER BY idx LIMIT ?",
+                (job_id, ROW_PENDING, after, -1 if limit is None else limit),
+            ):
+                row = dict(r)
+                key = (row["engine_id"], row["dedup_key"]) if row["dedup_key"] is not None else ("row", row["idx"])
+                groups.setdefault(key, []).append(row)
+        return [(rows[0]["input"], rows) for rows in groups.values()]
+
+    def answer_for(self, job_id, engine_id, dedup_key):
+        """(input, output) of an already answered row of the job with this engine and dedup key, or None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT input, output FROM rows WHERE job_id = ? AND dedup_key = ? AND engine_id IS ? AND status = ? "
+                "LIMIT 1",
+                (job_id, dedup_key, engine_id, ROW_DONE),
+            ).fetchone()
+        return None if row is None else (row["input"], row["output"])
+
+    def group_session(self, job_id, engine_id, session_group):
+        """Session ID the job's `session_group` is held in on `engine_id`, or None before its first row"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT session_id FROM sessions WHERE job_id = ? AND engine_id = ? AND session_group = ?",
+                (job_id, engine_id, session_group),
+            ).fetchone()
+        return None if row is None else row["session_id"]
+
+    def save_group_session(self, job_id, engine_id, session_group, session_id):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (job_id, engine_id, session_group, session_id) VALUES (?, ?, ?, ?)",
+                (job_id, engine_id, session_group, session_id),
+            )
+
+    def complete_rows(self, job_id, idxs, output, failed=False, origin=ORIGIN_CALL):
+        """
+        Record one answer for every row in a dedup group in a single
+        transaction. The first row got it by `origin`; the others share it.
+        """
+        now = time.time()
+        status = ROW_FAILED if failed else ROW_DONE
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE rows SET output = ?, status = ?, finished_at = ?, origin = ? WHERE job_id = ? AND idx = ?",
+                [(output, status, now, origin if i == 0 else ORIGIN_SHARED, job_id, idx) for i, idx in enumerate(idxs)],
+            )
+
+    def iter_finished(self, job_id):
+        """Finished rows in input order, as dicts of every row column"""
+        conn = self._conn()
+        cur = conn.execute(
+            "SELECT * FROM rows WHERE job_id = ? AND status != ? ORDER BY idx",
+            (job_id, ROW_PENDING),
+        )
+        for r in cur:
+            yield dict(r)
+
+    def finish_job(self, job_id, status, error=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+
+    def job_state(self, job_id):
+        """(status, sealed, updated_at, error) of a job, or None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT status, sealed, updated_at, error FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return None if row is None else (row["status"], bool(row["sealed"]), row["updated_at"], row["error"])
+
+    def get_job(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM rows WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+            origins = dict(conn.execute(
+                "SELECT COALESCE(origin, ?), COUNT(*) FROM rows WHERE job_id = ? AND status != ? GROUP BY 1",
+                (ORIGIN_CALL, job_id, ROW_PENDING),
+            ).fetchall())
+            finished_this_run = 0
+            if row["started_at"]:
+                finished_this_run = conn.execute(
+                    "SELECT COUNT(*) FROM rows WHERE job_id = ? AND finished_at >= ?",
+                    (job_id, row["started_at"]),
+                ).fetchone()[0]
+        job = dict(row)
+        job["rows_done"] = counts.get(ROW_DONE, 0)
+        job["rows_failed"] = counts.get(ROW_FAILED, 0)
+        job["rows_pending"] = counts.get(ROW_PENDING, 0)
+        # Engine calls made for the finished rows, and the share of those rows answered by another row's call
+        finished = job["rows_done"] + job["rows_failed"]
+        job["unique_rows"] = origins.get(ORIGIN_CALL, 0)
+        job["dedup_ratio"] = round(origins.get(ORIGIN_SHARED, 0) / finished, 4) if finished else 0.0
+
+        # Throughput counts only rows finished since the job was last (re)started, so a resume doesn't inflate it
+        job["throughput"] = None
+        job["eta_seconds"] = None
+        if job["started_at"]:
+            end = time.time() if job["status"] == JOB_RUNNING else job["updated_at"]
+            elapsed = max(end - job["started_at"], 1e-6)
+            if finished_this_run:
+                job["throughput"] = round(finished_this_run / elapsed, 3)
+                job["eta_seconds"] = round(job["rows_pending"] / job["throughput"], 1)
+        return job
+
+    def queue_depth(self):
+        """{job state: (jobs, pending rows)} for jobs that are queued or running"""
+        depth = {JOB_PENDING: (0, 0), JOB_RUNNING: (0, 0)}
+        with self._connect() as conn:
+            for r in conn.execute(
+                "SELECT j.status, COUNT(DISTINCT j.id), COUNT(r.idx) FROM jobs j"
+                " LEFT JOIN rows r ON r.job_id = j.id AND r.status = ?"
+                " WHERE j.status IN (?, ?) GROUP BY j.status",
+                (ROW_PENDING, JOB_PENDING, JOB_RUNNING),
+            ):
+                depth[r[0]] = (r[1], r[2])
+        return depth
@@ -0,0 +1,157 @@
+"""
+Online log-template mining (Drain) for dm-gen batches.
+
+Raw-log exports are dominated by lines that share one template and differ
+only in timestamps, addresses and IDs. The miner assigns each sample to a
+template cluster as it is read. Batch rows of one cluster share a dedup key,
+so one representative is sent to the agent and the data model rule it
+generates is written back to every member row.
+
+Drain (He et al., ICWS 2017) works in a single pass with a fixed-depth
+tree:
+  1. Variable fields are masked first (<TS>, <IP>, <UUID>, <HEX>, <NUM>, ...),
+     so lines that differ only in them look the same.
+  2. Lines are routed by token count, then by their first LOG_CLUSTER_DEPTH - 2
+     tokens. Tokens with digits, and tokens beyond LOG_CLUSTER_MAX_CHILDREN
+     per node, share a wildcard branch.
+  3. In the leaf, a line joins the cluster whose template has the largest
+     share of equal tokens, if that share is at least
+     LOG_CLUSTER_SIMILARITY; positions where they differ become <*>.
+     Otherwise it starts a new cluster.
+
+Preview how a file of samples clusters with
+
+    python -m web_common.log_templates samples.log [--top 20]
+"""
+
+import os
+import re
+import argparse
+from collections import Counter
+
+LOG_CLUSTER_SIMILARITY = float(os.getenv("LOG_CLUSTER_SIMILARITY", "0.5"))
+LOG_CLUSTER_DEPTH = int(os.getenv("LOG_CLUSTER_DEPTH", "4"))
+LOG_CLUSTER_MAX_CHILDREN = int(os.getenv("LOG_CLUSTER_MAX_CHILDREN", "100"))
+
+WILDCARD = "<*>"
+# Earlier patterns win, so timestamps are masked before their parts look like numbers
+MASKS = [
+    ("<TS>", re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?")),
+    ("<TS>", re.compile(r"\b[A-Z][a-z]{2} +\d{1,2} \d{2}:\d{2}:\d{2}\b")),
+    ("<TS>", re.compile(r"\b\d{2}/[A-Z][a-z]{2}/\d{4}:\d{2}:\d{2}:\d{2}(?: [+-]\d{4})?")),
+    ("<TS>", re.compile(r"\b\d{1,2}:\d{2}:\d{2}(?:[.,]\d+)?\b")),
+    ("<UUID>", re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b")),
+    ("<MAC>", re.compile(r"\b[0-9a-fA-F]{2}(?:[:-][0-9a-fA-F]{2}){5}\b")),
+    ("<IP>", re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}(?::\d{1,5})?\b")),
+    ("<IP>", re.compile(r"\b[0-9a-fA-F]{1,4}(?::[0-9a-fA-F]{0,4}){2,7}\b")),
+    ("<EMAIL>", re.compile(r"\b[\w.+-]+@[\w-]+(?:\.[\w-]+)+\b")),
+    ("<HEX>", re.compile(r"\b0x[0-9a-fA-F]+\b|\b(?=[0-9a-fA-F]*\d)[0-9a-fA-F]{12,}\b")),
+    ("<NUM>", re.compile(r"(?<![\w.])[-+]?\d+(?:\.\d+)?(?![\w.])")),
+]
+
+
+# One pass over the text; at each position the alternatives are tried in MASKS order
+MASK_PATTERN = re.compile("|".join(f"(?P<m{i}>{pattern.pattern})" for i, (_, pattern) in enumerate(MASKS)))
+MASK_TOKENS = {f"m{i}": token for i, (token, _) in enumerate(MASKS)}
+
+
+def mask(text):
+    return MASK_PATTERN.sub(lambda m: MASK_TOKENS[m.lastgroup], text)
+
+
+def has_digits(token):
+    return any(c.isdigit() for c in token)
+
+
+class LogCluster:
+    __slots__ = ("cluster_id", "template", "size")
+
+    def __init__(self, cluster_id, template):
+        self.cluster_id = cluster_id
+        self.template = template
+        self.size = 1
+
+    @property
+    def text(self):
+        return " ".join(self.template)
+
+
+class LogTemplateMiner:
+    """Drain parse tree; add() returns the ID of the cluster a sample joins"""
+
+    def __init__(self, similarity=LOG_CLUSTER_SIMILARITY, depth=LOG_CLUSTER_DEPTH,
+                 max_children=LOG_CLUSTER_MAX_CHILDREN):
+        self.similarity = similarity
+        self.depth = max(depth, 3)
+        self.max_children = max_children
+        self.root = {}  # token count -> prefix tree whose leaves are lists of clusters
+        self.clusters = []
+
+    @staticmethod
+    def tokens(text):
+        return mask(text).split()
+
+    def _leaf(self, tokens):
+        """Clusters in the leaf for `tokens`, creating the path as needed"""
+        node = self.root.setdefault(len(tokens), {})
+        prefix = tokens[:self.depth - 2]
+        for i, token in enumerate(prefix):
+            key = WILDCARD if has_digits(token) else token
+            if key not in node and len(node) >= self.max_children:
+                key = WILDCARD
+            default = [] if i == len(prefix) - 1 else {}
+            node = node.setdefault(key, default)
+        if not prefix:
+            node = node.setdefault(WILDCARD, [])
+        return node
+
+    @staticmethod
+    def _score(template, tokens):
+        """(share of equal tokens, wildcards) of a template against a sample of the same length"""
+        equal = wildcards = 0
+        for expected, token in zip(template, tokens):
+            if expected == WILDCARD:
+                wildcards += 1
+            elif expected == token:
+                equal += 1
+        return (equal / len(tokens) if tokens else 1.0), wildcards
+
+    def add(self, text):
+        tokens = self.tokens(text)
+        leaf = self._leaf(tokens)
+        best, best_score = None, (-1.0, -1)
+        for cluster in leaf:
+            score = self._score(cluster.template, tokens)
+            if score > best_score:
+                best, best_score = cluster, score
+        if best is not None and best_score[0] >= self.similarity:
+            best.template = [t if t == token else WILDCARD for t, token in zip(best.template, tokens)]
+            best.size += 1
+            return best.cluster_id
+        cluster = LogCluster(len(self.clusters), tokens)
+        self.clusters.append(cluster)
+        leaf.append(cluster)
+        return cluster.cluster_id
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="log samples, one per line")
+    parser.add_argument("--top", type=int, default=20, help="largest clusters to print")
+    parser.add_argument("--similarity", type=float, default=LOG_CLUSTER_SIMILARITY)
+    args = parser.parse_args(argv)
+    miner = LogTemplateMiner(similarity=args.similarity)
+    lines = 0
+    with open(args.path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.strip():
+                miner.add(line)
+                lines += 1
+    print(f"{lines} samples, {len(miner.clusters)} templates")
+    sizes = Counter({cluster.cluster_id: cluster.size for cluster in miner.clusters})
+    for cluster_id, size in sizes.most_common(args.top):
+        print(f"{size:>8}  {miner.clusters[cluster_id].text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,493 @@
+"""
+Prometheus metrics and per-request phase timings for the web services.
+
+Every gunicorn worker keeps its own counters, gauges and histograms and
+writes them to METRICS_DIR/<service>-<host>-<pid>-<start>.json every
+METRICS_FLUSH_SECONDS; <start> tells apart the runs of workers that got the
+same pid. /metrics, on whichever worker serves it, merges its service's files
+into one text exposition. A scrape therefore sees totals for the whole
+service. Counters and histograms are summed over every file, including
+workers that have exited, so they never go down. Gauges only count workers
+still running. The counters and histograms of exited workers of this host are
+folded into <service>-<host>-exited.json and their own files removed, so the
+directory does not grow with every restart.
+
+A RequestTimer follows one chat request or batch row through its phases:
+engine lookup, cache lookup, session creation, rate-limit wait, tool calls
+and generation. It feeds them into xsiam_request_phase_seconds and, for
+chat, renders them as a Server-Timing header. Tool time runs from the event
+carrying a function call to the event carrying its response. Generation is
+the rest of the stream_query time. The same spans go to tracing.py, which
+writes them out as JSONL traces when TRACE_DIR is set.
+"""
+
+import os
+import json
+import fcntl
+import time
+import socket
+import bisect
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "xsiam-metrics"))
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+COUNTER, GAUGE, HISTOGRAM = "counter", "gauge", "histogram"
+
+
+class Metric:
+    """
+    One metric family. Values are keyed by the tuple of label values; a
+    histogram value is its per-bucket counts (the last one is +Inf) followed
+    by the sum of observations.
+    """
+
+    def __init__(self, kind, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.kind = kind
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) if kind == HISTOGRAM else ()
+        self.values = {}
+        self.function = None  # () -> {label values: value}, read at scrape time instead of stored values
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [0] * (len(self.buckets) + 2)
+            entry[bisect.bisect_left(self.buckets, value)] += 1
+            entry[-1] += value
+
+    def set_function(self, function):
+        """Compute this gauge from `function()` on every scrape; it is not written to the worker's file"""
+        self.function = function
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), list(value) if isinstance(value, list) else value]
+                    for key, value in self.values.items()]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Metric(COUNTER, name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._add(Metric(GAUGE, name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Metric(HISTOGRAM, name, help_text, labels, buckets))
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items() if metric.function is None}
+
+
+registry = MetricsRegistry()
+REQUESTS = registry.counter(
+    "xsiam_requests_total", "Chat requests and batch rows handled", ("engine", "endpoint", "status"))
+ENGINE_ERRORS = registry.counter(
+    "xsiam_engine_errors_total", "Failed Agent Engine calls by error type", ("engine", "error"))
+IN_FLIGHT = registry.gauge(
+    "xsiam_requests_in_flight", "Chat requests and batch rows being handled", ("endpoint",))
+PHASE_SECONDS = registry.histogram(
+    "xsiam_request_phase_seconds", "Time spent in each phase of a request", ("engine", "endpoint", "phase"))
+BATCH_QUEUE_ROWS = registry.gauge(
+    "xsiam_batch_queue_rows", "Batch rows still to answer, by the state of their job", ("state",))
+BATCH_QUEUE_JOBS = registry.gauge(
+    "xsiam_batch_queue_jobs", "Batch jobs waiting or running", ("state",))
+
+
+class RequestTimer:
+    """
+    Phase timings of one request, kept as spans of a tracing.Trace. Finishing
+    it (or leaving its `with` block) records the phases, the request count and
+    any errors, exports the trace and releases its in-flight slot.
+    """
+
+    def __init__(self, engine, endpoint, clock=time.perf_counter):
+        self.engine = engine or "unknown"
+        self.endpoint = endpoint
+        self.clock = clock
+        self.started = clock()
+        self.trace = tracing.Trace(clock, origin=self.started)
+        self.phases = {}
+        self.errors = []
+        self.status = 200
+        self.finished = False
+        self.streaming = False  # finished by timed_stream() rather than at request teardown
+        IN_FLIGHT.inc(endpoint=endpoint)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(500 if exc_type else self.status)
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        started = self.trace.now()
+        try:
+            yield
+        finally:
+            end = self.trace.now()
+            self.trace.add_span(name, "phase", started, end)
+            self.add(name, end - started)
+
+    def events(self, events):
+        """Pass stream_query() events through, timing each tool call and the generation around them"""
+        with self.recording() as recorder:
+            for event in events:
+                recorder.observe(event)
+                yield event
+
+    @contextmanager
+    def recording(self):
+        """events() for events handed over one at a time: observe() each on the recorder it yields"""
+        before = len(self.trace.spans)
+        recorder = self.trace.recorder()
+        try:
+            yield recorder
+        finally:
+            recorder.close()
+            spans = self.trace.spans[before:]
+            # Tool phases ahead of generation, the order the Server-Timing header has always had
+            for span in spans:
+                if span["kind"] == "tool":
+                    self.add(f"tool.{span['name']}", span["end"] - span["start"])
+            for span in spans:
+                if span["kind"] == "generation":
+                    self.add("generation", span["end"] - span["start"])
+
+    def error(self, kind):
+        self.errors.append(kind)
+        ENGINE_ERRORS.inc(engine=self.engine, error=kind)
+
+    def server_timing(self):
+        """Server-Timing header value: every phase so far and the total, in milliseconds"""
+        timings = dict(self.phases, total=self.clock() - self.started)
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+    def finish(self, status=None):
+        if self.finished:
+            return
+        self.finished = True
+        for phase, seconds in dict(self.phases, total=self.clock() - self.started).items():
+            PHASE_SECONDS.observe(seconds, engine=self.engine, endpoint=self.endpoint, phase=phase)
+        REQUESTS.inc(engine=self.engine, endpoint=self.endpoint, status=status or self.status)
+        IN_FLIGHT.dec(endpoint=self.endpoint)
+        tracing.export(self.trace.records(engine=self.engine, endpoint=self.endpoint,
+                                          status=status or self.status, errors=self.errors))
+
+
+def timed_stream(timer, body):
+    """Pass a streamed response body through, finishing `timer` once it has been sent or abandoned"""
+    # Set before the body starts: request teardown runs as soon as the view returns
+    timer.streaming = True
+
+    def relay():
+        try:
+            yield from body
+        finally:
+            timer.finish()
+
+    return relay()
+
+
+# --- Cross-worker aggregation ---
+
+_process_start = {}
+
+
+def process_start():
+    """Start id of this process (hex milliseconds); a forked worker gets its own"""
+    pid = os.getpid()
+    if pid not in _process_start:
+        _process_start.clear()
+        _process_start[pid] = f"{int(time.time() * 1000):x}"
+    return _process_start[pid]
+
+
+def snapshot_path(directory, service):
+    return os.path.join(directory, f"{service}-{socket.gethostname()}-{os.getpid()}-{process_start()}.json")
+
+
+def exited_path(directory, service):
+    return os.path.join(directory, f"{service}-{socket.gethostname()}-exited.json")
+
+
+def write_snapshot(directory, service, registry=registry):
+    os.makedirs(directory, exist_ok=True)
+    path = snapshot_path(directory, service)
+    data = {"host": socket.gethostname(), "pid": os.getpid(), "start": process_start(),
+            "metrics": registry.snapshot()}
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def read_snapshots(directory, service):
+    snapshots = []
+    if not os.path.isdir(directory):
+        return snapshots
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith(f"{service}-") and name.endswith(".json")):
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable metrics file {name}: {e}")
+            continue
+        snapshot["path"] = os.path.join(directory, name)
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def _start_key(snapshot):
+    start = snapshot.get("start") or "0"
+    return int(start, 16)
+
+
+def live_snapshots(snapshots):
+    """
+    The snapshots whose worker may still be running. Only the latest run of a
+    pid can be, and only workers of this host can be checked.
+    """
+    latest = {}
+    for snapshot in snapshots:
+        if snapshot.get("exited"):
+            continue
+        key = (snapshot.get("host"), snapshot.get("pid"))
+        if key not in latest or _start_key(snapshot) > _start_key(latest[key]):
+            latest[key] = snapshot
+    live = []
+    for snapshot in latest.values():
+        if snapshot.get("host") != socket.gethostname():
+            live.append(snapshot)
+            continue
+        try:
+            os.kill(snapshot["pid"], 0)
+        except ProcessLookupError:
+            continue
+        except PermissionError:
+            pass
+        live.append(snapshot)
+    return live
+
+
+def merge(snapshots, registry=registry):
+    """{metric name: {label values: value}} summed over worker snapshots"""
+    merged = {name: {} for name in registry.metrics}
+    live_ids = {id(snapshot) for snapshot in live_snapshots(snapshots)}
+    for snapshot in snapshots:
+        live = id(snapshot) in live_ids
+        for name, values in snapshot.get("metrics", {}).items():
+            metric = registry.metrics.get(name)
+            if metric is None or (metric.kind == GAUGE and not live):
+                continue
+            target = merged[name]
+            for key, value in values:
+                key = tuple(key)
+                if metric.kind == HISTOGRAM:
+                    old = target.get(key) or [0] * len(value)
+                    target[key] = [a + b for a, b in zip(old, value)]
+                else:
+                    target[key] = target.get(key, 0) + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render(merged, service, registry=registry):
+    """Prometheus text exposition of merged values, each series labelled with `service`"""
+    lines = []
+    const = [("service", service)]
+    for name, metric in registry.metrics.items():
+        values = merged.get(name, {})
+        if metric.function is not None:
+            try:
+                values = metric.function()
+            except Exception as e:
+                logger.warning(f"Could not compute {name}: {e}")
+                continue
+        lines.append(f"# HELP {name} {metric.help_text}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for key, value in sorted(values.items()):
+            if metric.kind != HISTOGRAM:
+                lines.append(f"{name}{_labels(const + list(zip(metric.labels, key)))} {_number(value)}")
+                continue
+            cumulative = 0
+            for le, count in zip(metric.buckets + ("+Inf",), value[:-1]):
+                cumulative += count
+                labels = _labels(const + list(zip(metric.labels, key)) + [("le", le)])
+                lines.append(f"{name}_bucket{labels} {cumulative}")
+            labels = _labels(const + list(zip(metric.labels, key)))
+            lines.append(f"{name}_sum{labels} {_number(round(value[-1], 6))}")
+            lines.append(f"{name}_count{labels} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def fold_exited(snapshots, directory, service, registry=registry):
+    """
+    Add the counters and histograms of this host's exited workers to the
+    service's exited file and remove their own files. Call with the lock
+    held; returns the snapshots that are left.
+    """
+    host = socket.gethostname()
+    live_ids = {id(snapshot) for snapshot in live_snapshots(snapshots)}
+    exited = [s for s in snapshots if s.get("host") == host and not s.get("exited") and id(s) not in live_ids]
+    if not exited:
+        return snapshots
+    path = exited_path(directory, service)
+    previous = [s for s in snapshots if s.get("exited") and s["path"] == path]
+    totals = merge(previous + exited, registry)
+    data = {"host": host, "exited": True, "metrics": {
+        name: [[list(key), value] for key, value in values.items()]
+        for name, values in totals.items() if values and registry.metrics[name].kind != GAUGE
+    }}
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+    for snapshot in exited:
+        try:
+            os.remove(snapshot["path"])
+        except FileNotFoundError:
+            pass
+    data["path"] = path
+    folded = {id(snapshot) for snapshot in previous + exited}
+    return [snapshot for snapshot in snapshots if id(snapshot) not in folded] + [data]
+
+
+def exposition(service, directory=METRICS_DIR, registry=registry):
+    """/metrics body: this worker's current values merged with the other workers' latest files"""
+    write_snapshot(directory, service, registry)
+    # Folding and reading under one lock, so no scrape counts an exited worker both in its file and in the totals
+    with open(os.path.join(directory, f"{service}.lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            snapshots = fold_exited(read_snapshots(directory, service), directory, service, registry)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return render(merge(snapshots, registry), service, registry)
+
+
+def _flush_forever(directory, service, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            write_snapshot(directory, service)
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {directory}: {e}")
+
+
+# --- Flask integration ---
+
+def current_timer():
+    """The RequestTimer of the Flask request being served"""
+    from flask import g, request
+
+    timer = g.get("request_timer")
+    if timer is None:
+        timer = g.request_timer = RequestTimer(None, request.endpoint or "unknown")
+    return timer
+
+
+def install(app, service, timed, engines=(), queue_depth=None, directory=METRICS_DIR,
+            flush_interval=METRICS_FLUSH_SECONDS):
+    """
+    Time the views named in `timed` ({view name: endpoint label}), add a
+    Server-Timing header to their responses and serve /metrics for `service`.
+    `engines` are the engine keys allowed as label values. `queue_depth()`
+    returns the job store's {job state: (jobs, pending rows)}.
+    """
+    from flask import Response, g, request
+
+    engines = set(engines)
+
+    @app.before_request
+    def start_timer():
+        endpoint = timed.get(request.endpoint)
+        if endpoint is not None:
+            engine = (request.view_args or {}).get("engine_key")
+            g.request_timer = RequestTimer(engine if engine in engines else None, endpoint)
+
+    @app.after_request
+    def add_server_timing(response):
+        timer = g.get("request_timer")
+        if timer is not None:
+            timer.status = response.status_code
+            # A streamed reply has only done its setup phases by now; generation follows the headers
+            response.headers["Server-Timing"] = timer.server_timing()
+        return response
+
+    @app.teardown_request
+    def finish_timer(exc):
+        timer = g.pop("request_timer", None)
+        if timer is not None and not timer.streaming:
+            timer.finish(500 if exc is not None else None)
+
+    if queue_depth is not None:
+        BATCH_QUEUE_JOBS.set_function(lambda: {(state,): jobs for state, (jobs, _) in queue_depth().items()})
+        BATCH_QUEUE_ROWS.set_function(lambda: {(state,): rows for state, (_, rows) in queue_depth().items()})
+
+    def metrics_view():
+        return Response(exposition(service, directory), content_type=CONTENT_TYPE)
+
+    app.add_url_rule("/metrics", "metrics", metrics_view)
+    tracing.configure(service)
+    threading.Thread(target=_flush_forever, args=(directory, service, flush_interval),
+                     name="metrics-flush", daemon=True).start()
+    return app
@@ -0,0 +1,149 @@
+"""
+Request budgets shared by every gunicorn worker of both web services.
+
+Token buckets for the GCP project and for each Agent Engine live in a small
+JSON file under SCHEDULER_STATE_DIR, guarded by an exclusive flock. Mount that
+directory as a shared volume in both containers and every worker of doc-spl
+and dm-gen draws from the same budgets.
+
+Interactive chat has priority over batch rows: a batch request is only
+granted while the buckets hold more than RATE_LIMIT_INTERACTIVE_RESERVE of
+their capacity, so a large batch cannot drain the budget chat needs.
+"""
+
+import os
+import json
+import time
+import fcntl
+import asyncio
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_STATE_DIR = os.getenv("SCHEDULER_STATE_DIR", os.path.join(tempfile.gettempdir(), "xsiam-scheduler"))
+RATE_LIMIT_PROJECT_RPM = float(os.getenv("RATE_LIMIT_PROJECT_RPM", "300"))
+RATE_LIMIT_ENGINE_RPM = float(os.getenv("RATE_LIMIT_ENGINE_RPM", "120"))
+RATE_LIMIT_BURST_SECONDS = float(os.getenv("RATE_LIMIT_BURST_SECONDS", "10"))
+RATE_LIMIT_INTERACTIVE_RESERVE = float(os.getenv("RATE_LIMIT_INTERACTIVE_RESERVE", "0.25"))
+INTERACTIVE_MAX_WAIT = float(os.getenv("INTERACTIVE_MAX_WAIT", "30"))  # seconds
+
+INTERACTIVE, BATCH = "interactive", "batch"
+
+
+class RateLimited(Exception):
+    """Raised when a request could not get a token within its timeout"""
+
+
+class SharedRateLimiter:
+    def __init__(self, state_dir=SCHEDULER_STATE_DIR, project=None, project_rpm=RATE_LIMIT_PROJECT_RPM,
+                 engine_rpm=RATE_LIMIT_ENGINE_RPM, burst_seconds=RATE_LIMIT_BURST_SECONDS,
+                 interactive_reserve=RATE_LIMIT_INTERACTIVE_RESERVE, clock=time.time, sleep=time.sleep):
+        os.makedirs(state_dir, exist_ok=True)
+        self._state_path = os.path.join(state_dir, "rate_limits.json")
+        self._lock_path = os.path.join(state_dir, "rate_limits.lock")
+        self.project = project or os.getenv("GOOGLE_CLOUD_PROJECT") or "default"
+        self.project_rpm = project_rpm
+        self.engine_rpm = engine_rpm
+        self.burst_seconds = burst_seconds
+        self.interactive_reserve = interactive_reserve
+        self._clock = clock
+        self._sleep = sleep
+        self._thread_lock = threading.Lock()  # flock is per open file, so serialise threads too
+        self._stats = {INTERACTIVE: 0, BATCH: 0, "waits": 0, "rejected": 0}
+
+    def _buckets(self, engine_id):
+        """(key, tokens per second, capacity) for every budget a call to `engine_id` draws from"""
+        buckets = []
+        if self.project_rpm > 0:
+            buckets.append((f"project:{self.project}", self.project_rpm / 60))
+        if self.engine_rpm > 0:
+            buckets.append((f"engine:{engine_id}", self.engine_rpm / 60))
+        return [(key, rate, max(1.0, rate * self.burst_seconds)) for key, rate in buckets]
+
+    def try_acquire(self, engine_id, priority=INTERACTIVE):
+        """Take one token from every bucket atomically; returns 0 on success or the seconds to wait"""
+        buckets = self._buckets(engine_id)
+        if not buckets:
+            return 0.0
+        with self._thread_lock, open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                state = self._load()
+                now = self._clock()
+                wait = 0.0
+                for key, rate, capacity in buckets:
+                    tokens, updated = state.get(key, (capacity, now))
+                    tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+                    state[key] = (tokens, now)
+                    floor = 1.0 + (self.interactive_reserve * capacity if priority == BATCH else 0.0)
+                    if tokens < floor:
+                        wait = max(wait, (floor - tokens) / rate)
+                if wait == 0.0:
+                    for key, _, _ in buckets:
+                        tokens, updated = state[key]
+                        state[key] = (tokens - 1.0, updated)
+                self._save(state)
+                return wait
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def acquire(self, engine_id, priority=INTERACTIVE, timeout=None):
+        """Block until the budgets allow one request; raises RateLimited after `timeout` seconds"""
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            wait = self.try_acquire(engine_id, priority)
+            if wait == 0.0:
+                with self._thread_lock:
+                    self._stats[priority] += 1
+                return
+            if deadline is not None and self._clock() + wait > deadline:
+                with self._thread_lock:
+                    self._stats["rejected"] += 1
+                raise RateLimited(f"Request budget for {engine_id} exhausted, retry in {wait:.1f}s")
+            with self._thread_lock:
+                self._stats["waits"] += 1
+            self._sleep(min(wait, 1.0))
+
+    async def acquire_async(self, engine_id, priority=INTERACTIVE, timeout=None):
+        """
+        acquire() for the asyncio serving mode: waits without blocking the event
+        loop. try_acquire() takes the thread lock and the flock, either of which
+        may be held by another worker or thread, so it runs on the executor.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            wait = await loop.run_in_executor(None, self.try_acquire, engine_id, priority)
+            if wait == 0.0:
+                with self._thread_lock:
+                    self._stats[priority] += 1
+                return
+            if deadline is not None and self._clock() + wait > deadline:
+                with self._thread_lock:
+                    self._stats["rejected"] += 1
+                raise RateLimited(f"Request budget for {engine_id} exhausted, retry in {wait:.1f}s")
+            with self._thread_lock:
+                self._stats["waits"] += 1
+            await asyncio.sleep(min(wait, 1.0))
+
+    def _load(self):
+        try:
+            with open(self._state_path) as f:
+                return {key: tuple(value) for key, value in json.load(f).items()}
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save(self, state):
+        tmp_path = f"{self._state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._state_path)
+
+    def stats(self):
+        with self._thread_lock:
+            return dict(self._stats)
+
+
+request_budget = SharedRateLimiter()
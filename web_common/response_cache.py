@@ -0,0 +1,182 @@
+"""
+Response cache for first-turn agent questions.
+
+Analysts ask the `doc` and `spl` engines the same questions over and over.
+Answers are cached per engine under a normalized form of the prompt:
+  - spl:   whitespace collapsed and case folded outside quoted strings
+  - doc:   a message that is just a data source name is canonicalized
+           ("Tenable_io" == "tenable.io" == "Tenable IO"); any other
+           question has its whitespace collapsed only
+  - other: whitespace collapsed only (raw log samples are matched exactly)
+
+Two tiers: an in-process LRU with TTL, and an SQLite file shared by every
+worker that survives restarts. Only turns without session history are looked
+up or stored, because a follow-up's answer depends on the conversation.
+"""
+
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))  # in-memory tier
+
+_QUOTED = re.compile(r'("(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\')')
+_SEPARATORS = re.compile(r"[\s_\-.:/]+")
+# A bare data source name: a few words of name characters, no sentence punctuation
+_DATA_SOURCE_NAME = re.compile(r"[\w .:/&+()-]+")
+DATA_SOURCE_NAME_MAX_WORDS = 6
+
+
+def normalize_spl(text):
+    """Collapse whitespace and fold case, leaving quoted literals untouched"""
+    pieces = _QUOTED.split(text.strip())
+    for i in range(0, len(pieces), 2):  # even pieces are outside quotes
+        piece = re.sub(r"\s+", " ", pieces[i]).lower()
+        # Spacing around pipes, '=' and commas is insignificant in SPL
+        pieces[i] = re.sub(r" ?([|=,]) ?", r"\1", piece)
+    return "".join(pieces).strip()
+
+
+def normalize_data_source(text):
+    """Canonical data source name: case-folded, separators unified"""
+    return _SEPARATORS.sub(" ", text.strip().lower()).strip()
+
+
+def is_data_source_name(text):
+    """Whether a doc message is only a data source name rather than a free-text question"""
+    text = text.strip()
+    return bool(_DATA_SOURCE_NAME.fullmatch(text)) and len(text.split()) <= DATA_SOURCE_NAME_MAX_WORDS
+
+
+def normalize_prompt(engine_key, text):
+    if engine_key == "spl":
+        return normalize_spl(text)
+    if engine_key == "doc" and is_data_source_name(text):
+        return normalize_data_source(text)
+    return " ".join(text.split())
+
+
+def is_first_turn(data):
+    """True when a chat request carries no conversation history"""
+    return not data.get("session_id") and not data.get("prior_turn")
+
+
+def with_prior_turn(message, prior_turn):
+    """
+    Fold a cached question/answer into a follow-up that starts a fresh session.
+
+    A cache hit has no Agent Engine session behind it, so the browser sends the
+    cached exchange back with its next message.
+    """
+    if not prior_turn:
+        return message
+    return (
+        "Earlier in this conversation the user asked:\n"
+        f"{prior_turn.get('message', '')}\n\n"
+        "and you answered:\n"
+        f"{prior_turn.get('response', '')}\n\n"
+        f"Follow-up from the user:\n{message}"
+    )
+
+
+class ResponseCache:
+    def __init__(self, path, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                 enabled=RESPONSE_CACHE_ENABLED, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._clock = clock
+        self._memory = OrderedDict()  # key -> (text, expires_at)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = defaultdict(lambda: {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0})
+        if enabled:
+            self._conn().execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, engine_key TEXT,"
+                " response TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(engine_key, engine_id, prompt):
+        normalized = normalize_prompt(engine_key, prompt)
+        return hashlib.sha256(f"{engine_id}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, engine_key, engine_id, prompt):
+        if not self.enabled:
+            return None
+        key = self.make_key(engine_key, engine_id, prompt)
+        now = self._clock()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and entry[1] > now:
+                self._memory.move_to_end(key)
+                self._stats[engine_key]["memory_hits"] += 1
+                return entry[0]
+            self._memory.pop(key, None)
+        try:
+            row = self._conn().execute(
+                "SELECT response, expires_at FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache read failed: {e}")
+            row = None
+        with self._lock:
+            if row is None:
+                self._stats[engine_key]["misses"] += 1
+                return None
+            self._stats[engine_key]["disk_hits"] += 1
+            self._remember(key, row[0], row[1])
+        return row[0]
+
+    def put(self, engine_key, engine_id, prompt, response):
+        if not self.enabled or not response:
+            return
+        key = self.make_key(engine_key, engine_id, prompt)
+        expires_at = self._clock() + self.ttl
+        with self._lock:
+            self._remember(key, response, expires_at)
+            self._stats[engine_key]["stores"] += 1
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, engine_key, response, expires_at) VALUES (?, ?, ?, ?)",
+                (key, engine_key, response, expires_at),
+            )
+            conn.execute("DELETE FROM responses WHERE expires_at <= ?", (self._clock(),))
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache write failed: {e}")
+
+    def _remember(self, key, response, expires_at):
+        self._memory[key] = (response, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self, engine_key=None):
+        with self._lock:
+            keys = [engine_key] if engine_key else list(self._stats)
+            out = {}
+            for key in keys:
+                stats = dict(self._stats[key])
+                lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+                stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+                out[key] = stats
+            return out
@@ -0,0 +1,74 @@
+"""
+Incremental, input-ordered result files for batch jobs.
+
+Rows finish out of order on the thread pool. The writer appends each finished
+row to the output file as soon as every row before it has been written, so
+the file on disk is always a valid prefix of the final result and can be
+downloaded while the job is still running.
+
+Results are CSV, or JSONL (one object per row) when the output file name ends
+in .jsonl, so downstream tooling can read multi-line answers without
+re-parsing CSV quoting.
+"""
+
+import csv
+import json
+
+
+class OrderedCsvWriter:
+    def __init__(self, path, header=("Input", "Output")):
+        self._file = open(path, "w", newline='', encoding="utf-8")
+        self._start(header)
+        self._file.flush()
+        self._buffer = {}
+        self.next_idx = 0
+        self.written = 0
+
+    def _start(self, header):
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(header)
+
+    def _write(self, fields):
+        self._writer.writerow(fields)
+
+    def add(self, idx, *fields):
+        """Record the result for row `idx`; writes it and any rows it was holding back"""
+        self._buffer[idx] = fields
+        flushed = False
+        while self.next_idx in self._buffer:
+            self._write(self._buffer.pop(self.next_idx))
+            self.next_idx += 1
+            self.written += 1
+            flushed = True
+        if flushed:
+            self._file.flush()
+
+    @property
+    def held_back(self):
+        return len(self._buffer)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class OrderedJsonlWriter(OrderedCsvWriter):
+    """Same ordering, one JSON object per row keyed by `header`, and no header line"""
+
+    def _start(self, header):
+        self._keys = header
+
+    def _write(self, fields):
+        self._file.write(json.dumps(dict(zip(self._keys, fields)), ensure_ascii=False) + "\n")
+
+
+def open_result_writer(path, header):
+    """Ordered writer for `path`, JSONL or CSV by its extension"""
+    if path.endswith(".jsonl"):
+        return OrderedJsonlWriter(path, header)
+    return OrderedCsvWriter(path, header)
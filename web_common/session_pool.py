@@ -0,0 +1,184 @@
+"""
+Pre-warmed Agent Engine sessions for batch jobs.
+
+Creating a session is a full round trip, and batch rows each need a fresh one.
+A SessionPool keeps SESSION_POOL_SIZE sessions created ahead of time by
+background fillers, so a batch worker only pays for the query itself.
+
+Sessions are single-use by default (SESSION_MAX_USES=1): a session that has
+answered a row carries that conversation, so reusing it would leak one row's
+context into the next. Raise the limit only for engines where that is fine.
+A ready session older than SESSION_MAX_AGE seconds is retired instead of
+handed out, so an idle pool does not keep stale sessions on the engine.
+Retired sessions are deleted on the engine by a background thread, off the
+batch row's path. Closing the pool deletes the ready ones before it returns;
+the apps close every pool with close_session_pools() when a worker exits.
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+
+from .concurrency import is_quota_error
+from .engine_pool import engine_registry
+
+logger = logging.getLogger(__name__)
+
+SESSION_POOL_SIZE = int(os.getenv("SESSION_POOL_SIZE", "5"))
+SESSION_MAX_USES = int(os.getenv("SESSION_MAX_USES", "1"))
+SESSION_POOL_FILLERS = int(os.getenv("SESSION_POOL_FILLERS", "2"))
+SESSION_MAX_AGE = float(os.getenv("SESSION_MAX_AGE", "1800"))  # seconds
+
+
+class SessionPool:
+    def __init__(self, engine_id, user_id="batch_job", size=SESSION_POOL_SIZE,
+                 max_uses=SESSION_MAX_USES, fillers=SESSION_POOL_FILLERS, max_age=SESSION_MAX_AGE,
+                 registry=engine_registry, clock=time.monotonic):
+        self.engine_id = engine_id
+        self.user_id = user_id
+        self.size = size
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self._registry = registry
+        self._clock = clock
+        self._ready = queue.Queue()
+        self._uses = {}
+        self._created_at = {}
+        self._lock = threading.Lock()
+        self._pending = 0  # sessions being created by fillers
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+        self._retired = queue.Queue()
+        self._stats = {"created": 0, "warm": 0, "cold": 0, "reused": 0, "retired": 0, "expired": 0,
+                       "create_errors": 0, "deleted": 0, "delete_errors": 0}
+        for i in range(max(0, fillers) if size > 0 else 0):
+            threading.Thread(target=self._fill_loop, name=f"session-pool-{i}", daemon=True).start()
+        threading.Thread(target=self._delete_loop, name="session-pool-delete", daemon=True).start()
+
+    def _create(self):
+        session = self._registry.get(self.engine_id).create_session(user_id=self.user_id)
+        with self._lock:
+            self._stats["created"] += 1
+            self._created_at[session.get("id")] = self._clock()
+        return session.get("id")
+
+    def _fill_loop(self):
+        while True:
+            with self._wakeup:
+                while not self._closed and self._ready.qsize() + self._pending >= self.size:
+                    self._wakeup.wait()
+                if self._closed:
+                    return
+                self._pending += 1
+            try:
+                session_id = self._create()
+            except Exception as e:
+                logger.warning(f"Session pre-warm failed for {self.engine_id}: {e}")
+                if not is_quota_error(e):
+                    self._registry.invalidate(self.engine_id)
+                with self._wakeup:
+                    self._stats["create_errors"] += 1
+                    self._pending -= 1
+                    self._wakeup.wait(timeout=5)  # back off before retrying
+                continue
+            with self._wakeup:
+                self._pending -= 1
+                if self._closed:
+                    self._retired.put(session_id)
+                    return
+                self._uses[session_id] = 0
+            self._ready.put(session_id)
+
+    def _delete(self, session_id):
+        try:
+            self._registry.get(self.engine_id).delete_session(user_id=self.user_id, session_id=session_id)
+            outcome = "deleted"
+        except Exception as e:
+            logger.warning(f"Deleting retired session {session_id} of {self.engine_id} failed: {e}")
+            outcome = "delete_errors"
+        with self._lock:
+            self._created_at.pop(session_id, None)
+            self._stats[outcome] += 1
+
+    def _delete_loop(self):
+        while True:
+            self._delete(self._retired.get())
+
+    def acquire(self):
+        """Hand out a ready session, creating one inline if the pool is empty; stale ones are retired"""
+        while True:
+            try:
+                session_id = self._ready.get_nowait()
+            except queue.Empty:
+                break
+            with self._wakeup:
+                self._wakeup.notify()
+                if self._clock() - self._created_at.get(session_id, self._clock()) > self.max_age:
+                    self._uses.pop(session_id, None)
+                    self._stats["expired"] += 1
+                    self._retired.put(session_id)
+                    continue
+                self._stats["reused" if self._uses.get(session_id) else "warm"] += 1
+            return session_id
+        session_id = self._create()
+        with self._wakeup:
+            self._stats["cold"] += 1
+            self._uses[session_id] = 0
+            self._wakeup.notify()
+        return session_id
+
+    def release(self, session_id, healthy=True):
+        """Return a session after use; it is retired once used max_uses times or after an error"""
+        with self._wakeup:
+            uses = self._uses.get(session_id, 0) + 1
+            if healthy and uses < self.max_uses and not self._closed:
+                self._uses[session_id] = uses
+                self._ready.put(session_id)
+                return
+            self._uses.pop(session_id, None)
+            self._stats["retired"] += 1
+            self._wakeup.notify()
+        self._retired.put(session_id)
+
+    def close(self):
+        """Stop refilling and delete the ready sessions and those still waiting to be deleted"""
+        with self._wakeup:
+            self._closed = True
+            self._wakeup.notify_all()
+        for waiting in (self._ready, self._retired):
+            while True:
+                try:
+                    session_id = waiting.get_nowait()
+                except queue.Empty:
+                    break
+                self._delete(session_id)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["ready"] = self._ready.qsize()
+        return stats
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_session_pool(engine_id, user_id="batch_job"):
+    """Process-wide pool for `engine_id`, started on first use"""
+    with _pools_lock:
+        pool = _pools.get((engine_id, user_id))
+        if pool is None:
+            pool = _pools[(engine_id, user_id)] = SessionPool(engine_id, user_id=user_id)
+        return pool
+
+
+def close_session_pools():
+    """Close every pool of this process, e.g. when a gunicorn worker exits"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,241 @@
+"""
+SPL fingerprints with parameterized literals, for spl batch rows.
+
+Migration batches are full of queries that differ only in spacing, keyword
+case, the order of implicit-AND search terms, and the literal values they look
+for. parameterize() tokenizes a query, splits it into its pipeline of commands
+and renders a canonical template in which literals are replaced by `?`:
+
+    index=fw src_ip="10.0.0.1"  | stats count BY user,host
+    search src_ip="10.9.9.9" index=fw | stats count by user host
+      -> template  index = fw src_ip = ? | stats count by user , host
+         literals  ["10.0.0.1"] and ["10.9.9.9"]
+
+Field lists (`by` fields, `table` and `fields`) keep their order, which sets
+the column order of the result; only their commas are optional.
+
+Rows with the same template share one translation. reinstantiate() carries
+the XQL over to another row by swapping the representative's literal values
+for the row's own. When that cannot be done safely it returns None, and the
+row is translated on its own. That happens when a value is missing from the
+XQL, when one value maps to two, or when a short value occurs in the XQL
+more often than in the query.
+
+Literals are double-quoted strings, numbers, and unquoted values compared
+to a field in a search. The values of fields that pick the XQL dataset
+(STRUCTURAL_FIELDS) stay part of the template, as do single-quoted field
+names and unquoted operands of `where`/`eval`, which are field references.
+
+compact() is the pre-normalizer for the text actually sent: whitespace outside
+quotes is collapsed and ``` comments are dropped, so formatted multi-line
+queries cost fewer prompt tokens. A ``` block that itself holds a query is a
+code fence, not a comment, and is kept.
+"""
+
+import re
+
+_TOKEN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>```.*?```)
+  | (?P<string>"(?:[^"\\]|\\.)*")
+  | (?P<field>'(?:[^'\\]|\\.)*')
+  | (?P<macro>`[^`]*`)
+  | (?P<op>==|!=|<=|>=|[=<>|(),\[\]])
+  | (?P<word>[^\s"'`=!<>|(),\[\]]+|!)
+  | (?P<other>.)
+""", re.S | re.X)
+_NUMBER = re.compile(r"[-+]?\d+(?:\.\d+)?")
+COMPARISONS = {"=", "==", "!=", "<", ">", "<=", ">="}
+# Their values select the XQL dataset or time range rather than being copied into the query
+STRUCTURAL_FIELDS = {"index", "sourcetype", "source", "eventtype", "tag", "datamodel", "earliest", "latest",
+                     "span", "bins", "timeformat"}
+# Commands with a `by` field list
+GROUPING_COMMANDS = {"stats", "eventstats", "streamstats", "chart", "timechart", "top", "rare", "tstats"}
+# Commands whose arguments are a field list
+FIELD_LIST_COMMANDS = {"table", "fields"}
+# Search terms containing these cannot be reordered
+BOOLEAN_SYNTAX = {"or", "not", "(", ")", "[", "]"}
+# Literals this short must occur in the XQL exactly as often as in the query to be swapped
+SHORT_LITERAL = 3
+
+
+def tokenize(text):
+    """[(kind, text)] without whitespace and comments"""
+    return [(m.lastgroup, m.group()) for m in _TOKEN.finditer(text) if m.lastgroup not in ("space", "comment")]
+
+
+def compact(text):
+    """`text` without ``` comments and with whitespace outside quotes collapsed to single spaces"""
+    parts = []
+    for m in _TOKEN.finditer(text.strip()):
+        if m.lastgroup == "comment" and parameterize(m.group()[3:-3]) is None:
+            continue
+        if m.lastgroup != "space":
+            parts.append(m.group())
+        elif parts and parts[-1] != " ":
+            parts.append(" ")
+    return "".join(parts).strip()
+
+
+def _commands(tokens):
+    """Split at top-level pipes; a pipe inside [ ] belongs to the subsearch"""
+    commands, current, depth = [], [], 0
+    for token in tokens:
+        if token[1] == "[":
+            depth += 1
+        elif token[1] == "]":
+            depth = max(depth - 1, 0)
+        if token[1] == "|" and depth == 0:
+            commands.append(current)
+            current = []
+        else:
+            current.append(token)
+    commands.append(current)
+    return commands
+
+
+def _terms(args):
+    """Search arguments as terms: (field, op, value) comparisons or single tokens"""
+    terms, i = [], 0
+    while i < len(args):
+        if (i + 2 < len(args) and args[i][0] == "word" and args[i + 1][1] in COMPARISONS
+                and args[i + 2][0] in ("word", "string")):
+            terms.append(args[i:i + 3])
+            i += 3
+        else:
+            terms.append(args[i:i + 1])
+            i += 1
+    return terms
+
+
+class _Template:
+    def __init__(self):
+        self.parts = []
+        self.literals = []
+
+    def literal(self, value):
+        self.parts.append("?")
+        self.literals.append(value)
+
+    def token(self, kind, text):
+        if kind == "string":
+            self.literal(text[1:-1])
+        elif kind == "word" and _NUMBER.fullmatch(text):
+            self.literal(text)
+        else:
+            self.parts.append(text if kind in ("field", "macro") else text.lower())
+
+    def search(self, args):
+        terms = _terms(args)
+        if not any(len(term) == 1 and term[0][1].lower() in BOOLEAN_SYNTAX for term in terms):
+            terms = [term for term in terms if not (len(term) == 1 and term[0][1].lower() == "and")]
+            terms.sort(key=lambda term: " ".join(text.lower() for _, text in term))
+        for term in terms:
+            if len(term) == 3:
+                (_, field), (_, op), (kind, value) = term
+                self.parts.extend([field.lower(), op])
+                if field.lower() in STRUCTURAL_FIELDS:
+                    self.parts.append(value.lower())
+                elif kind == "string":
+                    self.literal(value[1:-1])
+                elif "*" in value:
+                    self.parts.append(value.lower())  # wildcards are rewritten, not copied, in XQL
+                else:
+                    self.literal(value)
+            else:
+                self.token(*term[0])
+
+    def grouping(self, args):
+        words = [text.lower() for _, text in args]
+        if "by" not in words:
+            return self.plain(args)
+        split = words.index("by")
+        self.plain(args[:split])
+        self.parts.append("by")
+        self.fields(args[split + 1:])
+
+    def fields(self, args):
+        """A field list in its own order; `a, b` and `a b` are the same list"""
+        self.parts.append(" , ".join(text.lower() for _, text in args if text != ","))
+
+    def plain(self, args):
+        for token in args:
+            self.token(*token)
+
+
+def parameterize(text):
+    """(template, literals) of an SPL query, or None when `text` does not look like SPL"""
+    tokens = tokenize(text)
+    if not tokens or not any(kind == "op" and value in COMPARISONS | {"|"} for kind, value in tokens):
+        return None
+    generating = tokens[0][1] == "|"
+    template = _Template()
+    for i, command in enumerate(_commands(tokens[1:] if generating else tokens)):
+        if i or generating:
+            template.parts.append("|")
+        name = command[0][1].lower() if command and command[0][0] == "word" else None
+        if i == 0 and not generating and name != "search":
+            template.search(command)  # a leading search needs no `search` keyword
+            continue
+        if name is None:
+            template.plain(command)
+            continue
+        template.parts.append(name)
+        if name == "search" and i == 0:
+            template.parts.pop()
+        if name == "search":
+            template.search(command[1:])
+        elif name in GROUPING_COMMANDS:
+            template.grouping(command[1:])
+        elif name in FIELD_LIST_COMMANDS:
+            template.fields(command[1:])
+        else:
+            template.plain(command[1:])
+    return " ".join(template.parts), template.literals
+
+
+def fingerprint(text):
+    """Template of an SPL query, or None when it does not look like SPL"""
+    parsed = parameterize(text)
+    return None if parsed is None else parsed[0]
+
+
+def _occurrences(value):
+    """Whole occurrences of `value`: not part of a longer word, IP address, time or hyphenated name"""
+    return re.compile(r"(?<![\w.:-])" + re.escape(value) + r"(?![\w.:-])")
+
+
+def reinstantiate(sent, output, text):
+    """
+    The answer `output` to query `sent`, rewritten for query `text` of the
+    same template, or None when it cannot safely be carried over.
+    """
+    a, b = parameterize(sent), parameterize(text)
+    if a is None or b is None:
+        return output if a is None and b is None else None
+    if a[0] != b[0]:
+        return None
+    targets = {}
+    for old, new in zip(a[1], b[1]):
+        targets.setdefault(old, set()).add(new)
+    changes = {}
+    for old, new in targets.items():
+        if len(new) > 1:
+            return None  # one value in the answer would have to become two
+        new = new.pop()
+        if new == old:
+            continue
+        if not old:
+            return None
+        pattern = _occurrences(old)
+        found = len(pattern.findall(output))
+        if not found:
+            return None
+        if len(old) <= SHORT_LITERAL and found != len(pattern.findall(sent)):
+            return None
+        changes[old] = new
+    if not changes:
+        return output
+    # All values are swapped in one pass, so a new value is never swapped again
+    swap = re.compile("|".join(_occurrences(old).pattern for old in sorted(changes, key=len, reverse=True)))
+    return swap.sub(lambda m: changes[m.group()], output)
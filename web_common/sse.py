@@ -0,0 +1,118 @@
+"""
+Server-Sent Events helpers for streaming Agent Engine replies to the browser.
+
+`stream_query()` yields ADK events as dicts. With `streaming_mode="sse"` the
+model's text arrives as `partial` events carrying deltas, followed by one
+final event with the aggregated text. Tool calls arrive as function call /
+function response parts.
+"""
+
+import os
+import json
+import time
+
+# Passed through to AdkApp.stream_query; set CHAT_STREAMING_MODE="" for engines deployed without run_config support
+CHAT_STREAMING_MODE = os.getenv("CHAT_STREAMING_MODE", "sse")
+
+
+def stream_run_kwargs():
+    """Extra stream_query() kwargs that turn on token-level partial events"""
+    if not CHAT_STREAMING_MODE:
+        return {}
+    return {"run_config": {"streaming_mode": CHAT_STREAMING_MODE}}
+
+
+def format_sse(event, data):
+    """Encode one SSE frame. `data` is JSON-serialised onto a single line."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def event_text(event):
+    """Concatenated text of all text parts in an ADK event ('' if none)"""
+    parts = (event.get("content") or {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts if part.get("text"))
+
+
+def final_text(events):
+    """Text of the last event of a stream_query() turn ('' if it carries none)"""
+    last = None
+    for event in events:
+        last = event
+    return event_text(last) if last else ""
+
+
+def event_tool_calls(event):
+    parts = (event.get("content") or {}).get("parts") or []
+    return [part["functionCall"].get("name", "unknown") for part in parts if "functionCall" in part]
+
+
+class SseRelay:
+    """
+    Translates stream_query() events into SSE frames.
+
+    Frames: `session` (sent immediately), `tool` for each tool call, `delta`
+    for partial text, `message` for a complete text event, `validation` with
+    the XQL check of an spl reply (followed by a `message` replacing the text
+    when a repair turn fixed it), then `done` with timings or `error`. Used
+    by the chat turns of web_common.chat in both serving modes.
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.started = time.monotonic()
+        self.first_token_ms = None
+        self.final_text = ""
+        self.last_event = None
+
+    def start(self):
+        return [format_sse("session", {"session_id": self.session_id})]
+
+    def feed(self, event):
+        self.last_event = event
+        frames = [format_sse("tool", {"name": name}) for name in event_tool_calls(event)]
+        text = event_text(event)
+        if text:
+            if self.first_token_ms is None:
+                self.first_token_ms = round((time.monotonic() - self.started) * 1000, 1)
+            if event.get("partial"):
+                frames.append(format_sse("delta", {"text": text}))
+            else:
+                self.final_text = text
+                frames.append(format_sse("message", {"text": text}))
+        return frames
+
+    def review(self, text, report):
+        """Frames for the XQL check of the reply; `text` is the reply after it"""
+        frames = [] if report is None else [format_sse("validation", report)]
+        if text != self.final_text:
+            self.final_text = text
+            frames.append(format_sse("message", {"text": text}))
+        return frames
+
+    def finish(self):
+        if not self.final_text:
+            error_msg = (self.last_event or {}).get("error") or "No response from agent engine"
+            return [format_sse("error", {"error": error_msg})]
+        return [format_sse("done", {
+            "session_id": self.session_id,
+            "timestamp": (self.last_event or {}).get("timestamp"),
+            "first_token_ms": self.first_token_ms,
+            "total_ms": round((time.monotonic() - self.started) * 1000, 1),
+        })]
+
+
+def sse_frames(events, session_id):
+    """SSE frames for a synchronous stream_query() event iterator"""
+    relay = SseRelay(session_id)
+    yield from relay.start()
+    for event in events:
+        yield from relay.feed(event)
+    yield from relay.finish()
+
+
+def cached_reply_frames(text):
+    """Frames for an answer served from the response cache (no session behind it)"""
+    return [
+        format_sse("message", {"text": text}),
+        format_sse("done", {"session_id": None, "cached": True, "first_token_ms": 0.0, "total_ms": 0.0}),
+    ]
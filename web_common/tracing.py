@@ -0,0 +1,320 @@
+"""
+Event-level traces of stream_query() calls, and a report over them.
+
+A Trace timestamps every event of a stream_query() as it arrives and turns
+the stream into spans:
+  event       one per event: author, part kinds, text length
+  tool        from the event carrying a functionCall to the event carrying
+              its functionResponse (matched by call id, else by tool name)
+  generation  each stretch of the stream outside tool calls, i.e. the model
+              working towards its next function call or its answer
+Requests timed by metrics.RequestTimer add a root `request` span and one
+`phase` span per setup step (engine_get, create_session, ...).
+
+With TRACE_DIR set, each traced request is appended to
+TRACE_DIR/<service>-<host>-<pid>.jsonl, one span per line. TRACE_SAMPLE_RATE
+sets the fraction of requests kept. Aggregate the files with
+
+    python -m web_common.tracing traces/*.jsonl [--slowest 0.05] [--json]
+
+This prints latency histograms per tool, for generation and for whole
+requests. It also shows how the slowest requests split their time between
+tools, generation and setup.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import argparse
+import threading
+from collections import defaultdict
+
+TRACE_DIR = os.getenv("TRACE_DIR", "")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+# Histogram bucket upper bounds in milliseconds; the last bucket is open
+HISTOGRAM_EDGES_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+HISTOGRAM_WIDTH = 40
+
+
+def event_parts(event):
+    """Kinds of the parts in an ADK event: "text", "functionCall:<name>", "functionResponse:<name>" """
+    kinds = []
+    for part in (event.get("content") or {}).get("parts") or []:
+        if "text" in part:
+            kinds.append("text")
+        for kind in ("functionCall", "functionResponse"):
+            if kind in part:
+                kinds.append(f"{kind}:{part[kind].get('name', 'unknown')}")
+    return kinds
+
+
+class Trace:
+    """
+    Spans of one request. Offsets are seconds on `clock` since `origin`, the
+    request start.
+    """
+
+    def __init__(self, clock=time.perf_counter, origin=None):
+        self.trace_id = uuid.uuid4().hex
+        self.clock = clock
+        self.origin = clock() if origin is None else origin
+        # Wall-clock time of the origin, for the spans' timestamps
+        self.timestamp = time.time() - (clock() - self.origin)
+        self.spans = []  # {"name", "kind", "start", "end", "attrs"}
+        self.last_offset = 0.0
+
+    def now(self):
+        return self.clock() - self.origin
+
+    def add_span(self, name, kind, start, end, **attrs):
+        self.spans.append({"name": name, "kind": kind, "start": start, "end": end, "attrs": attrs})
+
+    def stream(self, events):
+        """Pass stream_query() events through, recording event, tool and generation spans"""
+        recorder = self.recorder()
+        try:
+            for event in events:
+                recorder.observe(event)
+                yield event
+        finally:
+            recorder.close()
+
+    def recorder(self):
+        """stream() for events handed over one at a time, e.g. from an async stream"""
+        return StreamRecorder(self)
+
+    def seconds(self, kind):
+        """{span name: total seconds} over the spans of `kind`"""
+        totals = defaultdict(float)
+        for span in self.spans:
+            if span["kind"] == kind:
+                totals[span["name"]] += span["end"] - span["start"]
+        return dict(totals)
+
+    def records(self, name="request", **attrs):
+        """JSON-ready spans, the root span first and every other span its child"""
+        end = max([self.now()] + [span["end"] for span in self.spans])
+        root = {"name": name, "kind": "request", "start": 0.0, "end": end, "attrs": attrs}
+        records = []
+        for span_id, span in enumerate([root] + self.spans):
+            records.append({
+                "trace_id": self.trace_id,
+                "span_id": span_id,
+                "parent_id": None if span_id == 0 else 0,
+                "name": span["name"],
+                "kind": span["kind"],
+                "timestamp": round(self.timestamp + span["start"], 6),
+                "start_ms": round(span["start"] * 1000, 3),
+                "duration_ms": round((span["end"] - span["start"]) * 1000, 3),
+                "attrs": span["attrs"],
+            })
+        return records
+
+
+class StreamRecorder:
+    """Spans of one stream_query() call: observe() each event as it arrives, then close()"""
+
+    def __init__(self, trace):
+        self.trace = trace
+        self.calls = {}  # call id -> (tool name, start)
+        self.segment = {"start": trace.now(), "events": 0, "text_chars": 0}
+
+    def _close_segment(self, end):
+        segment = self.segment
+        if segment["start"] is not None:
+            self.trace.add_span("generation", "generation", segment["start"], end,
+                                events=segment["events"], text_chars=segment["text_chars"])
+            segment["start"] = None
+
+    def observe(self, event):
+        trace, segment = self.trace, self.segment
+        now = trace.last_offset = trace.now()
+        parts = (event.get("content") or {}).get("parts") or []
+        text_chars = sum(len(part.get("text") or "") for part in parts)
+        trace.add_span("event", "event", now, now, author=event.get("author"), parts=event_parts(event),
+                       partial=bool(event.get("partial")), text_chars=text_chars)
+        if segment["start"] is not None:
+            segment["events"] += 1
+            segment["text_chars"] += text_chars
+        for part in parts:
+            if "functionCall" in part:
+                call = part["functionCall"]
+                self._close_segment(now)
+                name = call.get("name", "unknown")
+                self.calls[call.get("id") or name] = (name, now)
+            elif "functionResponse" in part:
+                response = part["functionResponse"]
+                name = response.get("name", "unknown")
+                call = self.calls.pop(response.get("id") or name, None)
+                if call is not None:
+                    trace.add_span(call[0], "tool", call[1], now, call_id=response.get("id"))
+        if not self.calls and segment["start"] is None:
+            segment.update(start=now, events=0, text_chars=0)
+
+    def close(self):
+        end = self.trace.now()
+        for name, start in self.calls.values():
+            self.trace.add_span(name, "tool", start, end, unfinished=True)
+        self.calls = {}
+        self._close_segment(end)
+
+
+class TraceWriter:
+    """Appends sampled traces to this process's JSONL file"""
+
+    def __init__(self, directory, service, sample_rate=TRACE_SAMPLE_RATE, sample=random.random):
+        self.path = os.path.join(directory, f"{service}-{socket.gethostname()}-{os.getpid()}.jsonl")
+        self.sample_rate = sample_rate
+        self.sample = sample
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, records):
+        if self.sample_rate < 1 and self.sample() >= self.sample_rate:
+            return False
+        lines = "".join(json.dumps(record, default=str) + "\n" for record in records)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+        return True
+
+
+writer = None
+
+
+def configure(service, directory=TRACE_DIR, sample_rate=TRACE_SAMPLE_RATE):
+    """Write traces for `service` to `directory`; tracing stays off when it is empty"""
+    global writer
+    writer = TraceWriter(directory, service, sample_rate) if directory else None
+    return writer
+
+
+def export(records):
+    if writer is not None:
+        writer.write(records)
+
+
+# --- Report ---
+
+def load_traces(paths):
+    """{trace id: [span records]} from JSONL trace files"""
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    traces[record["trace_id"]].append(record)
+    return traces
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def histogram(values, edges=HISTOGRAM_EDGES_MS):
+    """Counts per bucket: values <= each edge, then the overflow"""
+    counts = [0] * (len(edges) + 1)
+    for value in values:
+        counts[next((i for i, edge in enumerate(edges) if value <= edge), len(edges))] += 1
+    return counts
+
+
+def latency_summary(values):
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values), 1) if values else None,
+        "p50_ms": percentile(values, 50),
+        "p95_ms": percentile(values, 95),
+        "p99_ms": percentile(values, 99),
+        "histogram": histogram(values),
+    }
+
+
+def time_split(spans):
+    """{"tool.<name>" | "generation" | "setup": ms} for one trace"""
+    split = defaultdict(float)
+    for span in spans:
+        if span["kind"] == "tool":
+            split[f"tool.{span['name']}"] += span["duration_ms"]
+        elif span["kind"] == "generation":
+            split["generation"] += span["duration_ms"]
+        elif span["kind"] == "phase":
+            split["setup"] += span["duration_ms"]
+    return split
+
+
+def summarize(traces, slowest=0.05):
+    """Latency distributions per tool, for generation and for requests, and the time split of the slowest requests"""
+    durations = defaultdict(list)
+    requests = []
+    for spans in traces.values():
+        for span in spans:
+            if span["kind"] == "tool":
+                durations[f"tool.{span['name']}"].append(span["duration_ms"])
+            elif span["kind"] == "generation":
+                durations["generation"].append(span["duration_ms"])
+            elif span["kind"] == "request":
+                requests.append((span["duration_ms"], time_split(spans)))
+    durations["request"] = [total for total, _ in requests]
+
+    def shares(selected):
+        total = sum(t for t, _ in selected)
+        combined = defaultdict(float)
+        for _, split in selected:
+            for name, ms in split.items():
+                combined[name] += ms
+        return {name: round(ms / total, 3) for name, ms in sorted(combined.items())} if total else {}
+
+    requests.sort(key=lambda item: item[0], reverse=True)
+    tail = requests[:max(1, int(len(requests) * slowest))] if requests else []
+    return {
+        "traces": len(traces),
+        "latency": {name: latency_summary(values) for name, values in sorted(durations.items())},
+        "share_all": shares(requests),
+        "share_slowest": shares(tail),
+        "slowest_count": len(tail),
+    }
+
+
+def print_summary(summary, out=None):
+    out = out or sys.stdout
+    labels = [f"<={edge}" for edge in HISTOGRAM_EDGES_MS] + [f">{HISTOGRAM_EDGES_MS[-1]}"]
+    print(f"{summary['traces']} traces", file=out)
+    for name, stats in summary["latency"].items():
+        if not stats["count"]:
+            continue
+        print(f"\n{name}: n={stats['count']} mean={stats['mean_ms']} ms p50={stats['p50_ms']} "
+              f"p95={stats['p95_ms']} p99={stats['p99_ms']}", file=out)
+        peak = max(stats["histogram"])
+        for label, count in zip(labels, stats["histogram"]):
+            if count:
+                bar = "#" * max(1, round(count / peak * HISTOGRAM_WIDTH))
+                print(f"  {label:>8} ms {count:>7} {bar}", file=out)
+    for title, key in (("all requests", "share_all"), (f"slowest {summary['slowest_count']} requests", "share_slowest")):
+        if summary[key]:
+            split = ", ".join(f"{name} {share:.0%}" for name, share in summary[key].items())
+            print(f"\nTime split, {title}: {split}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="JSONL trace files")
+    parser.add_argument("--slowest", type=float, default=0.05, help="fraction of requests counted as the tail")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args(argv)
+    summary = summarize(load_traces(args.paths), args.slowest)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
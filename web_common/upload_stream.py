@@ -0,0 +1,113 @@
+"""
+Incremental reading of batch uploads.
+
+Flask's request.files parses the whole multipart body before the view runs,
+spooling anything over 500 KB to a temporary file. For a multi-hundred-MB
+raw-log batch that means a second copy on disk and no row queued until the
+last byte has arrived. `open_upload()` reads request.stream in
+UPLOAD_CHUNK_BYTES chunks through werkzeug's sans-IO MultipartDecoder
+instead. It returns the file field as a text stream that yields data as soon
+as it arrives, holding about one chunk in memory at a time. Nothing touches
+the disk.
+
+The view must not touch request.files or request.form first, since either
+would consume the body.
+"""
+
+import io
+import os
+import csv
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(64 * 1024)))
+# A single raw log can be far larger than the csv module's 128 KB default field limit
+UPLOAD_MAX_FIELD_CHARS = int(os.getenv("UPLOAD_MAX_FIELD_CHARS", str(16 * 1024 * 1024)))
+
+csv.field_size_limit(max(csv.field_size_limit(), UPLOAD_MAX_FIELD_CHARS))
+
+
+class UploadError(ValueError):
+    """The request has no usable file upload; answered with 400"""
+
+
+class MultipartFileReader(io.RawIOBase):
+    """Raw bytes of one file field of a multipart body, read from `stream` as they arrive"""
+
+    def __init__(self, stream, boundary, field="file", chunk_size=UPLOAD_CHUNK_BYTES):
+        self._stream = stream
+        self._decoder = MultipartDecoder(boundary)
+        self._field = field
+        self._chunk_size = chunk_size
+        self._pending = b""
+        self._in_file = False
+        self._done = False
+        self.filename = None
+        self.bytes_received = 0
+
+    def readable(self):
+        return True
+
+    def _event(self):
+        try:
+            event = self._decoder.next_event()
+            while isinstance(event, NeedData):
+                chunk = self._stream.read(self._chunk_size)
+                self.bytes_received += len(chunk)
+                self._decoder.receive_data(chunk or None)
+                event = self._decoder.next_event()
+        except ValueError as e:
+            # Also what a body cut short by a disconnecting client looks like
+            raise UploadError(f"Malformed multipart upload: {e}") from e
+        return event
+
+    def find_file(self):
+        """Consume the body up to the start of the file field; returns its filename"""
+        while True:
+            event = self._event()
+            if isinstance(event, File) and event.name == self._field:
+                self._in_file = True
+                self.filename = event.filename
+                return self.filename
+            if isinstance(event, Epilogue):
+                raise UploadError("No file uploaded")
+
+    def _next_data(self):
+        while not self._done:
+            event = self._event()
+            if isinstance(event, Data):
+                if not event.more_data:
+                    self._done = True
+                if event.data:
+                    return event.data
+            elif isinstance(event, (Field, File, Epilogue)):
+                self._done = True
+        return b""
+
+    def readinto(self, buffer):
+        if not self._in_file:
+            self.find_file()
+        if not self._pending:
+            self._pending = self._next_data()
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+def open_upload(request, field="file", encoding="utf-8"):
+    """
+    (filename, text stream) for the `field` file of a multipart request,
+    decoded as it is read. Raises UploadError when there is no such file.
+    """
+    mimetype, options = parse_options_header(request.content_type or "")
+    boundary = options.get("boundary")
+    if mimetype != "multipart/form-data" or not boundary:
+        raise UploadError("No file uploaded")
+    reader = MultipartFileReader(request.stream, boundary.encode(), field)
+    filename = reader.find_file()
+    if not filename:
+        raise UploadError("Empty filename")
+    text = io.TextIOWrapper(io.BufferedReader(reader, UPLOAD_CHUNK_BYTES), encoding=encoding, newline="")
+    return filename, text
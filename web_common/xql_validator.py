@@ -0,0 +1,307 @@
+"""
+Offline XQL checks for answers of the SPL->XQL engine, with one repair turn.
+
+A bad translation used to surface only when an analyst pasted it into XSIAM.
+validate() checks one XQL query locally, in well under a millisecond:
+
+  - quotes, parentheses and brackets are closed
+  - no stage is empty (`| |`, a trailing pipe)
+  - the query starts with dataset / preset / datamodel / call (after any
+    config stages) and every stage name is an XQL stage
+  - limit takes a number, sort starts with asc/desc, comp aggregates
+    something, dataset/preset are followed by = or in
+  - every function called is an XQL function; join/union subqueries are
+    checked the same way
+SPL left in the translation (stats, eval, where, dc(), strftime(), ...) is
+reported with the XQL to use instead.
+
+review() is the post-processing stage the apps run on every spl answer. It
+finds the XQL in the answer: ``` blocks that hold a query, or the whole
+answer when it is one. When there are errors, it sends the engine a single
+repair prompt in the same session, naming the failing queries and their
+errors. The repaired answer is kept only if its XQL has fewer errors. The
+report that comes back ({"valid", "errors", "repaired"}) is returned to the
+caller; it is None when the answer holds no XQL or passed.
+
+XQL_VALIDATION=false turns the stage off, XQL_REPAIR=false reports without
+repairing, and XQL_EXTRA_FUNCTIONS (comma-separated) accepts functions added
+to XQL after this list was written.
+"""
+
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+XQL_VALIDATION = os.getenv("XQL_VALIDATION", "true").lower() == "true"
+XQL_REPAIR = os.getenv("XQL_REPAIR", "true").lower() == "true"
+
+SOURCE_STAGES = {"dataset", "preset", "datamodel", "call"}
+STAGES = SOURCE_STAGES | {
+    "config", "alter", "arrayexpand", "bin", "comp", "dedup", "fields", "filter", "getrole", "iploc", "join",
+    "limit", "replacenull", "sort", "tag", "target", "top", "transaction", "union", "view", "windowcomp",
+}
+FUNCTIONS = {
+    # aggregates and window functions
+    "approx_count", "approx_quantiles", "approx_top", "avg", "count", "count_distinct", "earliest", "first",
+    "first_value", "last", "last_value", "latest", "list", "max", "median", "min", "stddev_population",
+    "stddev_sample", "sum", "values", "var", "rank", "dense_rank", "row_number", "lag", "lead", "percent_rank",
+    "cume_dist", "ntile",
+    # math
+    "add", "subtract", "multiply", "divide", "pow", "round", "floor", "ceil", "ceiling", "abs",
+    # strings and conversions
+    "coalesce", "concat", "convert_from_base_64", "format_string", "if", "len", "lowercase", "uppercase", "ltrim",
+    "rtrim", "trim", "regexcapture", "regextract", "replace", "replex", "split", "string_count", "substring",
+    "to_boolean", "to_float", "to_integer", "to_json_string", "to_number", "to_string", "wildcard_match",
+    "json_extract", "json_extract_array", "json_extract_scalar", "json_extract_scalar_array",
+    # arrays and objects
+    "array_all", "array_any", "array_length", "arrayconcat", "arraycreate", "arraydistinct", "arrayfilter",
+    "arrayindex", "arrayindexof", "arraymap", "arraymerge", "arrayrange", "arraystring", "object_create",
+    "object_merge",
+    # time
+    "current_time", "date_floor", "extract_time", "format_timestamp", "parse_epoch", "parse_timestamp",
+    "timestamp_diff", "timestamp_seconds", "to_epoch", "to_timestamp",
+    # network and URLs
+    "extract_url_host", "extract_url_pub_suffix", "extract_url_registered_domain", "incidr", "incidr6",
+    "incidrlist", "int_to_ip", "ip_to_int", "is_ipv4", "is_ipv6", "is_known_private_ipv4", "is_known_private_ipv6",
+} | {name.strip().lower() for name in os.getenv("XQL_EXTRA_FUNCTIONS", "").split(",") if name.strip()}
+# Words that may precede a parenthesis without being a function call
+KEYWORDS = {"and", "or", "not", "in", "contains", "as", "by"}
+# SPL commands and functions an engine tends to leave in a translation, with their XQL counterpart
+SPL_COMMANDS = {
+    "search": "filter", "where": "filter", "eval": "alter", "stats": "comp", "eventstats": "windowcomp",
+    "streamstats": "windowcomp", "table": "fields", "head": "limit", "tail": "sort + limit", "rename": "alter",
+    "rex": "alter with regextract()", "timechart": "bin + comp", "chart": "comp", "lookup": "join",
+    "index": "dataset", "sourcetype": "dataset", "tstats": "comp", "fillnull": "replacenull", "spath": "json_extract()",
+    "mvexpand": "arrayexpand", "append": "union", "inputlookup": "dataset",
+}
+SPL_FUNCTIONS = {
+    "dc": "count_distinct", "distinct_count": "count_distinct", "strftime": "format_timestamp",
+    "strptime": "parse_timestamp", "now": "current_time", "mvcount": "array_length", "mvindex": "arrayindex",
+    "mvjoin": "arraystring", "mvappend": "arrayconcat", "lower": "lowercase", "upper": "uppercase",
+    "tostring": "to_string", "tonumber": "to_number", "isnull": "= null", "isnotnull": "!= null", "match": "~=",
+    "like": "~= or wildcard_match", "cidrmatch": "incidr", "case": "if", "stdev": "stddev_sample",
+}
+
+_TOKEN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<field>`[^`]*`)
+  | (?P<unterminated>["'`]|/\*)
+  | (?P<number>\d+(?:\.\d+)?[A-Za-z]*)
+  | (?P<word>[A-Za-z_][\w.]*)
+  | (?P<op>~=|!=|<=|>=|->|[=<>|(),\[\]{}+\-*/%:!])
+  | (?P<other>.)
+""", re.S | re.X)
+_PAIRS = {"(": ")", "[": "]", "{": "}"}
+_FENCE = re.compile(r"```([\w-]*)[ \t]*\n(.*?)```", re.S)
+
+
+def tokenize(query):
+    """[(kind, text)] without whitespace and comments"""
+    return [(m.lastgroup, m.group()) for m in _TOKEN.finditer(query) if m.lastgroup not in ("space", "comment")]
+
+
+def _starts_query(tokens):
+    return bool(tokens) and tokens[0][0] == "word" and tokens[0][1].lower() in SOURCE_STAGES | {"config"}
+
+
+def _stages(tokens):
+    """Split at top-level pipes"""
+    stages, current, depth = [], [], 0
+    for token in tokens:
+        if token[1] in _PAIRS:
+            depth += 1
+        elif token[1] in _PAIRS.values():
+            depth -= 1
+        if token[1] == "|" and depth == 0:
+            stages.append(current)
+            current = []
+        else:
+            current.append(token)
+    stages.append(current)
+    return stages
+
+
+def _groups(tokens):
+    """Contents of the top-level parenthesized groups in `tokens`"""
+    groups, depth, start = [], 0, None
+    for i, (_, text) in enumerate(tokens):
+        if text == "(":
+            depth += 1
+            if depth == 1:
+                start = i + 1
+        elif text == ")":
+            depth -= 1
+            if depth == 0:
+                groups.append(tokens[start:i])
+    return groups
+
+
+def _check_structure(tokens):
+    stack = []
+    for kind, text in tokens:
+        if kind == "unterminated":
+            return [f"unterminated {'comment' if text == '/*' else text + ' quote'}"]
+        if text in _PAIRS:
+            stack.append(text)
+        elif text in _PAIRS.values():
+            if not stack or _PAIRS[stack.pop()] != text:
+                return [f"unbalanced '{text}'"]
+    return [f"unclosed '{stack[-1]}'"] if stack else []
+
+
+def _check_stage(number, name, args):
+    where = f"stage {number} ({name})"
+    if not args:
+        return [f"{where}: has no arguments"]
+    first = args[0][1].lower()
+    if name == "limit" and not (len(args) == 1 and args[0][1].isdigit()):
+        return [f"{where}: expects a row count"]
+    if name == "sort" and first not in ("asc", "desc"):
+        return [f"{where}: must start with asc or desc"]
+    if name in ("dataset", "preset") and first not in ("=", "in"):
+        return [f"{where}: expects = or in"]
+    if name == "comp" and not any(text == "(" for _, text in args):
+        return [f"{where}: has no aggregate function"]
+    return []
+
+
+def _check_pipeline(tokens, prefix=""):
+    errors = []
+    started = False
+    for number, stage in enumerate(_stages(tokens), 1):
+        if not stage:
+            errors.append(f"{prefix}stage {number} is empty")
+            continue
+        kind, text = stage[0]
+        name = text.lower()
+        if kind != "word" or name not in STAGES:
+            hint = SPL_COMMANDS.get(name)
+            errors.append(f"{prefix}stage {number}: '{text}' is not an XQL stage"
+                          + (f" (SPL; use {hint})" if hint else ""))
+            continue
+        if not started and name not in SOURCE_STAGES and name != "config":
+            errors.append(f"{prefix}stage {number} ({name}): the query must start with dataset, preset, "
+                          f"datamodel or call")
+            started = True  # reported once
+        started = started or name in SOURCE_STAGES
+        errors.extend(prefix + error for error in _check_stage(number, name, stage[1:]))
+        if name in ("join", "union"):
+            for group in _groups(stage[1:]):
+                if _starts_query(group):
+                    errors.extend(_check_pipeline(group, prefix=f"{prefix}stage {number} subquery: "))
+    return errors
+
+
+def _check_functions(tokens):
+    errors = []
+    for (kind, text), after, inner in zip(tokens, tokens[1:], tokens[2:] + [("", "")]):
+        name = text.lower()
+        if kind != "word" or after[1] != "(" or name in FUNCTIONS or name in KEYWORDS or name in STAGES:
+            continue
+        if _starts_query([inner]):
+            continue  # a subquery, e.g. `join type = left (dataset = ...)`
+        hint = SPL_FUNCTIONS.get(name)
+        errors.append(f"'{text}()' is not an XQL function" + (f" (SPL; use {hint})" if hint else ""))
+    return errors
+
+
+def validate(query):
+    """Errors found in one XQL query; [] when it passes"""
+    tokens = tokenize(query)
+    if not tokens:
+        return ["the query is empty"]
+    errors = _check_structure(tokens)
+    if errors:
+        return errors  # stage checks on a broken token stream would only add noise
+    return _check_pipeline(tokens) + _check_functions(tokens)
+
+
+def answer_queries(answer):
+    """XQL queries in an engine answer: ``` blocks holding a query, else the whole answer if it is one"""
+    blocks = _FENCE.findall(answer)
+    if blocks:
+        return [body.strip() for lang, body in blocks
+                if lang.lower() == "xql" or _starts_query(tokenize(body)[:1])]
+    return [answer.strip()] if _starts_query(tokenize(answer)[:1]) else []
+
+
+def check_answer(answer):
+    """Errors of every XQL query in an answer, prefixed with the query's number when there are several"""
+    queries = answer_queries(answer)
+    if len(queries) == 1:
+        return validate(queries[0])
+    return [f"query {i}: {error}" for i, query in enumerate(queries, 1) for error in validate(query)]
+
+
+def repair_prompt(answer, errors, standalone=False):
+    """
+    Targeted follow-up asking the engine to fix the XQL of its last answer.
+    A standalone prompt quotes the whole answer, for a session that has not seen it.
+    """
+    problems = "\n".join(f"- {error}" for error in errors)
+    if standalone:
+        return (f"This answer to an SPL to XQL translation request has XQL that does not pass validation:\n"
+                f"{problems}\n\n----- answer -----\n{answer}\n----- end of answer -----\n\n"
+                f"Fix only these problems, using XQL stages and functions (no SPL), and return the full answer "
+                f"again in the same format.")
+    queries = "\n\n".join(f"```xql\n{query}\n```" for query in answer_queries(answer))
+    return (f"The XQL in your last answer does not pass validation:\n{problems}\n\n{queries}\n\n"
+            f"Fix only these problems, using XQL stages and functions (no SPL), and return the full answer "
+            f"again in the same format.")
+
+
+def _repair_failed(e):
+    logger.warning(f"XQL repair turn failed, keeping the original answer: {e}")
+
+
+def _settle(answer, errors, repaired):
+    """(answer, report) after one repair attempt"""
+    if repaired and answer_queries(repaired):
+        repaired_errors = check_answer(repaired)
+        if len(repaired_errors) < len(errors):
+            return repaired, {"valid": not repaired_errors, "errors": repaired_errors, "repaired": True}
+    return answer, {"valid": False, "errors": errors, "repaired": False}
+
+
+def _errors(engine_key, answer):
+    if engine_key != "spl" or not XQL_VALIDATION or not answer:
+        return []
+    return check_answer(answer)
+
+
+def review(engine_key, answer, ask=None, standalone=False):
+    """
+    (answer, report) for an engine answer. `ask(prompt)` sends the repair
+    prompt in the answer's session and returns the reply's text; it is called
+    at most once, and only for an spl answer whose XQL fails validation. If
+    it raises, the original answer stands. With `standalone`, the prompt
+    carries the whole answer, so `ask` may send it in any session.
+    """
+    errors = _errors(engine_key, answer)
+    if not errors:
+        return answer, None
+    repaired = None
+    if XQL_REPAIR and ask is not None:
+        try:
+            repaired = ask(repair_prompt(answer, errors, standalone))
+        except Exception as e:
+            _repair_failed(e)
+    return _settle(answer, errors, repaired)
+
+
+async def review_async(engine_key, answer, ask=None):
+    """review() for an async `ask`"""
+    errors = _errors(engine_key, answer)
+    if not errors:
+        return answer, None
+    repaired = None
+    if XQL_REPAIR and ask is not None:
+        try:
+            repaired = await ask(repair_prompt(answer, errors))
+        except Exception as e:
+            _repair_failed(e)
+    return _settle(answer, errors, repaired)